@@ -0,0 +1,221 @@
+"""Move query results as Arrow record batches rather than Python rows
+
+Read only tables don't need rows the model can edit in place, so their
+results can stay in Arrow's columnar buffers from the database to the
+view: the runner builds record batches, the model reads cells and column
+summaries straight from them, and the Parquet export writes the batches
+as they are.  DuckDB hands its results over as Arrow without any Python
+objects at all (see db.iterarrow).
+
+pyarrow is an optional dependency; without it everything falls back to
+lists of rows.
+"""
+import datetime
+from typing import Iterator, List, Optional, Sequence
+
+from custom_types import SqlDataType
+from export_sinks import to_date
+from schema import Field, FieldType, normalize_bool
+
+
+def available() -> bool:
+    """Can results be moved as Arrow?"""
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def arrow_schema(fields: List[Field]):
+    import pyarrow as pa
+    arrow_types = {
+        FieldType.bool: pa.bool_(),
+        FieldType.date: pa.date32(),
+        FieldType.float: pa.float64(),
+        FieldType.int: pa.int64(),
+        FieldType.str: pa.string(),
+    }
+    return pa.schema([
+        pa.field(fld.name, arrow_types[fld.dtype]) for fld in fields
+    ])
+
+
+CONVERTERS = {
+    FieldType.bool: normalize_bool,
+    FieldType.date: to_date,
+    FieldType.float: float,
+    FieldType.int: int,
+    FieldType.str: str,
+}
+
+
+def record_batch(fields: List[Field], rows: Sequence[Sequence[SqlDataType]],
+        schema=None):
+    """Build a record batch from rows, one column at a time
+
+    Empty strings and None are nulls; anything else is converted to the
+    field's type, the way the Parquet export always has.
+    """
+    import pyarrow as pa
+    schema = schema or arrow_schema(fields)
+    columns = list(zip(*rows)) if rows else [()] * len(fields)
+    arrays = [
+        pa.array(
+            [None if v is None or v == '' else CONVERTERS[fld.dtype](v) for v in col],
+            type=schema.types[i]
+        )
+        for i, (fld, col) in enumerate(zip(fields, columns))
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def conform(batch, schema):
+    """Rename and cast a record batch from another source, eg DuckDB, to
+    the fields' schema"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    return pa.RecordBatch.from_arrays([
+        col if col.type == typ else pc.cast(col, typ)
+        for col, typ in zip(batch.columns, schema.types)
+    ], schema=schema)
+
+
+def python_values(column) -> list:
+    """A column's values as the model's lists of rows hold them (see
+    FieldType.convert_column): dates as 'YYYY-MM-DD' strings and nulls as
+    the type's empty value"""
+    return list_compatible(column).to_pylist()
+
+
+def list_compatible(column):
+    """An Arrow column that compares and sorts like the model's lists"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pa.types.is_date(column.type):
+        column = pc.cast(column, pa.string())
+    if column.null_count:
+        column = pc.fill_null(column, empty_value(column.type))
+    return column
+
+
+def empty_value(arrow_type) -> SqlDataType:
+    """What FieldType.convert makes of a null of the Arrow type"""
+    import pyarrow as pa
+    if pa.types.is_boolean(arrow_type):
+        return False
+    if pa.types.is_floating(arrow_type):
+        return 0.0
+    if pa.types.is_integer(arrow_type):
+        return 0
+    return ''
+
+
+class ArrowRow:
+    """One row of an ArrowRows, whose cells are read as they are asked for"""
+
+    __slots__ = ('rows', 'index')
+
+    def __init__(self, rows: 'ArrowRows', index: int) -> None:
+        self.rows = rows
+        self.index = index
+
+    def __getitem__(self, col: int) -> SqlDataType:
+        return self.rows.value(self.index, col)
+
+    def __iter__(self) -> Iterator[SqlDataType]:
+        return (self[col] for col in range(self.rows.table.num_columns))
+
+    def __len__(self) -> int:
+        return self.rows.table.num_columns
+
+
+class ArrowRows:
+    """A read only sequence of rows over an Arrow table
+
+    Indexing returns a row whose cells are converted to Python values only
+    when they're read, so showing a page of a large result touches only
+    the visible cells.  Iterating converts a record batch at a time.  The
+    values are the ones the model's lists of rows hold, so the model's
+    filters compare them the same way.  Whole column operations (sorting,
+    totals, distinct values) should use column() and pyarrow.compute
+    instead.
+
+    The columns are combined into single arrays once, so reading a cell is
+    an index rather than a search through the chunks; a table that is
+    already one chunk, eg a memory-mapped cached result, isn't copied.
+    """
+
+    def __init__(self, table) -> None:
+        if any(col.num_chunks > 1 for col in table.columns):
+            table = table.combine_chunks()
+        self.table = table
+        self.arrays = [
+            col.chunk(0) if col.num_chunks == 1 else col.combine_chunks()
+            for col in table.columns
+        ]
+        self.empty_values = [empty_value(col.type) for col in self.arrays]
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __bool__(self) -> bool:
+        return self.table.num_rows > 0
+
+    def __getitem__(self, index: int) -> ArrowRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ArrowRow(self, index)
+
+    def __iter__(self) -> Iterator[tuple]:
+        for batch in self.table.to_batches():
+            yield from zip(*(python_values(col) for col in batch.columns))
+
+    def __deepcopy__(self, memo) -> 'ArrowRows':
+        return self  # immutable, so a copy can share the buffers
+
+    def column(self, col: int):
+        return self.arrays[col]
+
+    def unique(self, col: int) -> list:
+        """The distinct values of a column, as the model's lists hold them"""
+        return python_values(list_compatible(self.arrays[col]).unique())
+
+    def value(self, row: int, col: int) -> SqlDataType:
+        value = self.arrays[col][row].as_py()
+        if value is None:
+            return self.empty_values[col]
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return value
+
+    def take(self, indices) -> 'ArrowRows':
+        return ArrowRows(self.table.take(indices))
+
+    def sort(self, col: int, descending: bool = False) -> 'ArrowRows':
+        """A copy sorted on one column, in the order the model's lists sort:
+        empty values first, and descending is ascending reversed"""
+        import pyarrow.compute as pc
+        indices = pc.sort_indices(list_compatible(self.arrays[col]))
+        return self.take(indices[::-1] if descending else indices)
+
+    @classmethod
+    def from_batches(cls, batches: List, fields: List[Field],
+            schema=None) -> 'ArrowRows':
+        import pyarrow as pa
+        return cls(pa.Table.from_batches(batches, schema=schema or arrow_schema(fields)))
+
+
+def column_totals(rows: ArrowRows, col: int, dtype: FieldType) -> List[Optional[SqlDataType]]:
+    """The sum and mean, the min and max, or the distinct count of a column,
+    whichever the model's totals show for the field's type"""
+    import pyarrow.compute as pc
+    column = rows.column(col)
+    if dtype == FieldType.float:
+        total = pc.sum(column).as_py() or 0.0
+        return [total, total / len(rows) if len(rows) else 0]
+    if dtype == FieldType.date:
+        return [pc.min(column).as_py(), pc.max(column).as_py()]
+    return [pc.count_distinct(column, mode='all').as_py()]
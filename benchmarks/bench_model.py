@@ -0,0 +1,128 @@
+"""Time AbstractModel's grid operations without a display
+
+The model is driven directly under a QCoreApplication (with the offscreen
+platform requested for Qt builds that use QPA), filled with synthetic
+factSales rows, and each operation is timed with its peak memory.  The
+foreign key lookups are seeded in memory, so no database is needed.
+
+Operations:
+    update_view         load the rows into the model
+    data (viewport)     DisplayRole and TextAlignmentRole for one screen
+    scroll_paint        page through the grid one screen at a time, the
+                        way the view paints while the user scrolls
+    sort (float / fk)   sort by SalesAmount and by the Product label
+    filter_like         quick search over every column
+    filter_set          checkbox filter on the Customer column
+    distinct_values     the values listed in the right-click menu
+    field_totals        summary stats for every column
+    changes             diff after editing EDITED_ROWS rows
+    undo                restore the original rows
+
+Example:
+    python benchmarks/bench_model.py --sizes 10000 100000 1000000 --save model.json
+"""
+import os
+import random
+import sys
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import harness  # sets up sys.path
+
+from PyQt4 import QtCore
+from sortedcollections import ValueSortedDict
+
+from bulk_data import ColumnGenerator
+from config import cfg
+from model import AbstractModel
+from schema import convert_rows
+
+VIEWPORT_ROWS = 50
+EDITED_ROWS = 100  # setData scans modified_data, so keep this small
+
+
+def synthetic_rows(n: int, seed: int = 0) -> list:
+    """factSales rows with the same shape and skew as bulk_data generates,
+    with the foreign key labels registered on cfg"""
+    fact = cfg.star('factSales').fact
+    dimension_sizes = {dim: max(10, n // 100) for dim in fact.dimensions}
+    for dim, size in dimension_sizes.items():
+        cfg._foreign_keys[dim] = ValueSortedDict({
+            i: '{} {}'.format(dim, i) for i in range(1, size + 1)
+        })
+    generator = ColumnGenerator(random.Random(seed), dimension_sizes)
+    columns = [generator.column(fld, 1, n) for fld in fact.fields]
+    return convert_rows(fact.fields, list(zip(*columns)))
+
+
+def paint(model: AbstractModel, first_row: int) -> None:
+    """Ask for everything the view would paint for one screen of rows"""
+    for row in range(first_row, min(first_row + VIEWPORT_ROWS, model.rowCount())):
+        for col in range(model.columnCount()):
+            ix = model.index(row, col)
+            model.data(ix, QtCore.Qt.DisplayRole)
+            model.data(ix, QtCore.Qt.TextAlignmentRole)
+
+
+def scroll_paint(model: AbstractModel, rows: int) -> None:
+    model.rows_loaded = model.rows_per_page
+    for top in range(0, rows, VIEWPORT_ROWS):
+        while model.canFetchMore() and model.rowCount() < top + VIEWPORT_ROWS:
+            model.fetchMore()
+        paint(model, top)
+
+
+def run(n: int, repeat: int, scroll_rows: int) -> dict:
+    fact = cfg.star('factSales').fact
+    rows = synthetic_rows(n)
+    model = AbstractModel(table=fact)
+    fk_col = next(iter(fact.foreign_keys))
+    customer_col = list(fact.foreign_keys)[-1]
+    amount_col = next(i for i, f in enumerate(fact.fields) if f.name == 'SalesAmount')
+    results = {}
+
+    def timed(name, func):
+        results[name] = harness.measure(func, repeat, trace_memory=True)
+
+    timed('update_view', lambda: model.update_view(rows))
+
+    def fresh(func):
+        """Run func against an unfiltered, unsorted model"""
+        def wrapper():
+            model.reset()
+            func()
+        return wrapper
+
+    timed('data (viewport)', lambda: paint(model, 0))
+    timed('scroll_paint ({} rows)'.format(min(n, scroll_rows)),
+        lambda: scroll_paint(model, min(n, scroll_rows)))
+    timed('sort (float)', fresh(lambda: model.sort(amount_col, QtCore.Qt.AscendingOrder)))
+    timed('sort (fk)', fresh(lambda: model.sort(fk_col, QtCore.Qt.DescendingOrder)))
+    timed('filter_like', fresh(lambda: model.filter_like('12')))
+    wanted = set(list(model.distinct_values(customer_col))[:5])
+    timed('filter_set', fresh(lambda: model.filter_set(col=customer_col, values=wanted)))
+    timed('distinct_values', fresh(lambda: model.distinct_values(customer_col)))
+    timed('field_totals', fresh(lambda: [
+        model.field_totals(c) for c in range(model.columnCount())
+    ]))
+
+    model.reset()
+    for row in random.Random(1).sample(range(model.rowCount()), min(model.rowCount(), EDITED_ROWS)):
+        model.setData(model.index(row, amount_col), 1.0)
+    timed('changes', lambda: model.changes)
+    timed('undo', model.undo)
+    return results
+
+
+def main(argv=None) -> int:
+    p = harness.parser(__doc__.splitlines()[0], [10000, 100000, 1000000])
+    p.add_argument('--scroll-rows', type=int, default=10000,
+        help='rows to page through in scroll_paint')
+    args = p.parse_args(argv)
+    app = QtCore.QCoreApplication(sys.argv[:1])
+    results = {str(n): run(n, args.repeat, args.scroll_rows) for n in args.sizes}
+    return harness.report(results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
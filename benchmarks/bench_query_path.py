@@ -0,0 +1,123 @@
+"""Time the query and data path against generated warehouses
+
+Stages:
+    star_query      build the factSales star query with filters set
+    fetch_display   db.fetch of the display query (maximum_display_rows)
+    fetch_all       db.fetch of every fact row
+    pull            QueryRunnerThread.pull of every fact row: the fetch
+                    plus the conversion the runner does before handing the
+                    rows to QueryManager.process_results
+    transaction     update 1,000 fact rows in one Transaction and commit
+    export_csv      ExportSqlThread.export of every row to CSV
+    export_xlsx     the same for the Excel sink
+
+The runner and exporter threads are driven directly on this thread under a
+QCoreApplication, so their own batch sizes and progress signals are what's
+timed.
+
+Example:
+    python benchmarks/bench_query_path.py --sizes 10000 100000 --save base.json
+    python benchmarks/bench_query_path.py --sizes 10000 100000 --compare base.json
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import harness  # sets up sys.path
+
+from PyQt4 import QtCore
+from sqlalchemy import create_engine
+
+from config import cfg
+import db
+from export_sinks import CsvSink, XlsxSink
+from query_exporter import ExportSqlThread
+from query_runner import QueryRunnerThread
+
+TRANSACTION_ROWS = 1000
+
+
+def use_database(path: str) -> None:
+    db.engine = create_engine('sqlite:///' + path)
+
+
+def export(query, fields, sink: type, path: str) -> None:
+    headers = [fld.display_name for fld in fields]
+    thread = ExportSqlThread(query, fields, headers, sink=sink)
+    thread.export(path, time.time())
+
+
+def pull(query, table) -> list:
+    """Run the runner thread's pull and return the rows it hands on"""
+    results, errors = [], []
+    thread = QueryRunnerThread(query, table)
+    thread.signals.results.connect(results.append)
+    thread.signals.error.connect(errors.append)
+    thread.pull()
+    if errors:
+        raise RuntimeError(errors[0])
+    return results[0]
+
+
+def run(rows: int, repeat: int) -> dict:
+    path = harness.bench_db(rows)
+    use_database(path)
+    star = cfg.star('factSales')
+    fields = star.fact.fields
+    display = star.select(max_rows=cfg.app.maximum_display_rows)
+    everything = star.select(max_rows=rows)
+    results = {}
+
+    def build_star_query():
+        for flt in star.filters:
+            if flt.display_name == 'Order Date On or After':
+                flt.value = '2012-01-01'
+        try:
+            for _ in range(100):
+                star.star_query
+        finally:
+            for flt in star.filters:
+                flt.value = ''
+
+    results['star_query (x100)'] = harness.measure(build_star_query, repeat)
+    results['fetch_display'] = harness.measure(lambda: db.fetch(display), repeat)
+    results['fetch_all'] = harness.measure(lambda: db.fetch(everything), repeat, True)
+    results['pull'] = harness.measure(lambda: pull(everything, star.fact), repeat, True)
+
+    converted = pull(star.select(max_rows=TRANSACTION_ROWS), star.fact)
+    scratch = os.path.join(harness.DATA_DIR, 'scratch.db')
+    shutil.copyfile(path, scratch)
+    use_database(scratch)
+
+    def save():
+        trans = db.Transaction()
+        for row in converted:
+            trans.execute(star.fact.update_row(pk=row[0], values=list(row)))
+        trans.commit()
+
+    results['transaction ({} rows)'.format(TRANSACTION_ROWS)] = harness.measure(save, repeat)
+    use_database(path)
+    os.remove(scratch)
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        for name, sink in (('export_csv', CsvSink), ('export_xlsx', XlsxSink)):
+            out = os.path.join(out_dir, 'export' + sink.extension)
+            results[name] = harness.measure(
+                lambda: export(everything, fields, sink, out), repeat, True)
+    finally:
+        shutil.rmtree(out_dir)
+    return results
+
+
+def main(argv=None) -> int:
+    args = harness.parser(__doc__.splitlines()[0], [10000, 100000]).parse_args(argv)
+    app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication(sys.argv)
+    results = {str(n): run(n, args.repeat) for n in args.sizes}
+    return harness.report(results, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Shared helpers for the benchmark scripts in this folder
+
+Each script times a set of named stages at several data sizes, can save the
+results as a JSON baseline, and can compare a run against a saved baseline,
+failing when any stage got slower than the allowed threshold.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+
+Results = Dict[str, Dict[str, Dict[str, float]]]  # size -> stage -> measures
+
+
+def measure(func: Callable, repeat: int = 3, trace_memory: bool = False) -> Dict[str, float]:
+    """Best wall time of repeat calls, and optionally the peak memory of one"""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    result = {'seconds': best}
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def bench_db(rows: int, seed: int = 0) -> str:
+    """Path to a generated warehouse with the given number of fact rows,
+    built on first use and reused after that"""
+    from bulk_data import generate
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, 'bench_{}_{}.db'.format(rows, seed))
+    if not os.path.exists(path):
+        generate(db_path=path + '.tmp', fact_rows=rows, seed=seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def regressions(results: Results, baseline: Results,
+        threshold: float) -> List[Tuple[str, str, float, float]]:
+    """The (size, stage, baseline, current) of every stage that slowed down
+    by more than threshold (0.2 = 20%)"""
+    slower = []
+    for size, stages in results.items():
+        for stage, measures in stages.items():
+            before = baseline.get(size, {}).get(stage, {}).get('seconds')
+            now = measures['seconds']
+            if before and now > before * (1 + threshold):
+                slower.append((size, stage, before, now))
+    return slower
+
+
+def parser(description: str, default_sizes: List[int]) -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('--sizes', type=int, nargs='+', default=default_sizes,
+        help='fact rows in each generated database')
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--save', metavar='JSON', help='save the results as a baseline')
+    p.add_argument('--compare', metavar='JSON', help='baseline to compare against')
+    p.add_argument('--threshold', type=float, default=0.25,
+        help='allowed slowdown before a stage counts as a regression')
+    return p
+
+
+def report(results: Results, args: argparse.Namespace) -> int:
+    """Print the results, save/compare baselines and return an exit code"""
+    for size, stages in results.items():
+        print('{:>12,} rows'.format(int(size)))
+        for stage, measures in stages.items():
+            extra = ''
+            if 'peak_mb' in measures:
+                extra = '  peak {:8.1f} MB'.format(measures['peak_mb'])
+            print('    {:<28} {:10.4f} s{}'.format(stage, measures['seconds'], extra))
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, fh, indent=2, sort_keys=True)
+        print('baseline saved to {}'.format(args.save))
+
+    if args.compare:
+        with open(args.compare, 'r') as fh:
+            baseline = json.load(fh)['results']
+        slower = regressions(results, baseline, args.threshold)
+        for size, stage, before, now in slower:
+            print('REGRESSION {} rows {}: {:.4f}s -> {:.4f}s (+{:.0%})'.format(
+                size, stage, before, now, now / before - 1))
+        if slower:
+            return 1
+        print('no stage regressed by more than {:.0%}'.format(args.threshold))
+    return 0
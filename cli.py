@@ -0,0 +1,159 @@
+"""Run the app's star and dimension queries from the command line.
+
+This is the headless counterpart to main.py: it loads the same config, so
+scheduled extracts can run under cron without Qt or a display.
+
+Examples:
+    python cli.py --list
+    python cli.py factSales --filter "Order Date On or After=2016-01-01" > sales.csv
+    python cli.py Customers --filters-json filters.json --format parquet -o customers.parquet
+    python cli.py factSales --group-by OrderDate --aggregate sum:SalesAmount > daily.csv
+
+Aggregates over a fact are read from one of its rollups when one covers
+the grouping, the aggregates and the filters.
+"""
+import argparse
+from contextlib import closing
+import json
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from config import cfg
+from db import iterarrow, iterbatches
+from export_sinks import SINKS
+from schema import Fact, criteria_applied, select_with_criteria
+
+FORMATS = {sink.extension.lstrip('.'): sink for sink in SINKS.values()}
+STDOUT_FORMATS = ['csv', 'csv.gz', 'tsv', 'tsv.gz']
+
+
+def parse_criteria(filters: List[str], filters_json: str=None) -> Dict[str, str]:
+    """Combine --filters-json with --filter 'Display Name=value' arguments
+
+    Filters given on the command line override the ones in the file.
+
+    Example:
+    >>> parse_criteria(['Order Date On or After=2016-01-01', 'Product Like=a=b'])
+    {'Order Date On or After': '2016-01-01', 'Product Like': 'a=b'}
+    """
+    criteria = {}  # type: Dict[str, str]
+    if filters_json:
+        with open(filters_json, 'r') as fh:
+            criteria.update({k: str(v) for k, v in json.load(fh).items()})
+    for f in filters:
+        name, sep, value = f.partition('=')
+        if not sep:
+            raise ValueError("Filters must look like 'Display Name=value', got {}".format(f))
+        criteria[name.strip()] = value
+    return criteria
+
+
+def parse_aggregates(aggregates: List[str]) -> List[Tuple[str, str]]:
+    """Split 'function:Field' arguments; a bare function counts the rows
+
+    Example:
+    >>> parse_aggregates(['sum:SalesAmount', 'count'])
+    [('sum', 'SalesAmount'), ('count', '*')]
+    """
+    pairs = []
+    for agg in aggregates:
+        function, _, field = agg.partition(':')
+        pairs.append((function.strip().lower(), field.strip() or '*'))
+    return pairs
+
+
+def list_tables() -> None:
+    for tbl in cfg.tables:
+        source = cfg.star(tbl.table_name) if isinstance(tbl, Fact) else tbl
+        print('{} ({})'.format(tbl.table_name, tbl.display_name))
+        for flt in source.filters:
+            print('    {}'.format(flt.display_name))
+
+
+def run(*, table: str, criteria: Dict[str, str], export_format: str,
+        output: str, max_rows: int, group_by: List[str]=None,
+        aggregates: List[Tuple[str, str]]=None) -> int:
+    """Stream the filtered query to output and return the rows written"""
+    tbl = cfg.table(table)
+    source = cfg.star(tbl.table_name) if isinstance(tbl, Fact) else tbl
+    fields = tbl.fields
+    if group_by or aggregates:
+        if not isinstance(tbl, Fact):
+            raise ValueError('Only facts can be aggregated')
+        with criteria_applied(source, criteria):
+            qry = source.aggregate_query(group_by or [], aggregates or []) \
+                .limit(max_rows)
+        fields = source.aggregate_fields(group_by or [], aggregates or [])
+    else:
+        qry = select_with_criteria(source, criteria, max_rows=max_rows)
+    sink = FORMATS[export_format](
+        output,
+        fields=fields,
+        headers=[fld.display_name for fld in fields]
+    )
+    if sink.writes_arrow:
+        results, write = iterarrow(qry, fields), sink.write_batch
+    else:
+        results, write = iterbatches(qry), sink.write_rows
+    try:
+        with closing(results):
+            for batch in results:
+                write(batch)
+    finally:
+        sink.close()
+    return sink.rows_written
+
+
+def main(argv: List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('table', nargs='?',
+        help='table name or display name of a fact (star) or dimension')
+    parser.add_argument('-f', '--filter', action='append', default=[],
+        metavar='"NAME=VALUE"', help='filter value, by filter display name')
+    parser.add_argument('--filters-json',
+        help='json file mapping filter display names to values')
+    parser.add_argument('--format', default='csv', choices=sorted(FORMATS),
+        dest='export_format')
+    parser.add_argument('-o', '--output', default='-',
+        help="output file, or '-' for stdout (text formats only)")
+    parser.add_argument('-g', '--group-by', action='append', default=[],
+        metavar='FIELD', help='aggregate a fact, grouped by this field')
+    parser.add_argument('-a', '--aggregate', action='append', default=[],
+        metavar='FUNCTION[:FIELD]',
+        help='aggregate to compute, eg sum:SalesAmount; count alone counts rows')
+    parser.add_argument('--max-rows', type=int, default=cfg.app.maximum_export_rows)
+    parser.add_argument('--list', action='store_true',
+        help='list the tables and their filters')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        list_tables()
+        return 0
+    if not args.table:
+        parser.error('a table is required unless --list is given')
+    if args.output == '-' and args.export_format not in STDOUT_FORMATS:
+        parser.error('{} output needs a file; use --output'.format(args.export_format))
+
+    try:
+        start_time = time.time()
+        rows = run(
+            table=args.table,
+            criteria=parse_criteria(args.filter, args.filters_json),
+            export_format=args.export_format,
+            output=args.output,
+            max_rows=args.max_rows,
+            group_by=args.group_by,
+            aggregates=parse_aggregates(args.aggregate)
+        )
+    except (KeyError, ValueError) as e:
+        print('Error: {}'.format(e), file=sys.stderr)
+        return 1
+    seconds = time.time() - start_time
+    print('{:,} rows in {:.1f} seconds ({:,.0f} rows/sec)'.format(
+        rows, seconds, rows / max(seconds, 0.001)), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,7 @@ from schema import (
     FieldType,
     ForeignKey,
     Operator,
+    Rollup,
     SummaryField,
 )
 
@@ -17,7 +18,11 @@ class App:
         db_path: str,
         display_name: str,
         maximum_display_rows: int,
-        maximum_export_rows: int
+        maximum_export_rows: int,
+        export_partitions: int = 1,
+        slow_query_seconds: float = 1.0,
+        result_cache_folder: str = None,
+        result_cache_mb: int = 512
     ) -> None:
 
         self.color_scheme = color_scheme
@@ -25,6 +30,10 @@ class App:
         self.display_name = display_name
         self.maximum_display_rows = maximum_display_rows
         self.maximum_export_rows = maximum_export_rows
+        self.export_partitions = export_partitions  # parallel key ranges per export
+        self.slow_query_seconds = slow_query_seconds  # log queries slower than this
+        self.result_cache_folder = result_cache_folder  # None turns the cache off
+        self.result_cache_mb = result_cache_mb  # least recently used evicted beyond this
 
 
 cfg = Constellation(
@@ -34,6 +43,10 @@ cfg = Constellation(
         , db_path='sqlite:///test.db'
         , maximum_display_rows=10000
         , maximum_export_rows=500000
+        , export_partitions=1
+        , slow_query_seconds=1.0
+        , result_cache_folder=None  # eg 'cache' to keep results on disk
+        , result_cache_mb=512
     ),
     dimensions=[
         Dimension(
@@ -158,6 +171,23 @@ cfg = Constellation(
                     filter_operators=[
                     ]
                 ),
+            ],
+            rollups=[
+                Rollup(
+                    table_name='factSales_by_day',
+                    group_by=['OrderDate'],
+                    measures=['SalesAmount']
+                ),
+                Rollup(
+                    table_name='factSales_by_product',
+                    group_by=['ProductID', 'OrderDate'],
+                    measures=['SalesAmount']
+                ),
+                Rollup(
+                    table_name='factSales_by_customer',
+                    group_by=['CustomerID', 'OrderDate'],
+                    measures=['SalesAmount']
+                ),
             ]
         )
     ]
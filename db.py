@@ -3,21 +3,366 @@
 All of the code in other modules interfaces with the database through the
 classes and functions in this module."""
 
-from typing import Generator, List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import glob
+import os
+import threading
+from typing import Callable, Dict, Generator, List, Optional, Sequence, Set, Tuple, Union
 
 from sqlalchemy.sql import Select
-from sqlalchemy import create_engine
-from sqlalchemy.sql import Delete, Insert, Update
+from sqlalchemy import create_engine, event, func, inspect, select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Compiled
+from sqlalchemy.sql import Delete, Insert, Update, operators, sqltypes, visitors
+from sqlalchemy.sql.elements import ClauseElement, UnaryExpression
+from sqlalchemy.sql.schema import Table
 
 from config import cfg
-from logger import log_error
+from logger import log_error, slow_query_log
+from query_timer import QueryTimer
+from schema import rollup_watermarks
 
-engine = create_engine(cfg.app.db_path, echo=False)
+engine = None  # created by get_engine on first use, or assigned by tests
+_engine_lock = threading.Lock()
+_table_names = {}  # type: Dict[object, Set[str]]
+_shard_engines = {}  # type: Dict[str, object]
+_columnar_connections = {}  # type: Dict[str, object]
+
+
+def get_engine():
+    """Return the app's engine, creating it the first time it's needed
+
+    Nothing connects to the database until the first query, so importing
+    this module (and starting the app) doesn't wait on the database.
+    """
+    global engine
+    if engine is None:
+        with _engine_lock:
+            if engine is None:
+                engine = create_engine(cfg.app.db_path, echo=False)
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'before_execute', attach_partitions)
+    return engine
+
+
+def has_table(table_name: str) -> bool:
+    """Whether the database has the table, looked up once per engine
+
+    Like filters on full_text fields ask this before reading a table's
+    FTS index, which only exists once `python maintenance.py fts` has run.
+    """
+    current = get_engine()
+    if current not in _table_names:
+        _table_names[current] = set(inspect(current).get_table_names())
+    return table_name in _table_names[current]
+
+
+def forget_table_names(current) -> None:
+    """Look the engine's tables up again the next time has_table is asked"""
+    _table_names.pop(current, None)
+
+
+# SQLITE_MAX_ATTACHED, unless SQLite was compiled with a higher limit
+MAX_ATTACHED = 10
+
+
+def partition_files() -> Dict[str, str]:
+    """Map the schema of each month of the facts partitioned into files to
+    the month's database file"""
+    return {
+        schema: path
+        for fact in cfg.facts if fact.partitioning is not None
+        for schema, path in fact.partitioning.attachments()
+    }
+
+
+def attach_partitions(conn, clauseelement, multiparams, params) -> None:
+    """Attach the monthly database files a statement reads to its connection
+
+    Only the months left after the date filters prune the rest are
+    attached, as each statement runs, since SQLite attaches at most
+    MAX_ATTACHED files to a connection.  Months the statement doesn't read
+    are detached to make room.  Months whose file doesn't exist are
+    skipped, so a query that touches one fails on the missing schema
+    rather than creating an empty file.
+    """
+    if isinstance(clauseelement, Compiled):
+        clauseelement = clauseelement.statement
+    if not isinstance(clauseelement, ClauseElement):
+        return
+    files = partition_files()
+    if not files:
+        return
+    needed = {
+        element.schema for element in visitors.iterate(clauseelement, {})
+        if isinstance(element, Table) and element.schema in files
+    }
+    if not needed:
+        return
+    if len(needed) > MAX_ATTACHED:
+        raise ValueError(
+            'The query reads {:,} monthly files, but SQLite attaches at most {}; '
+            'narrow its date filters'.format(len(needed), MAX_ATTACHED))
+    dbapi_connection = conn.connection
+    attached = {
+        row[1] for row in dbapi_connection.execute('PRAGMA database_list')
+    } - {'main', 'temp'}
+    missing = sorted(needed - attached)
+    spare = sorted(schema for schema in attached if schema in files and schema not in needed)
+    while missing and spare and len(attached) + len(missing) > MAX_ATTACHED:
+        schema = spare.pop()
+        dbapi_connection.execute('DETACH DATABASE "{}"'.format(schema))
+        attached.discard(schema)
+    for schema in missing:
+        if os.path.exists(files[schema]):
+            dbapi_connection.execute(
+                'ATTACH DATABASE ? AS "{}"'.format(schema), (files[schema],))
+
+
+def current_rollups(fact) -> Set[str]:
+    """The table names of the fact's rollups that exist and have been
+    refreshed up to the fact's latest row
+
+    A stale rollup would leave out the rows loaded since its refresh, so
+    aggregates only read the rollups named here, and the fact otherwise.
+    """
+    engine = get_engine()
+    tables = set(inspect(engine).get_table_names())
+    if rollup_watermarks.name not in tables:
+        return set()
+    current = set()
+    with engine.connect() as con:
+        marks = dict(con.execute(select([
+            rollup_watermarks.c.rollup, rollup_watermarks.c.high_water])).fetchall())
+        latest = {}  # type: Dict[str, int]
+        for rollup in fact.rollups:
+            if rollup.table_name not in tables or rollup.table_name not in marks:
+                continue
+            field = rollup.high_water_field
+            if field not in latest:
+                latest[field] = con.execute(
+                    select([func.max(fact.source().c[field])])).scalar()
+            if marks[rollup.table_name] == latest[field]:
+                current.add(rollup.table_name)
+    return current
+
+
+def shard_engine(url: str):
+    """Return the engine of a shard of a sharded fact
+
+    A SQLite shard holds only its share of the fact's table, so the app's
+    database is attached to each of its connections, where SQLite finds
+    the dimensions that the star query joins to.
+    """
+    with _engine_lock:
+        if url not in _shard_engines:
+            shard = create_engine(url, echo=False)
+            if shard.dialect.name == 'sqlite':
+                event.listen(shard, 'connect', attach_warehouse)
+            _shard_engines[url] = shard
+        return _shard_engines[url]
+
+
+def attach_warehouse(dbapi_connection, connection_record) -> None:
+    warehouse = get_engine().url.database
+    if warehouse and warehouse != ':memory:':
+        dbapi_connection.execute("ATTACH DATABASE ? AS warehouse", (warehouse,))
+
+
+def query_option(qry, name: str):
+    """The value of one of the execution options a Star sets on its queries"""
+    return qry.get_execution_options().get(name) if isinstance(qry, Select) else None
+
+
+def query_shards(qry: Select) -> Optional[Sequence[str]]:
+    """The shard urls of a query over a sharded fact's star, if it is one"""
+    return query_option(qry, 'shards')
+
+
+def order_keys(qry: Select) -> List[Tuple[int, bool]]:
+    """The position in the result of each of the query's ORDER BY columns
+    and whether it's descending
+
+    Example:
+    >>> import sqlalchemy as sqa
+    >>> t = sqa.table('t', sqa.column('a'), sqa.column('b'))
+    >>> order_keys(sqa.select([t.c.a, t.c.b]).order_by(t.c.b.desc(), t.c.a))
+    [(1, True), (0, False)]
+    """
+    names = [col.name for col in qry.inner_columns]
+    keys = []
+    for clause in qry._order_by_clause.clauses:
+        descending = isinstance(clause, UnaryExpression) \
+            and clause.modifier is operators.desc_op
+        element = clause.element if isinstance(clause, UnaryExpression) else clause
+        name = getattr(element, 'name', None)
+        if name not in names:
+            raise ValueError('Sharded queries can only be ordered by the columns '
+                'they select; {} is not one of them'.format(element))
+        keys.append((names.index(name), descending))
+    return keys
+
+
+def merge_shard_rows(qry: Select, results: List[List]) -> List:
+    """Combine the rows of each shard, applying the query's ORDER BY,
+    OFFSET and LIMIT to the whole
+
+    Example:
+    >>> import sqlalchemy as sqa
+    >>> t = sqa.table('t', sqa.column('a'))
+    >>> qry = sqa.select([t.c.a]).order_by(t.c.a.desc()).limit(3).offset(1)
+    >>> merge_shard_rows(qry, [[(9,), (5,), (1,)], [(8,), (7,), (None,)]])
+    [(8,), (7,), (5,)]
+    """
+    rows = [row for shard_rows in results for row in shard_rows]
+    for index, descending in reversed(order_keys(qry)):
+        # stable sorts from the last key to the first; NULLs sort first,
+        # as they do in SQLite
+        rows.sort(key=lambda row: (row[index] is not None, row[index]),
+            reverse=descending)
+    offset = qry._offset or 0
+    limit = qry._limit
+    return rows[offset:None if limit is None else offset + limit]
+
+
+def fetch_shards(qry: Select, shards: Sequence[str],
+        timer: Optional[QueryTimer] = None) -> List:
+    """Run the query on every shard at once and merge the results
+
+    Each shard runs on its own connection in a worker thread, so the
+    query takes as long as the slowest shard rather than the sum of them.
+    Each shard only has to return offset + limit rows, since no more of
+    its rows can be in the merged result.
+    """
+    timer = timer or QueryTimer()
+    limit = qry._limit
+    per_shard = qry.offset(None).limit(
+        None if limit is None else limit + (qry._offset or 0))
+
+    def run(url: str) -> List:
+        con = shard_engine(url).connect()
+        try:
+            return con.execute(per_shard).fetchall()
+        finally:
+            con.close()
+
+    with timer.stage('execute'):
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            results = list(pool.map(run, shards))
+    with timer.stage('fetch'):
+        rows = merge_shard_rows(qry, results)
+    compiled = per_shard.compile(dialect=shard_engine(shards[0]).dialect)
+    log_if_slow(timer, len(rows), compiled.string, compiled.construct_params())
+    return rows
+
+
+def columnar_connection(path: str):
+    """Return a DuckDB connection to a fact's columnar copy
+
+    path is either a DuckDB database file, opened read only, or a folder of
+    Parquet files, one per table named <table>.parquet, which are mapped to
+    views of the same names.  DuckDB is only imported when a star that has
+    a columnar copy is queried.
+    """
+    with _engine_lock:
+        if path not in _columnar_connections:
+            import duckdb
+            if os.path.isdir(path):
+                con = duckdb.connect(':memory:')
+                for parquet in sorted(glob.glob(os.path.join(path, '*.parquet'))):
+                    table = os.path.splitext(os.path.basename(parquet))[0]
+                    con.execute("CREATE VIEW \"{}\" AS SELECT * FROM read_parquet('{}')"
+                        .format(table, parquet.replace("'", "''")))
+            else:
+                con = duckdb.connect(path, read_only=True)
+            _columnar_connections[path] = con
+        return _columnar_connections[path]
+
+
+class DuckDBCompiler(sqlite.base.SQLiteCompiler):
+    """SQLite's SQL, which is close enough to DuckDB's, but with LIKE
+    compiled as ILIKE, since SQLite's LIKE ignores case and DuckDB's doesn't"""
+
+    def visit_like_op_binary(self, binary, operator, **kw) -> str:
+        return self.ilike(binary, 'ILIKE', **kw)
+
+    def visit_notlike_op_binary(self, binary, operator, **kw) -> str:
+        return self.ilike(binary, 'NOT ILIKE', **kw)
+
+    def ilike(self, binary, keyword: str, **kw) -> str:
+        escape = binary.modifiers.get('escape')
+        return '{} {} {}'.format(
+            binary.left._compiler_dispatch(self, **kw),
+            keyword,
+            binary.right._compiler_dispatch(self, **kw)
+        ) + (' ESCAPE ' + self.render_literal_value(escape, sqltypes.STRINGTYPE)
+            if escape else '')
+
+
+class DuckDBDialect(sqlite.dialect):
+    statement_compiler = DuckDBCompiler
+
+
+def columnar_sql(qry: Select) -> Tuple[str, List]:
+    """Compile a query for DuckDB
+
+    The parameters are passed in order and unprocessed, so dates stay
+    dates.
+
+    Example:
+    >>> import datetime
+    >>> import sqlalchemy as sqa
+    >>> t = sqa.table('t', sqa.column('a'), sqa.column('d'))
+    >>> sql, params = columnar_sql(sqa.select([t.c.a]).where(t.c.a.contains('x'))
+    ...     .where(t.c.d >= datetime.date(2016, 1, 1)).limit(10))
+    >>> print(sql)
+    SELECT t.a 
+    FROM t 
+    WHERE (t.a ILIKE '%' || ? || '%') AND t.d >= ?
+     LIMIT ? OFFSET ?
+    >>> params
+    ['x', datetime.date(2016, 1, 1), 10, 0]
+    >>> print(columnar_sql(sqa.select([sqa.literal_column("'LIKE'").label('LIKE')]))[0])
+    SELECT 'LIKE' AS "LIKE"
+    """
+    compiled = qry.compile(dialect=DuckDBDialect())
+    values = compiled.construct_params()
+    return compiled.string, [values[name] for name in compiled.positiontup]
+
+
+def fetch_columnar(qry: Select, path: str, timer: Optional[QueryTimer] = None,
+        batch_size: Optional[int] = None) -> Generator:
+    """Run the query on DuckDB and yield its rows in batches (all of them at
+    once if batch_size is None)"""
+    timer = timer or QueryTimer()
+    with timer.stage('compile'):
+        sql, params = columnar_sql(qry)
+    cursor = columnar_connection(path).cursor()  # a cursor per thread
+    fetched = 0
+    try:
+        with timer.stage('execute'):
+            cursor.execute(sql, params)
+        stage = 'first_row'
+        while True:
+            with timer.stage(stage):
+                rows = cursor.fetchall() if batch_size is None \
+                    else cursor.fetchmany(batch_size)
+            stage = 'fetch'
+            if not rows:
+                return
+            fetched += len(rows)
+            yield rows
+            if batch_size is None:
+                return
+    finally:
+        cursor.close()
+        log_if_slow(timer, fetched, sql, params)
 
 
 class Transaction:
     def __init__(self):
-        self.connection = engine.connect()
+        self.connection = get_engine().connect()
         self.transaction = self.connection.begin()
         self.rows_added = 0
         self.rows_deleted = 0
@@ -56,7 +401,7 @@ class Transaction:
 @log_error
 def execute(cmd) -> int:
     print(type(cmd))
-    con = engine.connect()
+    con = get_engine().connect()
     try:
         # from sqlalchemy.dialects import sqlite
         # print(cmd.compile(dialect=sqlite.dialect()))
@@ -74,22 +419,227 @@ def execute(cmd) -> int:
         con.close()
 
 
+SLOW_QUERY_STAGES = ('execute', 'first_row', 'fetch')
+
+
+def bound_parameters(compiled) -> Union[Dict, List]:
+    """A compiled statement's parameters as the DBAPI is handed them, ie
+    after each type's bind processor (so dates are strings on SQLite), in
+    order for positional dialects"""
+    processed = {}
+    for name, value in compiled.construct_params().items():
+        processor = compiled.binds[name].type._cached_bind_processor(compiled.dialect)
+        processed[name] = processor(value) if processor else value
+    if compiled.positional:
+        return [processed[name] for name in compiled.positiontup]
+    return processed
+
+
+def query_plan(con, compiled) -> List[str]:
+    """Ask the database how it would run a compiled statement
+
+    SQLite's EXPLAIN QUERY PLAN rows are indented to show the plan's tree;
+    other databases get their EXPLAIN output as is.
+    """
+    processed = bound_parameters(compiled)
+    cursor = con.connection.cursor()
+    try:
+        if con.dialect.name != 'sqlite':
+            cursor.execute('EXPLAIN ' + compiled.string, processed)
+            return [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + compiled.string, processed)
+        depth = {0: -1}
+        plan = []
+        for node_id, parent, _, detail in cursor.fetchall():
+            depth[node_id] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[node_id] + detail)
+        return plan
+    finally:
+        cursor.close()
+
+
+def log_if_slow(timer: QueryTimer, rows: int, sql: str, params,
+        plan: Optional[Callable[[], List[str]]] = None) -> None:
+    """Write the statement, its parameters, timings and query plan to
+    logs/slow_queries.log if the database took longer than
+    cfg.app.slow_query_seconds to answer it
+
+    plan is only called once the query is known to be slow.  Queries with
+    no SQLite plan to ask for, those gathered from a sharded fact's shards
+    or run on a columnar copy, are logged without one.
+    """
+    seconds = sum(timer.stages.get(stage, 0) for stage in SLOW_QUERY_STAGES)
+    if seconds < cfg.app.slow_query_seconds:
+        return
+    entry = '{seconds:.2f}s, {rows:,} rows ({stages})\n{sql}\nparams: {params}\n'.format(
+        seconds=seconds,
+        rows=rows,
+        stages=timer.stage_summary(),
+        sql=sql,
+        params=params
+    )
+    if plan is not None:
+        try:
+            plan = plan()
+        except Exception as e:
+            plan = ['query plan unavailable: {}'.format(e)]
+        entry += 'plan:\n{}\n'.format('\n'.join('    ' + line for line in plan))
+    slow_query_log().warning(entry)
+
+
 @log_error
-def fetch(qry: Select) -> List[str]:
-    con = engine.connect()
+def fetch(qry: Select, timer: Optional[QueryTimer] = None) -> List[str]:
+    """Run the query and return all of its rows
+
+    If a timer is given, the compile, execute, first row and fetch stages
+    are added to it.  A query over a sharded fact is run on its shards, and
+    one over a fact with a columnar copy on DuckDB.
+    """
+    timer = timer or QueryTimer()
+    shards = query_shards(qry)
+    if shards:
+        return fetch_shards(qry, shards, timer)
+    columnar = query_option(qry, 'columnar')
+    if columnar:
+        return [row for rows in fetch_columnar(qry, columnar, timer) for row in rows]
+    con = get_engine().connect()
     try:
-        # from sqlalchemy.dialects import sqlite
-        # print(qry.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
-        return con.execute(qry).fetchall()
+        with timer.stage('compile'):
+            compiled = qry.compile(dialect=con.dialect)
+        with timer.stage('execute'):
+            result = con.execute(compiled)
+        with timer.stage('first_row'):
+            rows = result.fetchmany(1)
+        with timer.stage('fetch'):
+            rows.extend(result.fetchall())
+        log_if_slow(timer, len(rows), compiled.string, compiled.construct_params(),
+            lambda: query_plan(con, compiled))
+        return rows
     except:
         raise
     finally:
         con.close()
 
 
+ITER_BATCH_SIZE = 1000
+
+
+@log_error
+def iterbatches(cmd, batch_size: int = ITER_BATCH_SIZE,
+        progress: Optional[Callable[[int], None]] = None,
+        timer: Optional[QueryTimer] = None) -> Generator:
+    """Yield the results of a query in lists of up to batch_size rows
+
+    The query runs with stream_results so drivers that support server side
+    cursors don't buffer the whole result, and the connection is returned to
+    the pool when the generator finishes, fails or is closed early, so
+    consumers that may stop partway should wrap it in contextlib.closing.
+    progress is called with the running row count after each batch, and a
+    timer, if given, gets the compile, execute, first row and fetch stages
+    (the time spent by the consumer between batches isn't counted).  A
+    query over a sharded fact is gathered from its shards before the first
+    batch is yielded, since its order and limit apply across them.
+    """
+    timer = timer or QueryTimer()
+    shards = query_shards(cmd)
+    if shards:
+        rows = fetch_shards(cmd, shards, timer)
+        for start in range(0, len(rows), batch_size):
+            if progress is not None:
+                progress(min(start + batch_size, len(rows)))
+            yield rows[start:start + batch_size]
+        return
+    columnar = query_option(cmd, 'columnar')
+    if columnar:
+        fetched = 0
+        with closing(fetch_columnar(cmd, columnar, timer, batch_size)) as results:
+            for rows in results:
+                fetched += len(rows)
+                if progress is not None:
+                    progress(fetched)
+                yield rows
+        return
+    with get_engine().connect() as con:
+        with timer.stage('compile'):
+            compiled = cmd.compile(dialect=con.dialect)
+        with timer.stage('execute'):
+            result = con.execution_options(stream_results=True).execute(compiled)
+        try:
+            fetched = 0
+            with timer.stage('first_row'):
+                rows = result.fetchmany(batch_size)
+            while rows:
+                fetched += len(rows)
+                if progress is not None:
+                    progress(fetched)
+                yield rows
+                with timer.stage('fetch'):
+                    rows = result.fetchmany(batch_size)
+        finally:
+            result.close()
+            log_if_slow(timer, fetched, compiled.string, compiled.construct_params(),
+                lambda: query_plan(con, compiled))
+
+
+@log_error
+def iterarrow(cmd, fields, batch_size: int = ITER_BATCH_SIZE,
+        timer: Optional[QueryTimer] = None) -> Generator:
+    """Yield the results of a query as Arrow record batches with the
+    fields' types
+
+    DuckDB returns its results as Arrow already, so a query over a columnar
+    copy never makes a Python object per value; other queries' rows are
+    converted a batch at a time, which the timer counts as the convert stage.
+    """
+    from arrow_rows import arrow_schema, conform, record_batch
+    timer = timer or QueryTimer()
+    schema = arrow_schema(fields)
+    columnar = query_option(cmd, 'columnar')
+    if columnar:
+        with timer.stage('compile'):
+            sql, params = columnar_sql(cmd)
+        cursor = columnar_connection(columnar).cursor()
+        fetched = 0
+        try:
+            with timer.stage('execute'):
+                cursor.execute(sql, params)
+                # to_arrow_reader is the newer name for fetch_record_batch
+                reader = getattr(cursor, 'to_arrow_reader', None) \
+                    or cursor.fetch_record_batch
+                reader = reader(batch_size)
+            stage = 'first_row'
+            while True:
+                with timer.stage(stage):
+                    try:
+                        batch = reader.read_next_batch()
+                    except StopIteration:
+                        return
+                stage = 'fetch'
+                with timer.stage('convert'):
+                    batch = conform(batch, schema)
+                fetched += batch.num_rows
+                yield batch
+        finally:
+            cursor.close()
+            log_if_slow(timer, fetched, sql, params)
+    with closing(iterbatches(cmd, batch_size=batch_size, timer=timer)) as results:
+        for rows in results:
+            with timer.stage('convert'):
+                batch = record_batch(fields, rows, schema)
+            yield batch
+
+
+def fetch_arrow(qry: Select, fields, timer: Optional[QueryTimer] = None):
+    """Run the query and return all of its rows as an ArrowRows"""
+    from arrow_rows import ArrowRows
+    with closing(iterarrow(qry, fields, timer=timer)) as batches:
+        return ArrowRows.from_batches(list(batches), fields)
+
+
 @log_error
-def iterrows(cmd) -> Generator:
-    con = engine.connect()
-    for row in con.execute(cmd):
-        yield row
-    con.close()
+def iterrows(cmd, batch_size: int = ITER_BATCH_SIZE,
+        progress: Optional[Callable[[int], None]] = None) -> Generator:
+    """Yield the results of a query one row at a time, fetched in batches"""
+    with closing(iterbatches(cmd, batch_size=batch_size, progress=progress)) as results:
+        for rows in results:
+            yield from rows
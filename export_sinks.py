@@ -0,0 +1,334 @@
+"""The classes in this module write query results to disk as they stream
+from the database, so an export never holds more than a batch in memory.
+
+Each sink takes batches of rows through write_rows and keeps count of the
+rows it has written so the exporter can report progress.  SINKS maps the
+names shown on the QueryDesigner's export format box to the sink classes.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import csv
+import datetime
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import sys
+from typing import Callable, List, Sequence
+import zipfile
+
+from custom_types import Date, SqlDataType
+from schema import Field, FieldFormat, FieldType, normalize_bool, SQLITE_TYPES
+
+EXCEL_MAX_ROWS = 1048576  # per sheet, including the header row
+
+EXCEL_FORMATS = {
+    FieldFormat.accounting: '_(* #,##0.00_);_(* (#,##0.00);_(* "-"??_);_(@_)',
+    FieldFormat.bool: 'General',
+    FieldFormat.currency: '$#,##0.00_);($#,##0.00)',
+    FieldFormat.date: 'yyyy-mm-dd',
+    FieldFormat.datetime: 'yyyy-mm-dd hh:mm',
+    FieldFormat.float: '#,##0.0000',
+    FieldFormat.int: '0',
+    FieldFormat.str: '@',
+}
+
+
+def to_date(value: SqlDataType) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return Date.convert_to_datetime(str(value))
+
+
+def to_datetime(value: SqlDataType) -> datetime.datetime:
+    """Excel stores dates as datetimes, so promote whatever the driver
+    returned for a date column."""
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.combine(to_date(value), datetime.time())
+
+
+class ExportSink(ABC):
+    """Base class for the export formats"""
+
+    extension = ''
+    open_when_done = False  # hand the file to the OS default application
+    writes_arrow = False  # has write_batch, for Arrow record batches
+
+    def __init__(self, path: str, fields: List[Field], headers: List[str]) -> None:
+        self.path = path
+        self.fields = fields
+        self.headers = headers
+        self.rows_written = 0
+
+    @abstractmethod
+    def write_rows(self, rows: Sequence[Sequence[SqlDataType]]) -> None:
+        """Write a batch of rows and add them to rows_written"""
+
+    def close(self) -> None:
+        pass
+
+    @classmethod
+    def merge(cls, part_paths: List[str], output_path: str) -> str:
+        """Combine the part files of a partitioned export
+
+        Formats that can't be concatenated are zipped together instead.
+        Returns the path of the combined file.
+        """
+        zip_path = output_path + '.zip'
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for path in part_paths:
+                zf.write(path, os.path.basename(path))
+        return zip_path
+
+
+class XlsxSink(ExportSink):
+    """Stream rows into an .xlsx workbook
+
+    The workbook is opened in xlsxwriter's constant_memory mode, which
+    flushes each row to a temp file as soon as the next row starts.  Cells
+    are written with the type and number format of their Field, and once a
+    sheet is full the remaining rows roll over onto a new sheet with the
+    header repeated.  xlsxwriter is imported on first use, so it isn't
+    loaded at startup.
+    """
+
+    extension = '.xlsx'
+    open_when_done = True
+
+    def __init__(self, path: str, fields: List[Field], headers: List[str],
+            sheet_name: str = 'temp') -> None:
+        super(XlsxSink, self).__init__(path, fields, headers)
+        import xlsxwriter
+
+        self.sheet_name = sheet_name
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        self.header_format = self.workbook.add_format({
+            'bold': True,
+            'font_color': 'white',
+            'bg_color': '#000080',  # dark blue
+        })
+        self.cell_writers = [self.cell_writer(fld) for fld in fields]
+        self.sheet = None
+        self.sheet_count = 0
+        self.sheet_row = 0
+        self.add_sheet()
+
+    def add_sheet(self) -> None:
+        self.sheet_count += 1
+        name = self.sheet_name
+        if self.sheet_count > 1:
+            name = '{}_{}'.format(self.sheet_name, self.sheet_count)
+        self.sheet = self.workbook.add_worksheet(name)
+        for i, header in enumerate(self.headers):
+            self.sheet.write_string(0, i, header, self.header_format)
+        self.sheet_row = 1
+
+    def cell_writer(self, fld: Field) -> Callable:
+        """Return a function that writes one cell of the field's type"""
+        cell_format = self.workbook.add_format({
+            'num_format': EXCEL_FORMATS.get(fld.field_format, 'General')
+        })
+
+        def write_number(row: int, col: int, val: SqlDataType) -> None:
+            self.sheet.write_number(row, col, float(val), cell_format)
+
+        def write_date(row: int, col: int, val: SqlDataType) -> None:
+            self.sheet.write_datetime(row, col, to_datetime(val), cell_format)
+
+        def write_bool(row: int, col: int, val: SqlDataType) -> None:
+            self.sheet.write_boolean(row, col, normalize_bool(val))
+
+        def write_str(row: int, col: int, val: SqlDataType) -> None:
+            self.sheet.write_string(row, col, str(val))
+
+        return {
+            FieldType.bool: write_bool,
+            FieldType.date: write_date,
+            FieldType.float: write_number,
+            FieldType.int: write_number,
+            FieldType.str: write_str,
+        }[fld.dtype]
+
+    def write_row(self, row: Sequence[SqlDataType]) -> None:
+        if self.sheet_row >= EXCEL_MAX_ROWS:
+            self.add_sheet()
+        for col, val in enumerate(row):
+            if val is not None and val != '':
+                self.cell_writers[col](self.sheet_row, col, val)
+        self.sheet_row += 1
+        self.rows_written += 1
+
+    def write_rows(self, rows: Sequence[Sequence[SqlDataType]]) -> None:
+        for row in rows:
+            self.write_row(row)
+
+    def close(self) -> None:
+        self.workbook.close()
+
+
+class CsvSink(ExportSink):
+    """Stream rows into a delimited text file, optionally gzipped
+
+    A path of '-' writes to stdout, so headless extracts can be piped.
+    """
+
+    extension = '.csv'
+    open_when_done = True
+    compress = False
+    delimiter = ','
+
+    def __init__(self, path: str, fields: List[Field], headers: List[str]) -> None:
+        super(CsvSink, self).__init__(path, fields, headers)
+        target = sys.stdout.buffer if path == '-' else path
+        if self.compress:
+            self.file = gzip.open(target, 'wt', newline='', encoding='utf-8')
+        elif path == '-':
+            self.file = io.TextIOWrapper(target, newline='', encoding='utf-8')
+        else:
+            self.file = open(target, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file, delimiter=self.delimiter)
+        self.writer.writerow(headers)
+
+    def write_rows(self, rows: Sequence[Sequence[SqlDataType]]) -> None:
+        self.writer.writerows(rows)
+        self.rows_written += len(rows)
+
+    def close(self) -> None:
+        if self.path == '-' and not self.compress:
+            self.file.flush()
+            self.file.detach()  # leave stdout open
+        else:
+            self.file.close()
+
+    @classmethod
+    def merge(cls, part_paths: List[str], output_path: str) -> str:
+        """Append the parts to the first one, skipping their header lines
+
+        Gzipped parts are appended as new gzip members, since concatenated
+        members are themselves a valid gzip file.
+        """
+        opener = gzip.open if cls.compress else open
+        shutil.copyfile(part_paths[0], output_path)
+        for path in part_paths[1:]:
+            with opener(path, 'rb') as part, opener(output_path, 'ab') as out:
+                part.readline()
+                shutil.copyfileobj(part, out)
+        return output_path
+
+
+class GzipCsvSink(CsvSink):
+    extension = '.csv.gz'
+    open_when_done = False
+    compress = True
+
+
+class TsvSink(CsvSink):
+    extension = '.tsv'
+    delimiter = '\t'
+
+
+class GzipTsvSink(TsvSink):
+    extension = '.tsv.gz'
+    open_when_done = False
+    compress = True
+
+
+class ParquetSink(ExportSink):
+    """Stream rows into a Parquet file, one Arrow record batch per batch
+
+    pyarrow is an optional dependency, so it is only imported when a Parquet
+    export is requested.  Record batches from db.iterarrow are written as
+    they are.
+    """
+
+    extension = '.parquet'
+    writes_arrow = True
+
+    def __init__(self, path: str, fields: List[Field], headers: List[str]) -> None:
+        super(ParquetSink, self).__init__(path, fields, headers)
+        import pyarrow.parquet as pq
+        from arrow_rows import arrow_schema
+
+        self.schema = arrow_schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows: Sequence[Sequence[SqlDataType]]) -> None:
+        if not rows:
+            return
+        from arrow_rows import record_batch
+        self.write_batch(record_batch(self.fields, rows, self.schema))
+
+    def write_batch(self, batch) -> None:
+        self.writer.write_batch(batch)
+        self.rows_written += batch.num_rows
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class SqliteSink(ExportSink):
+    """Stream rows into a table in a standalone SQLite database file"""
+
+    extension = '.db'
+
+    def __init__(self, path: str, fields: List[Field], headers: List[str],
+            table_name: str = 'export') -> None:
+        super(SqliteSink, self).__init__(path, fields, headers)
+        self.con = sqlite3.connect(path)
+        self.con.execute('DROP TABLE IF EXISTS "{}"'.format(table_name))
+        self.con.execute('CREATE TABLE "{t}" ({cols})'.format(
+            t=table_name,
+            cols=', '.join(
+                '"{}" {}'.format(fld.name, SQLITE_TYPES[fld.dtype])
+                for fld in fields
+            )
+        ))
+        self.insert = 'INSERT INTO "{t}" VALUES ({p})'.format(
+            t=table_name,
+            p=', '.join('?' for _ in fields)
+        )
+
+    def write_rows(self, rows: Sequence[Sequence[SqlDataType]]) -> None:
+        with self.con:  # one transaction per batch
+            self.con.executemany(self.insert, (
+                tuple(
+                    v.isoformat() if isinstance(v, datetime.date) else v
+                    for v in row
+                )
+                for row in rows
+            ))
+        self.rows_written += len(rows)
+
+    def close(self) -> None:
+        self.con.close()
+
+    @classmethod
+    def merge(cls, part_paths: List[str], output_path: str,
+            table_name: str = 'export') -> str:
+        shutil.copyfile(part_paths[0], output_path)
+        con = sqlite3.connect(output_path)
+        try:
+            for path in part_paths[1:]:
+                con.execute("ATTACH DATABASE ? AS part", (path,))
+                with con:
+                    con.execute('INSERT INTO "{t}" SELECT * FROM part."{t}"'
+                        .format(t=table_name))
+                con.execute("DETACH DATABASE part")
+        finally:
+            con.close()
+        return output_path
+
+
+SINKS = OrderedDict([
+    ('Excel', XlsxSink),
+    ('CSV', CsvSink),
+    ('CSV (gzip)', GzipCsvSink),
+    ('Tab Delimited', TsvSink),
+    ('Tab Delimited (gzip)', GzipTsvSink),
+    ('Parquet', ParquetSink),
+    ('SQLite', SqliteSink),
+])
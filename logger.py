@@ -5,24 +5,64 @@
 >>> divtest() # doctest:+ELLIPSIS
 *etc* - debug - INFO - test
 """
+import atexit
 import functools
 import logging
 import os
 from logging import StreamHandler
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+import queue
 import sys
-from typing import Callable
+import threading
+from typing import Callable, List
 
 from utilities import rootdir
 
 DEBUG = True
 
+_listeners = []  # type: List[QueueListener]
+_setup_lock = threading.Lock()
+
+
+def log_folder() -> str:
+    folder = os.path.join(rootdir(), 'logs')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def queue_handlers(logger: logging.Logger, *handlers: logging.Handler) -> None:
+    """Send the logger's records to the handlers on a background thread
+
+    The calling thread only puts the record on a queue, so a worker thread
+    that logs never waits on file I/O.  The listeners are flushed and
+    stopped when the interpreter exits.
+    """
+    records = queue.Queue()  # type: queue.Queue
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    logger.addHandler(QueueHandler(records))
+
+
+@atexit.register
+def stop_listeners() -> None:
+    while _listeners:
+        _listeners.pop().stop()
+
 
 def rotating_log(name: str='main') -> logging.Logger:
     """Return a handle to a logger that messages can be sent to for storage."""
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if not logger.handlers:
+            _setup_rotating_log(logger)
+    return logger
+
+
+def _setup_rotating_log(logger: logging.Logger) -> None:
     fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     formatter = logging.Formatter(fmt)
-    fp = os.path.join(rootdir(), 'logs', 'rotating.log')
+    fp = os.path.join(log_folder(), 'rotating.log')
     file_handler = TimedRotatingFileHandler(
         filename=fp,
         when='D',
@@ -40,17 +80,46 @@ def rotating_log(name: str='main') -> logging.Logger:
         '''
     file_handler.setLevel(logging.ERROR)
     file_handler.setFormatter(formatter)
-    logger = logging.getLogger(name)
-    logger.addHandler(file_handler)
-    logger.setLevel(logging.ERROR)
+    handlers = [file_handler]
     if DEBUG:
         stream_handler = StreamHandler(stream=sys.stderr)
         stream_handler.setLevel(logging.ERROR)
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
+    logger.setLevel(logging.ERROR)
+    queue_handlers(logger, *handlers)
+
+
+def file_log(name: str, filename: str, fmt: str='%(message)s') -> logging.Logger:
+    """Return a logger that writes INFO and above to its own daily rotating
+    file in the logs folder, and nowhere else."""
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if logger.handlers:
+            return logger
+        file_handler = TimedRotatingFileHandler(
+            filename=os.path.join(log_folder(), filename),
+            when='D',
+            interval=1,
+            backupCount=5
+        )
+        file_handler.setFormatter(logging.Formatter(fmt))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        queue_handlers(logger, file_handler)
     return logger
 
 
+def timings_log() -> logging.Logger:
+    """Return the logger that query timings are written to as json lines."""
+    return file_log('timings', 'timings.log')
+
+
+def slow_query_log() -> logging.Logger:
+    """Return the logger that slow queries and their plans are written to."""
+    return file_log('slow_queries', 'slow_queries.log', '%(asctime)s - %(message)s')
+
+
 def debug_logger():
     fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     formatter = logging.Formatter(fmt)
@@ -66,21 +135,26 @@ def debug_logger():
 
 
 def log_error(func) -> Callable:
+    """Log any exception the function raises to the 'main' log and re-raise it
+
+    The logger is looked up once here, and the log's handlers are only set
+    up when the first error is logged, so a call that doesn't raise costs
+    no more than the try block.
+    """
+    current_logger = logging.getLogger('{}.{}.{}'.format(
+        'main'
+        , func.__module__
+        , func.__name__
+    ))
+
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        if not logging.getLogger('main').handlers:
-            rotating_log()
-        log_name = '{}.{}.{}'.format(
-            'main'
-            , func.__module__
-            , func.__name__
-        )
-        current_logger = logging.getLogger(log_name)
         try:
             return func(*args, **kwargs)
         except Exception as e:
+            rotating_log()
             current_logger.exception(str(e))
-            raise e
+            raise
     return wrapper
 
 
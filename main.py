@@ -4,15 +4,35 @@
 import os
 import sys
 
-from PyQt4 import QtGui
+import startup_profile
+
+PROFILE_STARTUP = __name__ == '__main__' and '--profile-startup' in sys.argv
+if PROFILE_STARTUP:
+    startup_profile.enable()
+
+from PyQt4 import QtCore, QtGui
 
 from view import MainView
 from logger import rotating_log
 
 
+def finish_profile() -> None:
+    """Report once the event loop is running, ie the window is on screen"""
+    startup_profile.mark('window shown')
+    startup_profile.report()
+    QtGui.QApplication.quit()
+
+
 if __name__ == '__main__':
+    if PROFILE_STARTUP:
+        sys.argv.remove('--profile-startup')
+        startup_profile.mark('imports')
     app = QtGui.QApplication(sys.argv)
+    if PROFILE_STARTUP:
+        startup_profile.mark('QApplication')
     main_view = MainView()
+    if PROFILE_STARTUP:
+        startup_profile.mark('MainView')
     main_logger = rotating_log('main')
 
     try:
@@ -32,6 +52,8 @@ if __name__ == '__main__':
         app.setWindowIcon(icon)
 
         main_view.showMaximized()
+        if PROFILE_STARTUP:
+            QtCore.QTimer.singleShot(0, finish_profile)
         app.exec_()
         sys.exit(0)
     except SystemExit:
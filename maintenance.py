@@ -0,0 +1,585 @@
+"""Keep the database in step with how the app queries it.
+
+The config already says which columns the users filter and join on, so the
+indexes a deployment needs can be worked out from it rather than guessed.
+
+Commands:
+    indexes             list the indexes the config calls for that the
+                        database is missing
+    indexes --create    create them
+    fts                 (re)build the FTS5 trigram tables and their sync
+                        triggers for the tables with full_text fields
+    labels              add, fill and index the persisted summary label
+                        columns of the dimensions that have one
+    rollups             add the fact rows past each rollup's high-water mark
+                        to the rollup
+    rollups --full      rebuild the rollups from scratch, which also picks up
+                        fact rows that were edited or deleted
+    columnar            copy the tables of the stars that have a columnar
+                        path to it, as a DuckDB database or Parquet files
+
+Examples:
+    python maintenance.py indexes
+    python maintenance.py indexes --create
+    python maintenance.py fts
+    python maintenance.py labels
+    python maintenance.py rollups
+    python maintenance.py columnar
+"""
+import argparse
+from contextlib import closing
+from functools import reduce
+import os
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import warnings
+
+import sqlalchemy as sqa
+
+from config import cfg
+from db import forget_table_names, get_engine, iterbatches
+from schema import (
+    Constellation, Dimension, Fact, FieldType, ForeignKey, fts_table_name, Operator,
+    Rollup, rollup_watermarks, Table
+)
+
+# Operators a b-tree index can answer.  Like, Not Like and Ends With match
+# anywhere in the value, so an index on the column doesn't help them.
+INDEXABLE_OPERATORS = {
+    Operator.number_equals,
+    Operator.number_greater_than,
+    Operator.number_greater_than_or_equal_to,
+    Operator.number_less_than,
+    Operator.number_less_than_or_equal_to,
+    Operator.str_equals,
+    Operator.date_after,
+    Operator.date_on_or_after,
+    Operator.date_before,
+    Operator.date_on_or_before,
+    Operator.date_equals,
+}
+
+IndexSpec = NamedTuple('IndexSpec', [
+    ('table', str)
+    , ('name', str)
+    , ('columns', Tuple[str, ...])
+    , ('expression', Optional[str])  # sql, for an index on an expression
+    , ('reason', str)
+])
+
+
+def index_name(table: str, columns: Tuple[str, ...]) -> str:
+    return 'ix_{}_{}'.format(table, '_'.join(columns))
+
+
+def summary_label_sql(dim: Dimension) -> str:
+    """The summary label expression the app concatenates at query time
+
+    Example:
+    >>> summary_label_sql(cfg.table('dimProduct'))
+    '"ProductName" || \\' - \\' || "ProductCategory"'
+    """
+    label = reduce(
+        lambda x, y: x + dim.summary_field.separator + y,
+        [sqa.literal_column('"{}"'.format(n), sqa.String)
+            for n in dim.summary_field.display_fields]
+    )
+    return str(label.compile(
+        dialect=get_engine().dialect,
+        compile_kwargs={'literal_binds': True}
+    ))
+
+
+def filtered_columns(tbl: Table) -> List[str]:
+    """The table's columns that have a filter an index can answer"""
+    return [
+        fld.name for fld in tbl.fields
+        if set(fld.filter_operators or []) & INDEXABLE_OPERATORS
+    ]
+
+
+def wanted_indexes(constellation: Constellation = cfg) -> List[IndexSpec]:
+    """The indexes the config's filters, joins and lookups call for
+
+    Facts get an index per foreign key, led by the key so it serves the
+    star join, with the first range filtered column second so a dimension
+    filter and a date filter can be answered together, plus an index per
+    filtered column.  Dimensions get a covering index for the foreign key
+    lookup, an index per filtered column, and an index on the summary label
+    expression if the label can be filtered on.  A persisted summary label
+    column stands in for the display fields in both label indexes.
+    """
+    specs = []  # type: List[IndexSpec]
+    for fact in constellation.facts:  # type: Fact
+        filtered = filtered_columns(fact)
+        for fld in fact.foreign_keys.values():  # type: ForeignKey
+            columns = (fld.name,) + tuple(filtered[:1])
+            specs.append(IndexSpec(
+                fact.table_name, index_name(fact.table_name, columns), columns,
+                None, 'join to {}'.format(fld.dimension)))
+        for name in filtered:
+            specs.append(IndexSpec(
+                fact.table_name, index_name(fact.table_name, (name,)), (name,),
+                None, 'filter'))
+    for dim in constellation.dimensions:  # type: Dimension
+        pk = dim.primary_key.name
+        persisted = dim.summary_field.persisted_column
+        display_fields = (persisted,) if persisted \
+            else tuple(dim.summary_field.display_fields)
+        columns = (pk,) + display_fields
+        specs.append(IndexSpec(
+            dim.table_name, index_name(dim.table_name, columns), columns,
+            None, 'foreign key lookup (covering)'))
+        for name in filtered_columns(dim):
+            specs.append(IndexSpec(
+                dim.table_name, index_name(dim.table_name, (name,)), (name,),
+                None, 'filter'))
+        if dim.summary_field.filter_operators and len(display_fields) == 1:
+            specs.append(IndexSpec(
+                dim.table_name, index_name(dim.table_name, display_fields),
+                display_fields, None, 'summary label'))
+        elif dim.summary_field.filter_operators:
+            specs.append(IndexSpec(
+                dim.table_name, 'ix_{}_summary_label'.format(dim.table_name), (),
+                summary_label_sql(dim), 'summary label'))
+    return specs
+
+
+def existing_indexes(engine, table: str) -> Dict[str, List[str]]:
+    """Map the table's index names to their columns
+
+    SQLAlchemy doesn't reflect SQLite's expression indexes, so those are
+    listed from sqlite_master with no columns.  The primary key is included
+    under the name 'primary key'.
+    """
+    inspector = sqa.inspect(engine)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', sqa.exc.SAWarning)
+        indexes = {
+            ix['name']: ix['column_names']
+            for ix in inspector.get_indexes(table)
+        }
+    if engine.dialect.name == 'sqlite':
+        for (name,) in engine.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                table):
+            indexes.setdefault(name, [])
+    pk = inspector.get_pk_constraint(table)['constrained_columns']
+    if pk:
+        indexes['primary key'] = pk
+    return indexes
+
+
+def missing_indexes(engine, specs: List[IndexSpec]) -> List[IndexSpec]:
+    """The specs that no existing index covers
+
+    An existing index covers a spec if the spec's columns are its leading
+    columns.  Expression indexes can't be compared that way, so they are
+    matched by name.
+    """
+    inspector = sqa.inspect(engine)
+    tables = set(inspector.get_table_names())
+    existing = {
+        table: existing_indexes(engine, table)
+        for table in {spec.table for spec in specs} & tables
+    }
+    missing = []
+    for spec in specs:
+        if spec.table not in existing:
+            continue  # not deployed here
+        indexes = existing[spec.table]
+        if spec.expression is not None:
+            covered = spec.name in indexes
+        else:
+            covered = any(
+                tuple(cols[:len(spec.columns)]) == spec.columns
+                for cols in indexes.values()
+            )
+        if not covered:
+            missing.append(spec)
+    return missing
+
+
+def create_index_sql(spec: IndexSpec) -> str:
+    return 'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({cols})'.format(
+        name=spec.name,
+        table=spec.table,
+        cols=spec.expression or ', '.join('"{}"'.format(c) for c in spec.columns)
+    )
+
+
+def indexes(create: bool = False, constellation: Constellation = cfg,
+        out=sys.stdout) -> List[IndexSpec]:
+    """Report (and optionally create) the missing indexes
+
+    Returns the indexes that were missing.
+    """
+    engine = get_engine()
+    missing = missing_indexes(engine, wanted_indexes(constellation))
+    if not missing:
+        print('All of the indexes the config calls for exist', file=out)
+    for spec in missing:
+        print('{} {}: {}'.format(
+            'Creating' if create else 'Missing', spec.reason, create_index_sql(spec)),
+            file=out)
+        if create:
+            with engine.begin() as con:
+                con.execute(create_index_sql(spec))
+    if create and missing:
+        with engine.begin() as con:
+            con.execute('ANALYZE')  # let the planner see the new indexes
+    return missing
+
+
+def fts_ddl(tbl: Table) -> List[str]:
+    """Statements that (re)create the table's FTS5 trigram table and the
+    triggers that keep it in sync with the table
+
+    The FTS table is an external content table over the table's
+    full_text fields, keyed by the primary key, so it stores the index but
+    not a second copy of the text.
+    """
+    fts = fts_table_name(tbl.table_name)
+    pk = tbl.primary_key.name
+    cols = [fld.name for fld in tbl.full_text_fields]
+
+    def values(prefix: str) -> str:
+        return ', '.join('{}."{}"'.format(prefix, c) for c in [pk] + cols)
+
+    col_list = ', '.join('"{}"'.format(c) for c in cols)
+    insert = 'INSERT INTO "{fts}"(rowid, {cols}) VALUES ({new});'.format(
+        fts=fts, cols=col_list, new=values('new'))
+    delete = ("INSERT INTO \"{fts}\"(\"{fts}\", rowid, {cols}) VALUES ('delete', {old});"
+        .format(fts=fts, cols=col_list, old=values('old')))
+    return [
+        'DROP TABLE IF EXISTS "{}"'.format(fts),
+        "CREATE VIRTUAL TABLE \"{fts}\" USING fts5({cols}, content='{t}', "
+        "content_rowid='{pk}', tokenize='trigram')"
+            .format(fts=fts, cols=col_list, t=tbl.table_name, pk=pk),
+        'DROP TRIGGER IF EXISTS "{}_ai"'.format(fts),
+        'DROP TRIGGER IF EXISTS "{}_ad"'.format(fts),
+        'DROP TRIGGER IF EXISTS "{}_au"'.format(fts),
+        'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{t}" BEGIN {insert} END'
+            .format(fts=fts, t=tbl.table_name, insert=insert),
+        'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{t}" BEGIN {delete} END'
+            .format(fts=fts, t=tbl.table_name, delete=delete),
+        'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{t}" BEGIN {delete} {insert} END'
+            .format(fts=fts, t=tbl.table_name, delete=delete, insert=insert),
+        "INSERT INTO \"{fts}\"(\"{fts}\") VALUES ('rebuild')".format(fts=fts),
+    ]
+
+
+def sqlite_version(engine) -> str:
+    with engine.connect() as con:
+        return con.execute('SELECT sqlite_version()').scalar()
+
+
+def full_text(constellation: Constellation = cfg, out=sys.stdout) -> List[str]:
+    """Build the FTS tables for every table with full_text fields
+
+    Returns the names of the FTS tables built.
+    """
+    engine = get_engine()
+    if engine.dialect.name != 'sqlite':
+        print('Full-text tables are only supported on SQLite', file=out)
+        return []
+    built = []
+    for tbl in constellation.tables:
+        if not tbl.full_text_fields:
+            continue
+        try:
+            with engine.begin() as con:
+                for statement in fts_ddl(tbl):
+                    con.execute(statement)
+        except sqa.exc.OperationalError as e:
+            if 'no such tokenizer' not in str(e) and 'no such module' not in str(e):
+                raise
+            print("This SQLite ({}) doesn't have FTS5's trigram tokenizer, which "
+                'needs 3.34 or newer, so {} was not built and Like filters on '
+                'its full_text fields scan the table'.format(
+                    sqlite_version(engine), fts_table_name(tbl.table_name)), file=out)
+            continue
+        finally:
+            forget_table_names(engine)
+        built.append(fts_table_name(tbl.table_name))
+        print('Built {} over {}'.format(
+            fts_table_name(tbl.table_name),
+            ', '.join(fld.name for fld in tbl.full_text_fields)), file=out)
+    if not built:
+        print('No fields are marked full_text', file=out)
+    return built
+
+
+def label_ddl(dim: Dimension, existing_columns: List[str]) -> List[str]:
+    """Statements that add the dimension's persisted summary label column
+    if it is missing and set it from the display fields
+
+    Rows saved through the app keep the column current from then on.
+    """
+    column = dim.summary_field.persisted_column
+    statements = []
+    if column not in existing_columns:
+        statements.append('ALTER TABLE "{t}" ADD COLUMN "{c}" VARCHAR'.format(
+            t=dim.table_name, c=column))
+    statements.append('UPDATE "{t}" SET "{c}" = {label}'.format(
+        t=dim.table_name, c=column, label=summary_label_sql(dim)))
+    return statements
+
+
+def labels(constellation: Constellation = cfg, out=sys.stdout) -> List[str]:
+    """Add and fill the persisted summary label columns, then create the
+    indexes that read them
+
+    Returns the names of the dimensions whose labels were filled.
+    """
+    engine = get_engine()
+    inspector = sqa.inspect(engine)
+    tables = set(inspector.get_table_names())
+    filled = []
+    for dim in constellation.dimensions:
+        if not dim.summary_field.persisted_column or dim.table_name not in tables:
+            continue
+        existing_columns = [col['name'] for col in inspector.get_columns(dim.table_name)]
+        with engine.begin() as con:
+            for statement in label_ddl(dim, existing_columns):
+                con.execute(statement)
+        filled.append(dim.table_name)
+        print('Filled {}.{}'.format(dim.table_name, dim.summary_field.persisted_column),
+            file=out)
+    if not filled:
+        print('No summary fields have a persisted_column', file=out)
+        return filled
+    label_specs = [
+        spec for spec in wanted_indexes(constellation)
+        if spec.table in filled and spec.reason in (
+            'foreign key lookup (covering)', 'summary label')
+    ]
+    for spec in missing_indexes(engine, label_specs):
+        print('Creating {}: {}'.format(spec.reason, create_index_sql(spec)), file=out)
+        with engine.begin() as con:
+            con.execute(create_index_sql(spec))
+    return filled
+
+
+MERGE_FUNCTIONS = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def staging_table(rollup: Rollup, name: str) -> sqa.Table:
+    """A temporary table with the rollup's columns and group by index"""
+    return sqa.Table(name, sqa.MetaData(),
+        *[sqa.Column(col.name, col.type) for col in rollup.schema.columns]
+            + [sqa.Index('ux_' + name, *rollup.group_by, unique=True)],
+        prefixes=['TEMPORARY'])
+
+
+def merge_query(rollup: Rollup, delta: sqa.Table) -> sqa.sql.Select:
+    """The rollup's rows for the groups in delta merged with delta's rows
+
+    Sums and counts add up and minimums and maximums are taken again, all
+    by the database, which also keeps the NULL handling of the aggregates.
+    """
+    c = rollup.schema.c
+    matched = sqa.exists().where(sqa.and_(*(
+        c[name].isnot_distinct_from(delta.c[name]) for name in rollup.group_by)))
+    both = sqa.union_all(
+        rollup.schema.select().where(matched),
+        delta.select()
+    ).alias('stored_and_new')
+    stats = list(rollup.measure_columns.items()) + [('row_count', (None, 'count'))]
+    groups = [both.c[name] for name in rollup.group_by]
+    return sqa.select(groups + [
+        getattr(sqa.func, MERGE_FUNCTIONS[stat])(both.c[name]).label(name)
+        for name, (_, stat) in stats
+    ]).group_by(*groups)
+
+
+def refresh_rollup(engine, rollup: Rollup, full: bool = False) -> int:
+    """Add the fact rows past the rollup's high-water mark to the rollup
+
+    The new rows are aggregated into a temporary table, then the groups
+    they share with the rollup are merged, deleted and written back in a
+    few set-based statements, on the rollup's unique index.  A full
+    refresh empties the rollup and aggregates the whole fact.  A rollup
+    table from before the index existed is always rebuilt.  Returns the
+    number of groups written.
+    """
+    inspector = sqa.inspect(engine)
+    if rollup.table_name in inspector.get_table_names():
+        existing = {ix['name'] for ix in inspector.get_indexes(rollup.table_name)}
+        missing = [ix for ix in rollup.schema.indexes if ix.name not in existing]
+        if missing:  # built before the index, when dates weren't grouped by day
+            engine.execute(rollup.schema.delete())
+            for index in missing:
+                index.create(engine)
+            full = True
+    rollup.schema.create(engine, checkfirst=True)
+    rollup_watermarks.create(engine, checkfirst=True)
+    fact = rollup.fact.source()
+    names = [col.name for col in rollup.schema.columns]
+    with engine.begin() as con:
+        low = con.execute(sqa.select([rollup_watermarks.c.high_water])
+            .where(rollup_watermarks.c.rollup == rollup.table_name)).scalar()
+        # read the fact first: its monthly files can't be attached once the
+        # delete below has begun the transaction
+        high = con.execute(
+            sqa.select([sqa.func.max(fact.c[rollup.high_water_field])])).scalar()
+        if full or low is None:
+            con.execute(rollup.schema.delete())
+            low = None
+        if high is None or high == low:
+            return 0
+        if low is None:
+            written = con.execute(rollup.schema.insert().from_select(
+                names, rollup.delta_query(low, high))).rowcount
+        else:
+            delta = staging_table(rollup, 'rollup_delta')
+            merged = staging_table(rollup, 'rollup_merged')
+            for tbl in (delta, merged):
+                tbl.drop(con, checkfirst=True)
+                tbl.create(con)
+            con.execute(delta.insert().from_select(names, rollup.delta_query(low, high)))
+            con.execute(merged.insert().from_select(names, merge_query(rollup, delta)))
+            con.execute(rollup.schema.delete().where(sqa.exists().where(sqa.and_(*(
+                rollup.schema.c[name].isnot_distinct_from(delta.c[name])
+                for name in rollup.group_by)))))
+            written = con.execute(rollup.schema.insert().from_select(
+                names, merged.select())).rowcount
+            for tbl in (delta, merged):
+                tbl.drop(con)
+        con.execute(rollup_watermarks.delete()
+            .where(rollup_watermarks.c.rollup == rollup.table_name))
+        con.execute(rollup_watermarks.insert().values(
+            rollup=rollup.table_name, high_water=high))
+    return written
+
+
+def rollups(full: bool = False, constellation: Constellation = cfg,
+        out=sys.stdout) -> Dict[str, int]:
+    """Refresh every rollup of the constellation's facts
+
+    Returns the number of groups written per rollup.
+    """
+    engine = get_engine()
+    tables = set(sqa.inspect(engine).get_table_names())
+    written = {}  # type: Dict[str, int]
+    for fact in constellation.facts:  # type: Fact
+        if fact.partitioning is None and fact.table_name not in tables:
+            continue
+        for rollup in fact.rollups:
+            written[rollup.table_name] = refresh_rollup(engine, rollup, full=full)
+            print('{} {}: {:,} groups written'.format(
+                'Rebuilt' if full else 'Refreshed', rollup.table_name,
+                written[rollup.table_name]), file=out)
+    if not written:
+        print('No facts have rollups', file=out)
+    return written
+
+
+DUCKDB_TYPES = {
+    FieldType.bool: 'BOOLEAN',
+    FieldType.date: 'DATE',
+    FieldType.float: 'DOUBLE',
+    FieldType.int: 'BIGINT',
+    FieldType.str: 'VARCHAR',
+}
+
+
+def copy_to_duckdb(con, tbl: Table, sqlite_path: str, scan: bool) -> None:
+    """Copy a table from the SQLite database to a DuckDB table of the same name
+
+    With scan, DuckDB reads the SQLite file itself through its sqlite
+    extension; otherwise the rows are fetched here and inserted in batches.
+    """
+    if scan:
+        con.execute("CREATE OR REPLACE TABLE \"{}\" AS SELECT * FROM sqlite_scan('{}', '{}')"
+            .format(tbl.table_name, sqlite_path.replace("'", "''"), tbl.table_name))
+        return
+    con.execute('CREATE OR REPLACE TABLE "{}" ({})'.format(tbl.table_name, ', '.join(
+        '"{}" {}'.format(fld.name, DUCKDB_TYPES[fld.dtype]) for fld in tbl.fields)))
+    insert = 'INSERT INTO "{}" VALUES ({})'.format(
+        tbl.table_name, ', '.join('?' for _ in tbl.fields))
+    with closing(iterbatches(tbl.schema.select())) as results:
+        for batch in results:
+            con.executemany(insert, [list(row) for row in batch])
+
+
+def columnar(constellation: Constellation = cfg, out=sys.stdout) -> List[str]:
+    """Copy each star's fact and dimensions to the fact's columnar path
+
+    The copy is a snapshot, so run this after loads, like the rollups.
+    DuckDB locks its database files, so copy to one while the app isn't
+    reading it.  Returns the facts copied.
+    """
+    engine = get_engine()
+    facts = [fact for fact in constellation.facts if fact.columnar]
+    if not facts:
+        print('No facts have a columnar path', file=out)
+        return []
+    if engine.dialect.name != 'sqlite':
+        print('Columnar copies can only be made from SQLite', file=out)
+        return []
+    import duckdb
+    for fact in facts:
+        star = constellation.star(fact.table_name)
+        to_parquet = os.path.isdir(fact.columnar)
+        con = duckdb.connect(':memory:' if to_parquet else fact.columnar)
+        try:
+            try:
+                con.execute('LOAD sqlite')
+                scan = True
+            except duckdb.Error:
+                scan = False  # the extension isn't installed and can't be downloaded
+            for tbl in [fact] + star.dimensions:
+                copy_to_duckdb(con, tbl, engine.url.database, scan)
+                if to_parquet:
+                    con.execute("COPY \"{}\" TO '{}' (FORMAT parquet)".format(
+                        tbl.table_name,
+                        os.path.join(fact.columnar, tbl.table_name + '.parquet')
+                            .replace("'", "''")))
+        finally:
+            con.close()
+        print('Copied {} and its dimensions to {}'.format(fact.table_name, fact.columnar),
+            file=out)
+    return [fact.table_name for fact in facts]
+
+
+def main(argv: List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    index_parser = commands.add_parser('indexes',
+        help='report the indexes the config calls for that are missing')
+    index_parser.add_argument('--create', action='store_true',
+        help='create the missing indexes')
+    commands.add_parser('fts',
+        help='build the full-text tables for the full_text fields')
+    commands.add_parser('labels',
+        help='add, fill and index the persisted summary label columns')
+    rollup_parser = commands.add_parser('rollups',
+        help="add the new fact rows to the facts' rollups")
+    rollup_parser.add_argument('--full', action='store_true',
+        help='rebuild the rollups from scratch')
+    commands.add_parser('columnar',
+        help='copy the stars that have a columnar path there')
+    args = parser.parse_args(argv)
+
+    if args.command == 'indexes':
+        indexes(create=args.create)
+        return 0
+    if args.command == 'fts':
+        full_text()
+        return 0
+    if args.command == 'labels':
+        labels()
+        return 0
+    if args.command == 'rollups':
+        rollups(full=args.full)
+        return 0
+    if args.command == 'columnar':
+        columnar()
+        return 0
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,8 +10,8 @@ from typing import (
     Optional, Tuple, Set)
 
 from PyQt4 import QtCore
-from sortedcontainers import SortedSet
 
+from arrow_rows import ArrowRows, column_totals
 from config import cfg
 from custom_types import ColumnIndex, SqlDataType
 from query_manager import QueryManager
@@ -98,6 +98,8 @@ class AbstractModel(QtCore.QAbstractTableModel):
         totals = []
         fld = self.query_manager.table.fields[col_ix]
         rows = self.rowCount()
+        if isinstance(self.visible_data, ArrowRows):
+            return self.arrow_totals(col_ix)
         if fld.dtype == FieldType.float:
             total = sum(val[col_ix] for val in self.visible_data)
             avg = total / rows if rows > 0 else 0
@@ -113,6 +115,22 @@ class AbstractModel(QtCore.QAbstractTableModel):
                 , len(set(val[col_ix] for val in self.visible_data))))
         return totals
 
+    def arrow_totals(self, col_ix: ColumnIndex) -> list:
+        """The same totals as field_totals, computed over the Arrow column"""
+        fld = self.query_manager.table.fields[col_ix]
+        values = column_totals(self.visible_data, col_ix, fld.dtype)
+        if fld.dtype == FieldType.float:
+            return [
+                '{} Sum \t = {:,.2f}'.format(fld.name, float(values[0])),
+                '{} Avg \t = {:,.2f}'.format(fld.name, float(values[1])),
+            ]
+        elif fld.dtype == FieldType.date:
+            return [
+                '{} Min \t = {}'.format(fld.name, values[0] or 'Empty'),
+                '{} Max \t = {}'.format(fld.name, values[1] or 'Empty'),
+            ]
+        return ['{} Distinct Count \t = {}'.format(fld.name, values[0])]
+
     def columnCount(self, parent: QtCore.QModelIndex=None) -> int:
         return len(self.query_manager.table.fields)
 
@@ -152,10 +170,15 @@ class AbstractModel(QtCore.QAbstractTableModel):
         self.dataChanged.emit(ix, ix)
 
     def distinct_values(self, col_ix: ColumnIndex) -> List[str]:
-        return SortedSet(
+        if isinstance(self.visible_data, ArrowRows):
+            return sorted({
+                str(self.fk_lookup(col=col_ix, val=val))
+                for val in self.visible_data.unique(col_ix)
+            })
+        return sorted({
             str(self.fk_lookup(col=col_ix, val=row[col_ix]))
             for row in self.visible_data
-        )
+        })
 
     def filter_equality(self, col_ix: ColumnIndex, val: SqlDataType) -> None:
         self.visible_data = [
@@ -320,6 +343,12 @@ class AbstractModel(QtCore.QAbstractTableModel):
         """sort table by given column number col"""
         try:
             self.layoutAboutToBeChanged.emit()
+            if isinstance(self.visible_data, ArrowRows) \
+                    and col not in self.foreign_keys.keys():
+                self.visible_data = self.visible_data.sort(
+                    col, descending=order == QtCore.Qt.DescendingOrder)
+                self.layoutChanged.emit()
+                return
             if col in self.foreign_keys.keys():
                 self.visible_data = sorted(
                     self.visible_data
@@ -343,8 +372,10 @@ class AbstractModel(QtCore.QAbstractTableModel):
         self.visible_data = deepcopy(self.original_data)
         self.layoutChanged.emit()
 
-    @QtCore.pyqtSlot(list)
+    @QtCore.pyqtSlot(object)
     def update_view(self, results) -> None:
+        """Show a new set of results, either lists of rows or, for read only
+        tables, an ArrowRows (whose deepcopy shares the same buffers)"""
         self.layoutAboutToBeChanged.emit()
         self.original_data = results
         self.visible_data = deepcopy(results)
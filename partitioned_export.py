@@ -0,0 +1,136 @@
+"""This module splits an export into key ranges that are written in parallel
+
+Each range runs the export query with an extra range predicate on its own
+pooled connection and writes its own part file with the chosen sink.  When
+every part is done the sink merges the parts into one file (or zips them if
+the format can't be concatenated).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import datetime
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import sqlalchemy as sqa
+from sqlalchemy.sql import Select
+
+from db import fetch, iterbatches
+from export_sinks import ExportSink
+from schema import Field
+
+EXPORT_BATCH_SIZE = 5000
+
+
+def key_ranges(lo, hi, n: int) -> List[Tuple]:
+    """Split the closed interval [lo, hi] into at most n half-open ranges
+
+    Works for integer keys and for dates, which are split by day.
+
+    Examples:
+    >>> key_ranges(1, 10, 3)
+    [(1, 4), (4, 8), (8, 11)]
+    >>> key_ranges(5, 5, 4)
+    [(5, 6)]
+    """
+    is_date = isinstance(lo, datetime.date)
+    if is_date:
+        lo, hi = lo.toordinal(), hi.toordinal()
+    n = max(1, min(n, hi - lo + 1))
+    step = (hi - lo + 1) / n
+    bounds = [lo + int(round(step * i)) for i in range(n)] + [hi + 1]
+    if is_date:
+        bounds = [datetime.date.fromordinal(b) for b in bounds]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def partition_queries(query: Select, key: sqa.Column, n: int,
+        max_rows: Optional[int] = None) -> List[Select]:
+    """Return one query per key range, each ordered by the key
+
+    With max_rows, the ranges cover only the first max_rows rows in key
+    order, and the last range is limited to what's left of them, so a
+    capped export always holds the same rows however the parts finish.
+    """
+    # a partitioned star selects the key from a union named for the fact
+    key = next((col for col in query.inner_columns if col.name == key.name), key)
+    unlimited = query.limit(None)
+    bounds = (unlimited.order_by(None).order_by(key).limit(max_rows)
+        if max_rows else unlimited).alias('bounds')
+    lo, hi = fetch(sqa.select([
+        sqa.func.min(bounds.c[key.name]),
+        sqa.func.max(bounds.c[key.name])
+    ]))[0]
+    if lo is None:
+        return [query]
+    ranges = key_ranges(lo, hi, n)
+    queries = [
+        unlimited.where(key >= start).where(key < end).order_by(key)
+        for start, end in ranges
+    ]
+    if max_rows:
+        before = unlimited.order_by(None).where(key < ranges[-1][0]).alias('before')
+        rows_before = fetch(sqa.select([sqa.func.count()]).select_from(before))[0][0]
+        queries[-1] = queries[-1].limit(max_rows - rows_before)
+    return queries
+
+
+def part_path(output_path: str, part: int) -> str:
+    root, ext = os.path.splitext(output_path)
+    return '{}.part{:02d}{}'.format(root, part, ext)
+
+
+def export_partitioned(*,
+        query: Select,
+        key: sqa.Column,
+        partitions: int,
+        sink: type,
+        output_path: str,
+        fields: List[Field],
+        headers: List[str],
+        max_rows: int,
+        progress: Optional[Callable[[int, float], None]] = None,
+        stopped: Callable[[], bool] = lambda: False
+) -> Tuple[str, int]:
+    """Export the query in parallel key ranges
+
+    Returns the path of the merged output and the number of rows written.
+    The parts hold the first max_rows rows in key order between them, and
+    progress is called with the aggregate row count and rows per second
+    after every batch.
+    """
+    queries = partition_queries(query, key, partitions, max_rows)
+    paths = [part_path(output_path, i) for i in range(len(queries))]
+    lock = threading.Lock()
+    state = {'rows': 0}
+    start_time = time.time()
+
+    def export_part(qry: Select, path: str) -> None:
+        part = sink(path, fields=fields, headers=headers)  # type: ExportSink
+        try:
+            with closing(iterbatches(qry, batch_size=EXPORT_BATCH_SIZE)) as results:
+                for batch in results:
+                    if stopped():
+                        return
+                    with lock:
+                        state['rows'] += len(batch)
+                        total = state['rows']
+                    part.write_rows(batch)
+                    if progress:
+                        progress(total, total / max(time.time() - start_time, 0.001))
+        finally:
+            part.close()
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        futures = [pool.submit(export_part, q, p) for q, p in zip(queries, paths)]
+    try:
+        for f in futures:
+            f.result()  # re-raise the first error from a worker
+        if stopped():
+            return output_path, state['rows']
+        return sink.merge(paths, output_path), state['rows']
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
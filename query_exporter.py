@@ -1,18 +1,25 @@
+from contextlib import closing
 import os
 from subprocess import Popen
+import time
 from typing import List
 
 from PyQt4 import QtCore
-import xlwt
 
+from config import cfg
 from logger import log_error
-from db import iterrows
+from db import iterarrow, iterbatches, query_shards
+from export_sinks import ExportSink, SINKS, XlsxSink
+from partitioned_export import EXPORT_BATCH_SIZE, export_partitioned
+from query_timer import QueryTimer
+from schema import Field
 
 
 class SqlSignals(QtCore.QObject):
     error = QtCore.pyqtSignal(str)
     exit = QtCore.pyqtSignal()
-    rows_exported = QtCore.pyqtSignal(int)
+    rows_exported = QtCore.pyqtSignal(int, float)  # rows, rows per second
+    exported_msg = QtCore.pyqtSignal(str)
     done = QtCore.pyqtSignal()
 
 
@@ -24,23 +31,34 @@ class QueryExporter(QtCore.QObject):
         self.signals = SqlSignals()
         self.thread = None  # type: ExportSqlThread
 
-    def start_pull(self, query, headers: List[str]) -> None:
+    def start_pull(self, query, fields: List[Field], headers: List[str],
+            export_format: str = 'Excel', key=None, partitions: int = 1,
+            timer: QueryTimer = None) -> None:
         self.signals.exit.emit()  # stop current thread
-        self.thread = ExportSqlThread(query, headers)
+        self.thread = ExportSqlThread(
+            query, fields, headers, sink=SINKS.get(export_format, XlsxSink),
+            key=key, partitions=partitions, timer=timer)
         self.signals.exit.connect(self.thread.stop)
         self.thread.signals.error.connect(self.signals.error.emit)  # pass along
         self.thread.signals.rows_exported.connect(self.signals.rows_exported.emit)  # pass along
+        self.thread.signals.exported_msg.connect(self.signals.exported_msg.emit)  # pass along
         self.thread.start()
 
 
 class ExportSqlThread(QtCore.QThread):
     """
-     Writes a sql query_manager to an Excel workbook.
+     Streams a sql query_manager to a file in the format of the given sink.
     """
-    def __init__(self, query, headers) -> None:
+    def __init__(self, query, fields, headers, sink: type=XlsxSink,
+            key=None, partitions: int=1, timer: QueryTimer=None) -> None:
         super(ExportSqlThread, self).__init__()
         self.query = query
+        self.fields = fields
         self.headers = headers
+        self.sink = sink
+        self.key = key  # column to split partitioned exports on
+        self.partitions = partitions
+        self.timer = timer or QueryTimer('export')
         self.signals = SqlSignals()
         self.stop_everything = False
         #   stop thread in relatively save spots
@@ -51,43 +69,79 @@ class ExportSqlThread(QtCore.QThread):
             folder = 'output'
             if not os.path.exists(folder) or not os.path.isdir(folder):
                 os.mkdir(folder)
-            output_path = os.path.join(folder, 'temp.xls')
+            output_path = os.path.join(folder, 'temp' + self.sink.extension)
 
-            wb = xlwt.Workbook()
-            sht = wb.add_sheet('temp', cell_overwrite_ok=True)
-            header_style = xlwt.easyxf(
-                'pattern: pattern solid, fore_colour dark_blue;'
-                'font: colour white, bold True;'
-            )
-            for i, x in enumerate(self.headers):
-                sht.write(0, i, x, header_style)
-
-            n = 0
-            if self.stop_everything: return
-            try:
-                for row in iterrows(self.query):
-                    if self.stop_everything: return
-                    n += 1
-                    for i, val in enumerate(row):
-                        if val:
-                            sht.write(n, i, str(val))
-                    if n % 1000 == 0:
-                        self.signals.rows_exported.emit(n)
-            except:
-                pass
-            self.signals.rows_exported.emit(n)
             if self.stop_everything: return
-            wb.save(output_path)
-            Popen(output_path, shell=True)
+            start_time = time.time()
+            # a sharded query already runs on its shards in parallel
+            if self.partitions > 1 and self.key is not None \
+                    and not query_shards(self.query):
+                # the parts run in parallel, so only the total is meaningful
+                with self.timer.stage('export'):
+                    output_path, rows_written = export_partitioned(
+                        query=self.query,
+                        key=self.key,
+                        partitions=self.partitions,
+                        sink=self.sink,
+                        output_path=output_path,
+                        fields=self.fields,
+                        headers=self.headers,
+                        max_rows=cfg.app.maximum_export_rows,
+                        progress=self.signals.rows_exported.emit,
+                        stopped=lambda: self.stop_everything
+                    )
+                if self.stop_everything: return
+            else:
+                rows_written = self.export(output_path, start_time)
+                if self.stop_everything:
+                    os.remove(output_path)
+                    return
+            seconds = time.time() - start_time
+            self.timer.rows = rows_written
+            self.timer.log()
+            self.signals.exported_msg.emit(
+                '{:,} rows exported to {} in {:.1f} seconds ({:,.0f} rows/sec; {})'
+                .format(
+                    rows_written,
+                    output_path,
+                    seconds,
+                    rows_written / max(seconds, 0.001),
+                    self.timer.stage_summary()
+                )
+            )
+            if self.sink.open_when_done and output_path.endswith(self.sink.extension):
+                Popen(output_path, shell=True)
         except Exception as e:
             err_msg = "Error exporting query_manager results: {err}; {qry}"\
                 .format(err=e, qry=self.query)
             self.signals.error.emit(err_msg)
 
+    def export(self, output_path: str, start_time: float) -> int:
+        """Stream the query into a single file on this thread"""
+        sink = self.sink(output_path, fields=self.fields, headers=self.headers)  # type: ExportSink
+        if sink.writes_arrow:
+            results = iterarrow(self.query, self.fields, batch_size=EXPORT_BATCH_SIZE,
+                timer=self.timer)
+            write = sink.write_batch
+        else:
+            results = iterbatches(self.query, batch_size=EXPORT_BATCH_SIZE,
+                timer=self.timer)
+            write = sink.write_rows
+        try:
+            with closing(results):
+                for batch in results:
+                    if self.stop_everything: break
+                    with self.timer.stage('write'):
+                        write(batch)
+                    self.signals.rows_exported.emit(
+                        sink.rows_written,
+                        sink.rows_written / max(time.time() - start_time, 0.001)
+                    )
+        finally:
+            sink.close()
+        return sink.rows_written
+
     def stop(self) -> None:
         self.stop_everything = True
         self.exit()
         self.quit()
-
-
-
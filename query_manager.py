@@ -11,6 +11,7 @@ from db import Transaction
 from query_exporter import QueryExporter
 from logger import log_error
 from query_runner import QueryRunner
+from query_timer import QueryTimer
 from schema import Fact, Table
 from sqlalchemy import Table
 from utilities import static_property
@@ -20,7 +21,8 @@ class QueryManager(QtCore.QObject):
     """Create a query from user input."""
 
     error_signal = QtCore.pyqtSignal(str)
-    query_results_signal = QtCore.pyqtSignal(list)
+    query_results_signal = QtCore.pyqtSignal(object)
+    timings_signal = QtCore.pyqtSignal(str)
 
     def __init__(self, table: Table) -> None:
         super(QueryManager, self).__init__()
@@ -31,6 +33,7 @@ class QueryManager(QtCore.QObject):
         self.star = cfg.star(self.table.table_name) if isinstance(self.table, Fact) else None
         self.filters = self.star.filters if self.star else self.table.filters
         self.headers = [fld.display_name for fld in self.table.fields]
+        self.timer = None  # type: QueryTimer
 
     #   Connect Signals
         self.runner.signals.results.connect(self.process_results)
@@ -56,25 +59,41 @@ class QueryManager(QtCore.QObject):
             if fld.name == name
         )
 
-    def export(self) -> None:
-        self.exporter.start_pull(query=self.sql_export, headers=self.headers)
+    def export(self, export_format: str = 'Excel') -> None:
+        timer = QueryTimer('export', self.table.table_name)
+        with timer.stage('build'):
+            qry = self.sql_export
+        self.exporter.start_pull(
+            query=qry,
+            fields=self.table.fields,
+            headers=self.headers,
+            export_format=export_format,
+            key=self.table.primary_key,
+            partitions=cfg.app.export_partitions,
+            timer=timer
+        )
 
     def pull(self) -> None:
-        self.runner.run_sql(query=self.sql_display)
+        self.timer = QueryTimer('pull', self.table.table_name)
+        with self.timer.stage('build'):
+            qry = self.sql_display
+        self.runner.run_sql(query=qry, table=self.table, timer=self.timer)
 
-    @QtCore.pyqtSlot(list)
+    @QtCore.pyqtSlot(object)
     def process_results(self, results: list) -> None:
-        """Convert data to specified data types"""
-        processed = []
-        try:
-            for r, row in enumerate(results):
-                processed.append(list(row))
-                for c, col in enumerate(row):
-                    processed[r][c] = self.table.fields[c].dtype.convert(col)
-            self.query_results_signal.emit(processed)
-        except Exception as e:
-            err_msg = "Error processing results: {}".format(e)
-            self.error_signal.emit(err_msg)
+        """Pass along results that the runner thread already converted to
+        the fields' data types
+
+        The model updates synchronously on this signal, so its time is the
+        last stage of the pull.
+        """
+        if self.timer is None:
+            self.query_results_signal.emit(results)
+            return
+        with self.timer.stage('model'):
+            self.query_results_signal.emit(results)
+        self.timer.log()
+        self.timings_signal.emit(self.timer.summary())
 
     def reset(self) -> None:
         for f in self.table.filters:
@@ -1,36 +1,36 @@
 from PyQt4 import QtCore
-import time
 
-from db import fetch
+import arrow_rows
+from db import fetch, fetch_arrow
 from logger import log_error
+from query_timer import QueryTimer
+from result_cache import cached_rows, store_rows
+from schema import convert_rows, Table
 
 class QueryRunnerSignals(QtCore.QObject):
     error = QtCore.pyqtSignal(str)
     exit = QtCore.pyqtSignal()
     done = QtCore.pyqtSignal()
-    results = QtCore.pyqtSignal(list)
+    results = QtCore.pyqtSignal(object)
     rows_returned_msg = QtCore.pyqtSignal(str)
 
 class QueryRunnerThread(QtCore.QThread):
 
-    def __init__(self, query: str) -> None:
+    def __init__(self, query: str, table: Table, timer: QueryTimer=None) -> None:
         super(QueryRunnerThread, self).__init__()
         self.query = query  # type: str
+        self.table = table
+        self.timer = timer or QueryTimer('pull', table.table_name)
         self.signals = QueryRunnerSignals()
-        self.start_time = time.time()
         self.stop_everything = False
 
     @log_error
     def pull(self) -> None:
+        if not self.table.editable and arrow_rows.available():
+            self.pull_arrow()
+            return
         try:
-            results = fetch(self.query)
-            self.signals.rows_returned_msg.emit(
-                '{} rows returned in {} seconds'.format(
-                    len(results),
-                    int(time.time() - self.start_time)
-                )
-            )
-            self.signals.results.emit(results)
+            results = fetch(self.query, timer=self.timer)
         except Exception as e:
             self.signals.error.emit(
                 'Query execution error: {err}; {qry}'.format(
@@ -38,6 +38,65 @@ class QueryRunnerThread(QtCore.QThread):
                     , qry=self.query
                 )
             )
+            return
+        if self.stop_everything: return
+        try:
+            with self.timer.stage('convert'):
+                processed = convert_rows(self.table.fields, results)
+        except Exception as e:
+            self.signals.error.emit(
+                'Error processing results: {}'.format(e)
+            )
+            return
+        if self.stop_everything: return
+        self.timer.rows = len(processed)
+        self.signals.rows_returned_msg.emit(
+            '{:,} rows returned in {:.2f} seconds'.format(
+                len(processed),
+                self.timer.elapsed
+            )
+        )
+        self.signals.results.emit(processed)
+
+    def pull_arrow(self) -> None:
+        """Read only results stay in Arrow record batches all the way to the
+        model, so there's no list of rows to build and convert
+
+        They're also what the result cache keeps, so a query pulled before
+        is memory-mapped from the cache instead.
+        """
+        try:
+            with self.timer.stage('cache'):
+                key, processed = cached_rows(
+                    self.query, self.table.table_name, self.table.fields)
+        except Exception:
+            key, processed = None, None  # logged; pull from the database instead
+        if processed is None:
+            try:
+                processed = fetch_arrow(self.query, self.table.fields, timer=self.timer)
+            except Exception as e:
+                self.signals.error.emit(
+                    'Query execution error: {err}; {qry}'.format(
+                        err=e
+                        , qry=self.query
+                    )
+                )
+                return
+            if key is not None:
+                try:
+                    with self.timer.stage('cache'):
+                        store_rows(key, processed)
+                except Exception:
+                    pass  # logged; the results are still good
+        if self.stop_everything: return
+        self.timer.rows = len(processed)
+        self.signals.rows_returned_msg.emit(
+            '{:,} rows returned in {:.2f} seconds'.format(
+                len(processed),
+                self.timer.elapsed
+            )
+        )
+        self.signals.results.emit(processed)
 
     def run(self) -> None:
         self.pull()
@@ -56,9 +115,9 @@ class QueryRunner(QtCore.QObject):
         self.thread = None
 
     @log_error
-    def run_sql(self, query: str) -> None:
+    def run_sql(self, query: str, table: Table, timer: QueryTimer=None) -> None:
         self.signals.exit.emit()  # stop current thread
-        self.thread = QueryRunnerThread(query)
+        self.thread = QueryRunnerThread(query, table, timer)
         self.signals.exit.connect(self.thread.stop)
         self.thread.signals.error.connect(self.signals.error.emit)
         self.thread.signals.rows_returned_msg.connect(self.signals.rows_returned_msg.emit)
@@ -0,0 +1,111 @@
+"""This module times the stages of a pull or an export
+
+A QueryTimer travels with a query from the QueryManager, where the select
+is built, through db, where it is compiled, executed and fetched, to the
+runner or exporter thread and back to the model.  Each stage adds its
+elapsed time, and once the results are on screen (or on disk) the timer
+is written to logs/timings.log as one json record per line and summarized
+for the status bar.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import datetime
+import json
+import threading
+import time
+from typing import Dict, Generator
+
+from logger import timings_log
+
+STAGE_LABELS = OrderedDict([
+    ('build', 'build'),
+    ('cache', 'cache'),
+    ('compile', 'compile'),
+    ('execute', 'execute'),
+    ('first_row', 'first row'),
+    ('fetch', 'fetch'),
+    ('convert', 'convert'),
+    ('model', 'model'),
+    ('write', 'write'),
+    ('export', 'export'),
+])
+
+
+class QueryTimer:
+    """Accumulate the seconds spent in each stage of one query
+
+    Stages may be entered more than once (an export fetches and writes a
+    batch at a time), and their times add up.  Adding is locked, so the
+    timer can be shared with a worker thread.
+
+    Example:
+    >>> timer = QueryTimer('pull', 'factSales')
+    >>> timer.add('fetch', 0.25)
+    >>> timer.add('fetch', 0.5)
+    >>> timer.stages
+    OrderedDict([('fetch', 0.75)])
+    """
+
+    def __init__(self, kind: str = 'pull', table: str = '') -> None:
+        self.kind = kind
+        self.table = table
+        self.rows = 0
+        self.stages = OrderedDict()  # type: Dict[str, float]
+        self.start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Generator:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    def record(self) -> OrderedDict:
+        return OrderedDict([
+            ('time', datetime.datetime.now().isoformat()),
+            ('kind', self.kind),
+            ('table', self.table),
+            ('rows', self.rows),
+            ('total', round(self.elapsed, 6)),
+            ('stages', OrderedDict(
+                (name, round(seconds, 6)) for name, seconds in self.stages.items()
+            )),
+        ])
+
+    def summary(self) -> str:
+        """One line for the status bar, in the order the stages run
+
+        Example:
+        >>> timer = QueryTimer()
+        >>> timer.rows = 1200
+        >>> timer.add('fetch', 0.4)
+        >>> timer.add('build', 0.002)
+        >>> timer.summary()  # doctest: +ELLIPSIS
+        '1,200 rows in ...s (build 2ms, fetch 400ms)'
+        """
+        return '{:,} rows in {:.2f}s ({})'.format(
+            self.rows, self.elapsed, self.stage_summary())
+
+    def stage_summary(self) -> str:
+        ordered = sorted(
+            self.stages.items(),
+            key=lambda item: list(STAGE_LABELS).index(item[0])
+                if item[0] in STAGE_LABELS else len(STAGE_LABELS)
+        )
+        return ', '.join(
+            '{} {:,.0f}ms'.format(STAGE_LABELS.get(name, name), seconds * 1000)
+            for name, seconds in ordered
+        )
+
+    def log(self) -> None:
+        timings_log().info(json.dumps(self.record()))
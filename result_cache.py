@@ -0,0 +1,214 @@
+"""Keep pulled results on disk, so the same query after a restart is instant
+
+Results are written as Arrow IPC files, which are memory-mapped when they're
+read back: opening a cached result reads nothing until the view asks for a
+page of cells.  A file is named for the hash of the query's table and
+fields, its SQL and parameters (ie the star and the filter values) and the data version of
+the files it reads, so any write to the warehouse makes older results
+unreachable rather than stale.  Files beyond the size cap are evicted least
+recently used first, by modification time, which a hit refreshes.
+
+The cache is optional: it is off unless the app config sets
+result_cache_folder, and it needs pyarrow.  Only databases that are files
+(SQLite, the columnar copies and shards) have a data version; queries
+against anything else are never cached.
+"""
+import glob
+import hashlib
+import os
+import threading
+from typing import List, Optional, Tuple
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql import Select
+
+import arrow_rows
+from arrow_rows import ArrowRows
+from config import cfg
+import db
+from logger import log_error
+from schema import Field
+from utilities import rootdir
+
+EXTENSION = '.arrow'
+
+_cache = None  # type: Optional[ResultCache]
+_cache_lock = threading.Lock()
+
+
+def file_version(path: str) -> Optional[Tuple[str, int, int]]:
+    """(path, modified time, size) of a file, or None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def sqlite_files(url: str) -> List[str]:
+    """The database file of a SQLite url, or nothing for other databases
+
+    Example:
+    >>> sqlite_files('sqlite:///test.db')
+    ['test.db']
+    >>> sqlite_files('postgresql://host/sales')
+    []
+    """
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or not url.database \
+            or url.database == ':memory:':
+        return []
+    return [url.database]
+
+
+def data_version(qry: Select) -> Optional[List]:
+    """The versions of every file the query can read, or None if any of
+    them isn't a file
+
+    A write to SQLite changes the file's modified time, or its write ahead
+    log's, so the versions change whenever the data might have.
+    """
+    main = sqlite_files(str(db.get_engine().url))
+    if not main:
+        return None
+    paths = main + [path + '-wal' for path in main]
+    for fact in cfg.facts:
+        if fact.partitioning is not None:
+            paths += [path for _, path in fact.partitioning.attachments()]
+    for url in db.query_shards(qry) or []:
+        files = sqlite_files(url)
+        if not files:
+            return None
+        paths += files
+    columnar = db.query_option(qry, 'columnar')
+    if columnar:
+        paths += sorted(glob.glob(os.path.join(columnar, '*.parquet'))) \
+            if os.path.isdir(columnar) else [columnar]
+    return [file_version(path) for path in paths]
+
+
+def cache_key(qry: Select, table_name: str, fields: List[Field]) -> Optional[str]:
+    """The file name a query's results are cached under, or None if the
+    query can't be cached
+
+    The fields' names and types are part of the key, since they're the
+    cached file's schema: changing a field's type in the config must not
+    hand the model a column of the old type.
+    """
+    version = data_version(qry)
+    if version is None:
+        return None
+    compiled = qry.compile(dialect=db.get_engine().dialect)
+    schema = [(fld.name, fld.dtype.name) for fld in fields]
+    key = repr((table_name, schema, str(compiled), sorted(compiled.params.items()),
+        version))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """A folder of Arrow IPC files, capped at max_bytes"""
+
+    def __init__(self, folder: str, max_bytes: int) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key + EXTENSION)
+
+    def get(self, key: str) -> Optional[ArrowRows]:
+        """Memory-map a cached result, marking it recently used"""
+        import pyarrow as pa
+        path = self.path(key)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            os.utime(path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        return ArrowRows(table)
+
+    def put(self, key: str, rows: ArrowRows) -> None:
+        """Write a result, then evict the least recently used beyond the cap
+
+        The file is written under a temporary name and renamed, so a reader
+        never maps a partly written result.
+        """
+        import pyarrow as pa
+        path = self.path(key)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, rows.table.schema) as writer:
+                writer.write_table(rows.table)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def files(self) -> List[Tuple[float, int, str]]:
+        """(last used, size, path) of each cached result, oldest first"""
+        files = []
+        for path in glob.glob(os.path.join(self.folder, '*' + EXTENSION)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def evict(self) -> List[str]:
+        """Remove the least recently used results until the cache fits"""
+        removed = []
+        with self._lock:
+            files = self.files()
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue  # still mapped on Windows; try again next time
+                total -= size
+                removed.append(path)
+        return removed
+
+    def clear(self) -> None:
+        for _, _, path in self.files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def get_cache() -> Optional[ResultCache]:
+    """The app's result cache, or None if it's off or pyarrow is missing"""
+    global _cache
+    folder = getattr(cfg.app, 'result_cache_folder', None)
+    if not folder or not arrow_rows.available():
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    os.path.join(rootdir(), folder),
+                    cfg.app.result_cache_mb * 1024 * 1024
+                )
+    return _cache
+
+
+@log_error
+def cached_rows(qry: Select, table_name: str,
+        fields: List[Field]) -> Tuple[Optional[str], Optional[ArrowRows]]:
+    """The key to cache a query's results under, and its cached results if
+    there are any"""
+    cache = get_cache()
+    key = cache_key(qry, table_name, fields) if cache else None
+    if key is None:
+        return None, None
+    return key, cache.get(key)
+
+
+@log_error
+def store_rows(key: Optional[str], rows: ArrowRows) -> None:
+    cache = get_cache()
+    if cache and key:
+        cache.put(key, rows)
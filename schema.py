@@ -1,17 +1,24 @@
 """The classes declared in this module are used by multiple modules within the project.
 
 """
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 import datetime
 from enum import Enum, unique
 from functools import reduce
 from itertools import chain
-from sortedcollections import ValueSortedDict
+import threading
 from sqlalchemy import select
 from typing import (
     Dict,
     List,
     Optional,
-    Iterable
+    Iterable,
+    Sequence,
+    Set,
+    Tuple,
+    Union
 )
 
 import sqlalchemy as sqa
@@ -37,6 +44,45 @@ from utilities import autorepr, static_property
 
 md = sqa.MetaData()
 
+FALSE_STRINGS = {'', '0', 'f', 'false', 'n', 'no'}
+
+
+def normalize_bool(value: SqlDataType) -> bool:
+    """Interpret the various ways a database stores a boolean
+
+    SQLite has no boolean type, so depending on who wrote the row a flag may
+    come back as 0/1, '0'/'1' or 'True'/'False'.
+
+    Example:
+    >>> [normalize_bool(v) for v in (1, 0, '1', '0', 'False', None)]
+    [True, False, True, False, False, False]
+    """
+    if isinstance(value, str):
+        return value.strip().lower() not in FALSE_STRINGS
+    return bool(value)
+
+
+def convert_dates(values: Sequence[SqlDataType]) -> List[str]:
+    """Convert a column of dates to 'YYYY-MM-DD' strings
+
+    Most values are already ISO formatted strings or date objects, so they
+    are sliced directly; only irregular values pay for the regex in Date,
+    which rejects anything that isn't a date.
+    """
+    converted = []  # type: List[str]
+    append = converted.append
+    for v in values:
+        if not v:
+            append('')
+        elif v.__class__ is str and v[4:5] == '-' and v[7:8] == '-' \
+                and v[:4].isdigit() and v[5:7].isdigit() and v[8:10].isdigit():
+            append(v[:10])
+        elif isinstance(v, datetime.date):
+            append(v.isoformat()[:10])
+        else:
+            append(Date(v))
+    return converted
+
 
 @unique
 class FieldType(Enum):
@@ -57,10 +103,37 @@ class FieldType(Enum):
             str:   '',
             bool:  False
         }
+        if self.data_type is bool:
+            return normalize_bool(value)
         if value:
             return self.data_type(value)
         return default_value[self.data_type]
 
+    def convert_column(self, values: Sequence[SqlDataType]) -> List[SqlDataType]:
+        """Convert a whole column of values at once
+
+        Equivalent to calling convert on each value, but the type dispatch
+        happens once per column instead of once per cell.
+        """
+        if self.data_type is Date:
+            return convert_dates(values)
+        elif self.data_type is bool:
+            return [normalize_bool(v) for v in values]
+        elif self.data_type is float:
+            return [float(v) if v else 0.0 for v in values]
+        elif self.data_type is int:
+            return [int(v) if v else 0 for v in values]
+        return [str(v) if v else '' for v in values]
+
+
+SQLITE_TYPES = {
+    FieldType.bool: 'BOOLEAN',
+    FieldType.date: 'DATE',
+    FieldType.float: 'REAL',
+    FieldType.int: 'INTEGER',
+    FieldType.str: 'TEXT',
+}  # the column type each field is declared with in a SQLite table
+
 
 @unique
 class Operator(Enum):
@@ -89,6 +162,57 @@ class Operator(Enum):
         return self.value
 
 
+DATE_OPERATORS = {
+    Operator.date_after,
+    Operator.date_on_or_after,
+    Operator.date_before,
+    Operator.date_on_or_before,
+    Operator.date_equals,
+    Operator.date_does_not_equal,
+}
+
+
+def date_bounds(value: Union[str, datetime.date]) -> Tuple[datetime.date, datetime.date]:
+    """Return the half-open range [start, end) that the day covers
+
+    Example:
+    >>> date_bounds('2016-12-31')
+    (datetime.date(2016, 12, 31), datetime.date(2017, 1, 1))
+    >>> date_bounds(datetime.datetime(2016, 2, 28, 13, 30))
+    (datetime.date(2016, 2, 28), datetime.date(2016, 2, 29))
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    elif not isinstance(value, datetime.date):
+        value = Date.convert_to_datetime(value)
+    return value, value + datetime.timedelta(days=1)
+
+
+FTS_MIN_CHARS = 3  # the trigram tokenizer can't match anything shorter
+
+
+def fts_table_name(table_name: str) -> str:
+    return table_name + '_fts'
+
+
+def full_text_match(column: sqa.Column, value: str) -> BinaryExpression:
+    """A semi-join on the column's FTS5 trigram table for the rows whose
+    column contains the value, which is what LIKE '%value%' finds, but
+    answered from the full-text index instead of a scan.
+
+    The shadow table's rowid is the table's primary key.
+    """
+    fts = sqa.table(fts_table_name(column.table.name), sqa.column('rowid'))
+    pk = next(iter(column.table.primary_key.columns))
+    phrase = '{{{col}}}: "{val}"'.format(
+        col=column.name, val=value.replace('"', '""'))
+    return pk.in_(
+        sqa.select([fts.c.rowid]).where(
+            sqa.literal_column('"{}"'.format(fts.name)).op('MATCH')(
+                sqa.bindparam('fts_phrase', phrase, unique=True)))
+    )
+
+
 @unique
 class FieldFormat(Enum):
     """This class is used by the query manager when processing the list to
@@ -113,7 +237,8 @@ class Field:
             field_format: Optional[FieldFormat] = None,
             filter_operators: Optional[List[Operator]] = None,
             editable: bool = False,
-            primary_key: bool = False
+            primary_key: bool = False,
+            full_text: bool = False
     ) -> None:
 
         self.name = name
@@ -123,6 +248,9 @@ class Field:
         self.editable = editable
         self.primary_key = primary_key
         self.filter_operators = filter_operators
+        # answer Like filters from the table's FTS5 shadow table, which
+        # `python maintenance.py fts` creates and keeps in sync with triggers
+        self.full_text = full_text
 
     @static_property
     def default_format(self) -> FieldFormat:
@@ -160,6 +288,22 @@ class Field:
         )
 
 
+def convert_rows(fields: List[Field],
+        rows: Sequence[Sequence[SqlDataType]]) -> List[List[SqlDataType]]:
+    """Convert query results to the data types of their fields
+
+    The rows are transposed so each column is converted in a single pass,
+    then transposed back into lists the model can edit in place.
+    """
+    if not rows:
+        return []
+    columns = [
+        fld.dtype.convert_column(col)
+        for fld, col in zip(fields, zip(*rows))
+    ]
+    return [list(row) for row in zip(*columns)]
+
+
 @autorepr
 class Filter:
     def __init__(self, *, field: Field, operator: Operator) -> None:
@@ -172,9 +316,27 @@ class Filter:
         suffix = self.operator.suffix
         return self.field.display_name + (" " + suffix if suffix else "")
 
+    @property
+    def full_text(self) -> bool:
+        """Whether the filter is answered from its table's FTS index, which
+        only the SQLite database has: a Like filter on a full_text field,
+        with a value the trigrams can match, once the FTS table has been
+        built; LIKE scans the table otherwise"""
+        if not (self.operator == Operator.str_like and self.field.full_text
+                and len(self.value or '') >= FTS_MIN_CHARS):
+            return False
+        from db import has_table
+        return has_table(fts_table_name(self.field.schema.table.name))
+
     @property
     def filter(self) -> BinaryExpression:
+        if not self.value:
+            return None
         fld = self.field.schema
+        if self.operator in DATE_OPERATORS:
+            return self.date_filter(fld)
+        if self.full_text:
+            return full_text_match(fld, self.value)
         operator_mapping = {
             Operator.number_equals: fld == self.value,
             Operator.number_does_not_equal: fld != self.value,
@@ -188,16 +350,49 @@ class Filter:
             Operator.str_not_like: fld.notlike('%{}%'.format(self.value)),
             Operator.str_starts_with: fld.startswith(self.value),
             Operator.str_ends_with: fld.endswith(self.value),
+        }
+        return operator_mapping[self.operator]
+
+    def date_filter(self, fld: sqa.Column) -> BinaryExpression:
+        """Compare the raw column to the start and end of the day
 
-            Operator.date_after: sqa.func.date(fld) > self.value,
-            Operator.date_on_or_after: sqa.func.date(fld) >= self.value,
-            Operator.date_before: sqa.func.date(fld) < self.value,
-            Operator.date_on_or_before: sqa.func.date(fld) <= self.value,
-            Operator.date_equals: sqa.func.date(fld) == self.value,
-            Operator.date_does_not_equal: sqa.func.date(fld) != self.value
+        Date columns may hold datetimes, so a day is the half-open range
+        [day, day + 1).  Comparing the column itself, rather than date(col),
+        lets the database use an index on it.
+        """
+        start, end = date_bounds(self.value)
+        operator_mapping = {
+            Operator.date_after: fld >= end,
+            Operator.date_on_or_after: fld >= start,
+            Operator.date_before: fld < start,
+            Operator.date_on_or_before: fld < end,
+            Operator.date_equals: sqa.and_(fld >= start, fld < end),
+            Operator.date_does_not_equal: sqa.or_(fld < start, fld >= end),
         }
-        if self.value:
-            return operator_mapping[self.operator]
+        return operator_mapping[self.operator]
+
+    @property
+    def date_range(self) -> Tuple[Optional[datetime.date], Optional[datetime.date]]:
+        """The half-open [lower, upper) range of dates the filter lets
+        through, None being unbounded
+
+        Example:
+        >>> flt = Filter(field=Field(name='d', dtype=FieldType.date,
+        ...     display_name='D'), operator=Operator.date_before)
+        >>> flt.value = '2016-03-01'
+        >>> flt.date_range
+        (None, datetime.date(2016, 3, 1))
+        """
+        if not self.value or self.operator not in DATE_OPERATORS:
+            return None, None
+        start, end = date_bounds(self.value)
+        return {
+            Operator.date_after: (end, None),
+            Operator.date_on_or_after: (start, None),
+            Operator.date_before: (None, start),
+            Operator.date_on_or_before: (None, end),
+            Operator.date_equals: (start, end),
+        }.get(self.operator, (None, None))
 
     def __lt__(self, other) -> bool:
         return self.display_name < other.display_name
@@ -256,6 +451,10 @@ class Table:
         return {ColumnIndex(i): fld for i, fld in enumerate(self.fields) if
             isinstance(fld, ForeignKey)}
 
+    @static_property
+    def full_text_fields(self) -> List[Field]:
+        return [fld for fld in self.fields if fld.full_text]
+
     @static_property
     def primary_key(self) -> Field:
         return next(c for c in self.schema.columns if c.primary_key == True)
@@ -293,7 +492,8 @@ class SummaryField(Field):
             display_fields: List[str],
             display_name: str,
             separator: str = ' ',
-            filter_operators: Optional[List[Operator]] = None
+            filter_operators: Optional[List[Operator]] = None,
+            persisted_column: Optional[str] = None
     ) -> None:
         super(SummaryField, self).__init__(
             name="_".join(display_fields),
@@ -307,6 +507,10 @@ class SummaryField(Field):
         self.display_fields = display_fields
         self.display_name = display_name
         self.separator = separator
+        # a column on the dimension that stores the label, so lookups and
+        # label filters read one indexed column instead of concatenating
+        # per row; `python maintenance.py labels` adds and fills it
+        self.persisted_column = persisted_column
 
 
 @autorepr
@@ -344,21 +548,52 @@ class Dimension(Table):
 
     @static_property
     def foreign_key_schema(self) -> Table:
-        summary_field = reduce(
-            lambda x, y: x + self.summary_field.separator + y,
-            self.display_field_schemas
-        ).label(self.summary_field.display_name)
+        summary_field = self.summary_label_schema.label(self.summary_field.display_name)
         return sqa.select([self.primary_key, summary_field])
 
+    @static_property
+    def schema(self) -> sqa.Table:
+        """The fields' columns, plus the persisted summary label column if
+        the summary field has one"""
+        cols = [fld.schema for fld in self.fields]
+        if self.summary_field.persisted_column:
+            cols.append(sqa.Column(self.summary_field.persisted_column, sqa.String))
+        return sqa.Table(self.table_name, md, *cols)
+
     def select(self, max_rows: int = 1000) -> Select:
         """Only the dimension has a select method on the table class since
         the Fact table has to consider foreign keys so its select statement
         is composed at the Star level"""
-        s = self.schema.select()
+        s = select([fld.schema for fld in self.fields]).select_from(self.schema)
         for f in (flt for flt in self.filters if flt.value):
             s = s.where(f.filter)
         return s.limit(max_rows)
 
+    def summary_label(self, values: List[SqlDataType]) -> Optional[str]:
+        """The summary label of a row, as the database would concatenate it
+
+        Example:
+        >>> from config import cfg
+        >>> cfg.table('dimProduct').summary_label([1, 'Shoes', 'Clothing'])
+        'Shoes - Clothing'
+        """
+        parts = [
+            values[next(i for i, fld in enumerate(self.fields) if fld.name == name)]
+            for name in self.summary_field.display_fields
+        ]
+        if any(part is None for part in parts):
+            return None  # || yields NULL if any part is NULL
+        return self.summary_field.separator.join(str(part) for part in parts)
+
+    @static_property
+    def summary_label_schema(self) -> sqa.sql.ColumnElement:
+        """The persisted label column, or the concatenation it stands for"""
+        if self.summary_field.persisted_column:
+            return self.schema.c[self.summary_field.persisted_column]
+        return reduce(
+            lambda x, y: x + self.summary_field.separator + y,
+            self.display_field_schemas)
+
     @static_property
     def summary_field_schema(self) -> List[sqa.Column]:
         fld = Field(
@@ -366,11 +601,20 @@ class Dimension(Table):
             display_name=self.summary_field.display_name,
             dtype=FieldType.str
         )
-        fld.schema = reduce(
-            lambda x, y: x + self.summary_field.separator + y,
-            self.display_field_schemas).label(self.summary_field.display_name)
+        fld.schema = self.summary_label_schema.label(self.summary_field.display_name)
         return fld
 
+    def update_row(self, *,
+            pk: PrimaryKeyIndex,
+            values: List[SqlDataType]) -> Update:
+        """Keep the persisted summary label in step with the row's fields"""
+        stmt = super(Dimension, self).update_row(pk=pk, values=values)
+        if self.summary_field.persisted_column:
+            stmt = stmt.values({
+                self.summary_field.persisted_column: self.summary_label(values)
+            })
+        return stmt
+
 
 @autorepr
 class ForeignKey(Field):
@@ -402,6 +646,110 @@ class ForeignKey(Field):
         )
 
 
+def month_start(value: Union[str, datetime.date]) -> datetime.date:
+    """The first day of the value's month
+
+    Example:
+    >>> month_start('2016-02'), month_start(datetime.date(2016, 2, 29))
+    (datetime.date(2016, 2, 1), datetime.date(2016, 2, 1))
+    """
+    if isinstance(value, str):
+        year, month = value.split('-')[:2]
+        return datetime.date(int(year), int(month), 1)
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month: datetime.date) -> datetime.date:
+    if month.month == 12:
+        return datetime.date(month.year + 1, 1, 1)
+    return datetime.date(month.year, month.month + 1, 1)
+
+
+@autorepr
+class Partitioning:
+    """How a fact's rows are split by the month of one of its date fields
+
+    Each month's rows are either in a table of their own, named like
+    factSales_201601, or, if database is given, in the fact's table of a
+    SQLite file per month, eg database='data/sales_{:%Y%m}.db'.  db attaches
+    the files a statement reads, as schemas named like factSales_201601, as
+    it runs.  SQLite attaches at most 10 databases unless it was compiled
+    with a higher SQLITE_MAX_ATTACHED, so a query over files must be
+    filtered to at most that many months.
+
+    Every month from first_month to last_month (the current month by
+    default) must have its table.  Queries read the union of the months the
+    date filters on the field can touch.
+    """
+
+    def __init__(self, *,
+            field: FieldName,
+            first_month: str,
+            last_month: Optional[str] = None,
+            database: Optional[str] = None
+    ) -> None:
+        self.field = field
+        self.first_month = month_start(first_month)
+        self._last_month = month_start(last_month) if last_month else None
+        self.database = database
+        self.fact = None  # type: Fact  # set by the Fact that declares it
+        self._tables = {}  # type: Dict[datetime.date, sqa.Table]
+
+    @property
+    def last_month(self) -> datetime.date:
+        return self._last_month or month_start(datetime.date.today())
+
+    def months(self, lower: Optional[datetime.date] = None,
+            upper: Optional[datetime.date] = None) -> List[datetime.date]:
+        """The months that overlap the half-open range [lower, upper)"""
+        months = []
+        month = self.first_month
+        while month <= self.last_month:
+            if (upper is None or month < upper) and \
+                    (lower is None or next_month(month) > lower):
+                months.append(month)
+            month = next_month(month)
+        return months
+
+    def partition_name(self, month: datetime.date) -> str:
+        return '{}_{:%Y%m}'.format(self.fact.table_name, month)
+
+    def attachments(self) -> List[Tuple[str, str]]:
+        """(schema, file path) of each month's database file"""
+        if not self.database:
+            return []
+        return [
+            (self.partition_name(month), self.database.format(month))
+            for month in self.months()
+        ]
+
+    def table(self, month: datetime.date) -> sqa.Table:
+        """The month's table, with the same columns as the fact"""
+        if month not in self._tables:
+            name = self.partition_name(month)
+            cols = [col.copy() for col in self.fact.schema.columns]
+            if self.database:
+                self._tables[month] = sqa.Table(
+                    self.fact.table_name, md, *cols, schema=name)
+            else:
+                self._tables[month] = sqa.Table(name, md, *cols)
+        return self._tables[month]
+
+    def date_range(self, filters: List[Filter]) -> Tuple[
+            Optional[datetime.date], Optional[datetime.date]]:
+        """The narrowest range of dates that the filters on the field allow"""
+        lower, upper = None, None  # type: Optional[datetime.date]
+        for flt in filters:
+            if flt.field.name != self.field:
+                continue
+            low, high = flt.date_range
+            if low is not None:
+                lower = low if lower is None else max(lower, low)
+            if high is not None:
+                upper = high if upper is None else min(upper, high)
+        return lower, upper
+
+
 @autorepr
 class Fact(Table):
     """Fact table specification
@@ -416,7 +764,11 @@ class Fact(Table):
             table_name: FactName,
             display_name: str,
             fields: List[Field],
-            editable: bool = False
+            editable: bool = False,
+            rollups: Optional[List['Rollup']] = None,
+            partitioning: Optional[Partitioning] = None,
+            shards: Optional[List[str]] = None,
+            columnar: Optional[str] = None
     ) -> None:
         super(Fact, self).__init__(
             table_name=table_name,
@@ -424,6 +776,21 @@ class Fact(Table):
             fields=fields,
             editable=editable
         )
+        self.rollups = rollups or []  # type: List[Rollup]
+        for rollup in self.rollups:
+            rollup.fact = self
+        # the app still saves edits to table_name, so a partitioned fact
+        # should be read only, or table_name a view that routes the writes
+        self.partitioning = partitioning
+        if partitioning is not None:
+            partitioning.fact = self
+        # database urls of the files the fact's rows are split across; the
+        # star query runs on each of them at once (see db.fetch_shards)
+        self.shards = shards
+        # a DuckDB file or a folder of Parquet copies of the star's tables,
+        # which `python maintenance.py columnar` writes; the star's queries
+        # run there instead of on the app's database (see db.fetch_columnar)
+        self.columnar = columnar
 
     @property
     def dimensions(self) -> List[DimensionName]:
@@ -433,6 +800,36 @@ class Fact(Table):
             for fld in self.foreign_keys.values()
         ]
 
+    def source(self, filters: Optional[List[Filter]] = None) -> sqa.sql.FromClause:
+        """Where the fact's rows are read from: its table, or, if it is
+        partitioned, the union of the partitions the filters can touch under
+        the fact's name, so the fact's columns can be adapted to it
+
+        Example:
+        >>> fact = Fact(table_name='factPartitioned', display_name='P',
+        ...     fields=[Field(name='ID', dtype=FieldType.int, display_name='ID',
+        ...         primary_key=True),
+        ...     Field(name='Day', dtype=FieldType.date, display_name='Day',
+        ...         filter_operators=[Operator.date_on_or_after])],
+        ...     partitioning=Partitioning(field='Day', first_month='2016-01',
+        ...         last_month='2016-06'))
+        >>> flt = fact.filters[0]
+        >>> flt.value = '2016-05-15'
+        >>> sql = str(fact.source([flt]).select())
+        >>> [m for m in ('201604', '201605', '201606') if 'factPartitioned_' + m in sql]
+        ['201605', '201606']
+        """
+        if self.partitioning is None:
+            return self.schema
+        months = self.partitioning.months(*self.partitioning.date_range(filters or []))
+        if not months:  # the filters rule out every partition
+            return select([
+                sqa.null().label(col.name) for col in self.schema.columns
+            ]).where(sqa.false()).alias(self.table_name)
+        return sqa.union_all(*(
+            select(self.partitioning.table(month).columns) for month in months
+        )).alias(self.table_name)
+
 
 @autorepr
 class Star:
@@ -474,14 +871,395 @@ class Star:
     @property
     def star_query(self) -> Select:
         fact = self.fact.schema  # type: sqa.Table
-        star = fact
-        for dim in self.dimensions:
-            star = star.join(dim.schema)
-        qry = select(fact.columns).select_from(star)
-        for f in [flt for flt in self.filters if flt.value]:
-            qry = qry.where(f.filter)
+        if self.fact.partitioning is not None:
+            qry = self.partitioned_star_query
+        else:
+            star = fact
+            for dim in self.dimensions:
+                star = star.join(dim.schema)
+            qry = select(fact.columns).select_from(star)
+            for f in [flt for flt in self.filters if flt.value]:
+                qry = qry.where(f.filter)
+        if self.fact.shards:
+            qry = qry.execution_options(shards=tuple(self.fact.shards))
+        if self.columnar:
+            qry = qry.execution_options(columnar=self.columnar)
         return qry
 
+    @property
+    def columnar(self) -> Optional[str]:
+        """The fact's columnar copy, unless a filter is answered from a
+        full-text index, which the copy doesn't have"""
+        if any(flt.value and flt.full_text for flt in self.filters):
+            return None
+        return self.fact.columnar
+
+    @property
+    def partitioned_star_query(self) -> Select:
+        """The star query over the union of the partitions that the date
+        filters can touch
+
+        The filters stay on the outer query; SQLite pushes them into each
+        arm of the union, where they can use the partition's indexes.
+        """
+        active = [flt for flt in self.filters if flt.value]
+        source = self.fact.source(active)
+        qry = select(source.columns).select_from(self.join_dimensions(source))
+        for clause in self.active_filters:
+            qry = qry.where(replace_columns(clause, self.fact.schema, source))
+        return qry
+
+    def join_dimensions(self, source: sqa.sql.FromClause,
+            dimensions: Optional[List[DimensionName]] = None):
+        """Join the dimensions (all of them by default) to a table or
+        subquery that has the fact's foreign key columns"""
+        star = source
+        for fld in self.fact.foreign_keys.values():  # type: ForeignKey
+            if dimensions is not None and fld.dimension not in dimensions:
+                continue
+            dim = next((d for d in self.dimensions if d.table_name == fld.dimension), None)
+            if dim is None:
+                continue
+            star = star.join(dim.schema,
+                source.c[fld.name] == dim.schema.c[fld.foreign_key_field])
+        return star
+
+    @property
+    def active_filters(self) -> List[BinaryExpression]:
+        return [
+            clause for clause in (flt.filter for flt in self.filters if flt.value)
+            if clause is not None
+        ]
+
+    def aggregate_fields(self, group_by: List[FieldName],
+            aggregates: List[Tuple[str, FieldName]]) -> List[Field]:
+        """The fields of the aggregate query's result, for display and export"""
+        fields = [self.fact.field(name) for name in group_by]
+        for function, name in aggregates:
+            if name == '*':
+                dtype, display_name = FieldType.int, 'Rows'
+            else:
+                fld = self.fact.field(name)
+                dtype = {'count': FieldType.int, 'avg': FieldType.float}.get(
+                    function, fld.dtype)
+                display_name = '{} of {}'.format(function.title(), fld.display_name)
+            fields.append(Field(name=aggregate_name(function, name), dtype=dtype,
+                display_name=display_name))
+        return fields
+
+    def aggregate_query(self, group_by: List[FieldName],
+            aggregates: List[Tuple[str, FieldName]]) -> Select:
+        """Group the filtered star by fact fields and aggregate others
+
+        aggregates are (function, field name) pairs, the functions being
+        those in AGGREGATE_FUNCTIONS, and ('count', '*') counts the rows.
+        The query reads the smallest of the fact's rollups that covers the
+        group by fields, the aggregates and the active filters and is
+        current (see db.current_rollups), and the fact table only if none
+        is.  A fact with a columnar copy is scanned there instead, since the
+        rollups aren't copied, unless a filter needs SQLite's full-text
+        index.  Date fields are grouped by day.
+        """
+        if self.fact.shards:
+            raise ValueError('{} is sharded; aggregates over shards are not supported'
+                .format(self.fact.table_name))
+        unknown = [f for f, _ in aggregates if f not in AGGREGATE_FUNCTIONS]
+        if unknown:
+            raise ValueError('Unknown aggregate function(s) {}; use one of {}'
+                .format(unknown, sorted(AGGREGATE_FUNCTIONS)))
+        filters = self.active_filters
+        columnar = self.columnar
+        rollup = None
+        if not columnar and self.fact.rollups:
+            from db import current_rollups
+            rollup = self.rollup_for(group_by, aggregates, filters,
+                current_rollups(self.fact))
+        if rollup is None:
+            fact = self.fact.source([flt for flt in self.filters if flt.value])
+            source = self.join_dimensions(fact)
+            filters = [replace_columns(clause, self.fact.schema, fact) for clause in filters]
+            groups = [
+                group_column(self.fact.field(name), fact.c[name],
+                    columnar=bool(columnar))
+                for name in group_by
+            ]
+            columns = [
+                aggregate_column(function, None if name == '*' else fact.c[name])
+                    .label(aggregate_name(function, name))
+                for function, name in aggregates
+            ]
+        else:
+            source = rollup.join_dimensions(self.dimensions, filters)
+            filters = [rollup.adapt(clause) for clause in filters]
+            groups = [rollup.schema.c[name] for name in group_by]
+            columns = [
+                rollup.aggregate_column(function, name)
+                    .label(aggregate_name(function, name))
+                for function, name in aggregates
+            ]
+        qry = select(groups + columns).select_from(source)
+        for clause in filters:
+            qry = qry.where(clause)
+        if columnar:
+            qry = qry.execution_options(columnar=columnar)
+        return qry.group_by(*groups).order_by(*groups)
+
+    def rollup_for(self, group_by: List[FieldName],
+            aggregates: List[Tuple[str, FieldName]],
+            filters: List[BinaryExpression],
+            current: Optional[Set[str]] = None) -> Optional['Rollup']:
+        """The rollup with the fewest group by fields that can answer the
+        query, among the current ones if their table names are given
+
+        Example:
+        >>> from config import cfg
+        >>> star = cfg.star('factSales')
+        >>> star.rollup_for(['OrderDate'], [('sum', 'SalesAmount')], []).table_name
+        'factSales_by_day'
+        >>> star.rollup_for(['OrderDate'], [('sum', 'SalesAmount')], [],
+        ...     current={'factSales_by_product'}).table_name
+        'factSales_by_product'
+        >>> star.rollup_for(['Paid'], [('sum', 'SalesAmount')], []) is None
+        True
+        """
+        covering = [
+            rollup for rollup in self.fact.rollups
+            if (current is None or rollup.table_name in current)
+                and rollup.covers(group_by, aggregates, filters, self.dimensions)
+        ]
+        return min(covering, key=lambda r: len(r.group_by), default=None)
+
+
+def replace_columns(clause: BinaryExpression, table: sqa.Table,
+        source: sqa.sql.FromClause) -> BinaryExpression:
+    """Point a clause's references to the table's columns at the
+    columns of the same names on source"""
+    if source is table:
+        return clause
+
+    def replace(element):
+        if isinstance(element, sqa.Column) and element.table is table:
+            return source.c[element.name]
+        return None
+
+    return sqa.sql.visitors.replacement_traverse(clause, {}, replace)
+
+
+AGGREGATE_FUNCTIONS = {'avg', 'count', 'max', 'min', 'sum'}
+
+
+def aggregate_name(function: str, field: FieldName) -> str:
+    """The column name of an aggregate in a query's result
+
+    Example:
+    >>> aggregate_name('sum', 'SalesAmount'), aggregate_name('count', '*')
+    ('sum_SalesAmount', 'row_count')
+    """
+    return 'row_count' if field == '*' else '{}_{}'.format(function, field)
+
+
+def group_column(fld: Field, column: sqa.Column, columnar: bool = False) -> sqa.sql.ColumnElement:
+    """The column to group a field by: a date field may hold datetimes, so
+    it's grouped by day (a columnar copy stores dates already)
+
+    Example:
+    >>> fld = Field(name='OrderDate', dtype=FieldType.date, display_name='Order Date')
+    >>> str(group_column(fld, fld.schema))
+    'date("OrderDate")'
+    """
+    if fld.dtype != FieldType.date or columnar:
+        return column
+    return sqa.func.date(column, type_=column.type).label(fld.name)
+
+
+def aggregate_column(function: str, column: Optional[sqa.Column]) -> sqa.sql.ColumnElement:
+    """The aggregate over the column, or count(*) if the column is None"""
+    if column is None:
+        return sqa.func.count()
+    return getattr(sqa.func, function)(column)
+
+
+@autorepr
+class Rollup:
+    """A table of a fact's measures pre-aggregated by some of its fields
+
+    For each measure the rollup stores the sum, the count of values, the
+    minimum and the maximum per group, plus the number of fact rows, which
+    is enough to answer sum, count, min, max and avg for any coarser
+    grouping.  Date fields are grouped by day, and the group by fields
+    have a unique index, which the refresh merges new groups on.
+    `python maintenance.py rollups` fills it incrementally from the fact
+    rows added since its high-water mark; the fact's rows that are edited
+    or deleted afterwards are only reflected by a full refresh.
+    """
+
+    def __init__(self, *,
+            table_name: str,
+            group_by: List[FieldName],
+            measures: List[FieldName],
+            high_water_field: Optional[FieldName] = None
+    ) -> None:
+        self.table_name = table_name
+        self.group_by = group_by
+        self.measures = measures
+        self._high_water_field = high_water_field
+        self.fact = None  # type: Fact  # set by the Fact the rollup is declared on
+
+    @static_property
+    def high_water_field(self) -> FieldName:
+        """The ever increasing integer fact field the refresh resumes from"""
+        return self._high_water_field or self.fact.primary_key.name
+
+    @static_property
+    def measure_columns(self) -> Dict[str, Tuple[FieldName, str]]:
+        """Map the stored statistics' column names to their measure and
+        aggregate function"""
+        return OrderedDict(
+            ('{}_{}'.format(measure, stat), (measure, stat))
+            for measure in self.measures
+            for stat in ('sum', 'count', 'min', 'max')
+        )
+
+    @static_property
+    def schema(self) -> sqa.Table:
+        cols = [
+            Field(name=name, dtype=self.fact.field(name).dtype, display_name=name).schema
+            for name in self.group_by
+        ]
+        for name, (measure, stat) in self.measure_columns.items():
+            dtype = FieldType.int if stat == 'count' else self.fact.field(measure).dtype
+            cols.append(Field(name=name, dtype=dtype, display_name=name).schema)
+        cols.append(sqa.Column('row_count', sqa.Integer))
+        cols.append(sqa.Index('ux_{}'.format(self.table_name), *self.group_by, unique=True))
+        return sqa.Table(self.table_name, md, *cols)
+
+    def delta_query(self, low: Optional[SqlDataType], high: SqlDataType) -> Select:
+        """Aggregate the fact rows past the low water mark, up to the high"""
+        fact = self.fact.source()
+        mark = fact.c[self.high_water_field]
+        groups = [group_column(self.fact.field(name), fact.c[name]) for name in self.group_by]
+        stats = [
+            aggregate_column(stat, fact.c[measure]).label(name)
+            for name, (measure, stat) in self.measure_columns.items()
+        ]
+        qry = select(groups + stats + [sqa.func.count().label('row_count')]) \
+            .where(mark <= high)
+        if low is not None:
+            qry = qry.where(mark > low)
+        return qry.group_by(*groups)
+
+    def aggregate_column(self, function: str, field: FieldName) -> sqa.sql.ColumnElement:
+        """Re-aggregate the stored statistics for a coarser grouping"""
+        c = self.schema.c
+        if field == '*':
+            return sqa.func.sum(c.row_count)
+        if function == 'avg':
+            return sqa.cast(sqa.func.sum(c[field + '_sum']), sqa.Float) \
+                / sqa.func.sum(c[field + '_count'])
+        if function == 'count':
+            return sqa.func.sum(c[field + '_count'])
+        return getattr(sqa.func, function)(c['{}_{}'.format(field, function)])
+
+    def covers(self, group_by: List[FieldName],
+            aggregates: List[Tuple[str, FieldName]],
+            filters: List[BinaryExpression],
+            dimensions: List[Dimension]) -> bool:
+        """Can the rollup answer the query?
+
+        It can if it groups by every field the query groups by, stores
+        every measure aggregated, and every column the filters compare is
+        one it groups by, or belongs to a dimension whose foreign key it
+        groups by.
+        """
+        if not set(group_by) <= set(self.group_by):
+            return False
+        if any(name != '*' and name not in self.measures for _, name in aggregates):
+            return False
+        dimension_keys = {
+            fld.dimension: fld.name for fld in self.fact.foreign_keys.values()
+        }
+        for clause in filters:
+            for column in sqa.sql.visitors.iterate(clause, {}):
+                if not isinstance(column, sqa.sql.expression.ColumnClause):
+                    continue
+                table = column.table
+                if table is self.fact.schema and column.name in self.group_by:
+                    continue
+                if table is not None and dimension_keys.get(table.name) in self.group_by \
+                        and any(dim.schema is table for dim in dimensions):
+                    continue
+                return False
+        return True
+
+    def adapt(self, clause: BinaryExpression) -> BinaryExpression:
+        """Point a filter on the fact's columns at the rollup's"""
+        return replace_columns(clause, self.fact.schema, self.schema)
+
+    def join_dimensions(self, dimensions: List[Dimension],
+            filters: List[BinaryExpression]):
+        """The rollup joined to the dimensions the filters refer to"""
+        referenced = {
+            column.table.name
+            for clause in filters
+            for column in sqa.sql.visitors.iterate(clause, {})
+            if isinstance(column, sqa.sql.expression.ColumnClause)
+                and column.table is not None
+        }
+        source = self.schema
+        for fld in self.fact.foreign_keys.values():  # type: ForeignKey
+            if fld.dimension not in referenced:
+                continue
+            dim = next(d for d in dimensions if d.table_name == fld.dimension)
+            source = source.join(dim.schema,
+                self.schema.c[fld.name] == dim.schema.c[fld.foreign_key_field])
+        return source
+
+
+# the fact value each rollup has been refreshed up to
+rollup_watermarks = sqa.Table('rollup_watermarks', sqa.MetaData(),
+    sqa.Column('rollup', sqa.String, primary_key=True),
+    sqa.Column('high_water', sqa.Integer)
+)
+
+_criteria_lock = threading.Lock()
+
+
+@contextmanager
+def criteria_applied(source: Union[Star, Dimension], criteria: Dict[str, str]):
+    """Set the source's filter values for the duration of the block, under a
+    lock, and restore the values the user has entered afterwards.
+
+    criteria maps filter display names (eg 'Order Date On or After') to
+    values.  Statements capture their bound values when they are built, so
+    build them inside the block and run them after it.
+    """
+    filters = {flt.display_name: flt for flt in source.filters}
+    unknown = sorted(set(criteria) - set(filters))
+    if unknown:
+        raise KeyError("Unknown filter(s) {}; the filters available are {}"
+            .format(unknown, sorted(filters)))
+    with _criteria_lock:
+        previous = {name: flt._value for name, flt in filters.items()}
+        try:
+            for name, flt in filters.items():
+                flt.value = criteria.get(name, '')
+            yield source
+        finally:
+            for name, flt in filters.items():
+                flt.value = previous[name]
+
+
+def select_with_criteria(source: Union[Star, Dimension],
+        criteria: Dict[str, str], max_rows: int) -> Select:
+    """Build the select statement of a Star or Dimension for a set of filter
+    values without disturbing the values the user has entered.
+
+    The filters are restored straight after the statement is built, which
+    lets several threads build statements from the shared config at once.
+    """
+    with criteria_applied(source, criteria):
+        return source.select(max_rows=max_rows)
+
 
 @autorepr
 class View:
@@ -494,18 +1272,24 @@ class View:
             aggregate_function: str
     ) -> None:
         self._fact_table = fact_table
+        self.group_by_fields = group_by_fields
+        self.aggregate_field = aggregate_field
+        self.aggregate_function = aggregate_function
 
     @static_property
     def star(self) -> Star:
         from config import cfg
-        return cfg.star[self._fact_table]
+        return cfg.star(self._fact_table)
 
     @static_property
     def filters(self) -> List[Filter]:
         return self.star.filters
 
     def select(self, max_rows: int = 1000) -> Select:
-        return self.star.star_query
+        return self.star.aggregate_query(
+            self.group_by_fields,
+            [(self.aggregate_function, self.aggregate_field)]
+        ).limit(max_rows)
 
 
 class Constellation:
@@ -523,6 +1307,8 @@ class Constellation:
             tbl.table_name: {}
             for tbl in dimensions
         }  # type: Dict[str, Dict[int, str]]
+        self._pending_foreign_keys = {}  # type: Dict[str, Future]
+        self._foreign_keys_lock = threading.Lock()
 
     @static_property
     def stars(self) -> Dict[FactName, Star]:
@@ -533,7 +1319,17 @@ class Constellation:
 
     @static_property
     def tables(self) -> List[Table]:
-        return chain(self.facts, self.dimensions)
+        return list(chain(self.facts, self.dimensions))
+
+    def table(self, name: str) -> Table:
+        """Look up a Fact or Dimension by its table name or display name"""
+        try:
+            return next(
+                tbl for tbl in self.tables
+                if name in (tbl.table_name, tbl.display_name)
+            )
+        except StopIteration:
+            raise KeyError("{} is not a table in the constellation".format(name))
 
     @property
     def foreign_key_lookups(self) -> Dict[DimensionName, Select]:
@@ -546,12 +1342,39 @@ class Constellation:
         ForeignKeyValue, SqlDataType]:
         if self._foreign_keys[dim]:
             return self._foreign_keys[dim]
-        self.pull_foreign_keys(dim)
+        with self._foreign_keys_lock:
+            pending = self._pending_foreign_keys.get(dim)
+        if pending is None:
+            self.pull_foreign_keys(dim)
+            return self._foreign_keys[dim]
+        try:
+            pending.result()  # wait for the prefetch rather than query twice
+        finally:
+            with self._foreign_keys_lock:
+                self._pending_foreign_keys.pop(dim, None)
         return self._foreign_keys[dim]
 
+    def prefetch_foreign_keys(self, dims: List[DimensionName] = None,
+            max_workers: int = 4) -> None:
+        """Pull the foreign key lookups for the dimensions in the background
+
+        Returns immediately.  A caller that asks for a dimension's lookup
+        before its prefetch is done waits for it instead of running the
+        query again.
+        """
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        with self._foreign_keys_lock:
+            for dim in dims or [tbl.table_name for tbl in self.dimensions]:
+                if self._foreign_keys[dim] or dim in self._pending_foreign_keys:
+                    continue
+                self._pending_foreign_keys[dim] = executor.submit(
+                    self.pull_foreign_keys, dim)
+        executor.shutdown(wait=False)
+
     def pull_foreign_keys(self, dim: DimensionName) -> None:
         select_statement = self.foreign_key_lookups[dim]  # type: Select
         from db import fetch
+        from sortedcollections import ValueSortedDict
         self._foreign_keys[dim] = ValueSortedDict({
             row[0]: str(row[1])
             for row in fetch(select_statement)
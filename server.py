@@ -0,0 +1,294 @@
+"""Serve the constellation's stars over HTTP on the local network.
+
+This is an optional, stdlib-only asyncio service for teams that want the
+same curated stars the desktop app shows without opening the database file
+themselves.  All clients share the process's engine, and so its connection
+pool, rather than each opening the database file.
+
+Endpoints:
+    GET /stars                          the stars and their filters
+    GET /stars/<fact>/filters           the filter display names of a star
+    GET /stars/<fact>/rows?...          query results
+
+/rows takes format=jsonl (default) or csv, limit and offset for paging, and
+any other query parameters are filter values keyed by filter display name,
+eg /stars/factSales/rows?limit=100&Order%20Date%20On%20or%20After=2016-01-01
+Without a limit the whole result (up to maximum_export_rows) is streamed.
+Pages go through the app's result cache when it's on (see result_cache),
+which the desktop app shares.
+
+Example:
+    python server.py --port 8765
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import csv
+import datetime
+import io
+import json
+import threading
+from typing import Dict, List
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from config import cfg
+from db import fetch, fetch_arrow, iterbatches
+from result_cache import cached_rows, get_cache, store_rows
+from schema import Constellation, Star, select_with_criteria
+
+MAX_PAGE_SIZE = 10000
+STREAM_QUEUE_SIZE = 4  # batches buffered ahead of a slow client
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+class StreamAborted(Exception):
+    """A stream failed after its 200 status was sent, so all that's left
+    is to close the connection early"""
+
+
+def json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class QueryService:
+    """Answer HTTP requests for the stars of a Constellation"""
+
+    def __init__(self, constellation: Constellation = cfg,
+            max_workers: int = 8) -> None:
+        self.constellation = constellation
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass  # headers aren't used
+            if len(request_line) < 2:
+                raise HttpError(400, 'Malformed request line')
+            if request_line[0] != 'GET':
+                raise HttpError(405, 'Only GET is supported')
+            await self.route(request_line[1], writer)
+        except HttpError as e:
+            self.write_head(writer, e.status, 'application/json')
+            writer.write(json.dumps({'error': str(e)}).encode('utf-8'))
+        except (ConnectionError, StreamAborted):
+            pass
+        except Exception as e:
+            self.write_head(writer, 500, 'application/json')
+            writer.write(json.dumps({'error': str(e)}).encode('utf-8'))
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def route(self, target: str, writer: asyncio.StreamWriter) -> None:
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        params = OrderedDict(parse_qsl(url.query, keep_blank_values=False))
+        if parts == ['stars']:
+            self.write_json(writer, [
+                {
+                    'name': name,
+                    'display_name': star.fact.display_name,
+                    'filters': [flt.display_name for flt in star.filters],
+                }
+                for name, star in sorted(self.constellation.stars.items())
+            ])
+        elif len(parts) == 3 and parts[0] == 'stars' and parts[2] == 'filters':
+            star = self.star(parts[1])
+            self.write_json(writer, [flt.display_name for flt in star.filters])
+        elif len(parts) == 3 and parts[0] == 'stars' and parts[2] == 'rows':
+            await self.rows(self.star(parts[1]), params, writer)
+        else:
+            raise HttpError(404, 'No such resource: {}'.format(url.path))
+
+    def star(self, name: str) -> Star:
+        try:
+            return self.constellation.star(name)
+        except KeyError:
+            raise HttpError(404, 'No such star: {}'.format(name))
+
+    async def rows(self, star: Star, params: Dict[str, str],
+            writer: asyncio.StreamWriter) -> None:
+        fmt = params.pop('format', 'jsonl')
+        if fmt not in ('jsonl', 'csv'):
+            raise HttpError(400, 'format must be jsonl or csv')
+        try:
+            limit = int(params.pop('limit')) if 'limit' in params else None
+            offset = int(params.pop('offset', 0))
+        except ValueError:
+            raise HttpError(400, 'limit and offset must be integers')
+        if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+            raise HttpError(400, 'limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+        try:
+            qry = select_with_criteria(
+                star,
+                params,
+                max_rows=limit or self.constellation.app.maximum_export_rows
+            ).order_by(star.fact.primary_key).offset(offset or None)
+        except KeyError as e:
+            raise HttpError(400, str(e))
+
+        fields = star.fact.fields
+        encode = self.encoder(fmt, [fld.name for fld in fields])
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        loop = asyncio.get_event_loop()
+        if limit is None:
+            await self.stream(qry, encode, content_type, writer)
+            return
+        # the head waits for the page, so a failed query gets a 500 status
+        rows = await loop.run_in_executor(self.executor, self.page, qry, star)
+        self.write_head(writer, 200, content_type)
+        writer.write(encode(None))  # csv header
+        writer.write(encode(rows))
+
+    @staticmethod
+    def page(qry, star: Star) -> List:
+        """Fetch a page of rows, from the result cache when it's on
+
+        A cached page is an Arrow table typed from the fact's fields, so
+        with the cache on every page is read through Arrow, hit or miss,
+        and holds the fields' types (dates as dates) rather than the
+        database's raw values.
+        """
+        if get_cache() is None:
+            return fetch(qry)
+        fields = star.fact.fields
+        key, rows = cached_rows(qry, star.fact.table_name, fields)
+        if rows is None:
+            rows = fetch_arrow(qry, fields)
+            store_rows(key, rows)
+        return list(zip(*(col.to_pylist() for col in rows.arrays)))
+
+    async def stream(self, qry, encode, content_type: str,
+            writer: asyncio.StreamWriter) -> None:
+        """Stream batches to the client as a worker thread fetches them
+
+        One thread owns the cursor for its whole life (SQLite connections
+        can't move between threads), and the bounded queue stops it from
+        running ahead of a slow client.  The head is written once the
+        first batch (or the end, or an error) arrives, so a query that
+        fails outright still gets an error status.
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        done = object()
+        cancelled = threading.Event()
+
+        def produce() -> None:
+            try:
+                with closing(iterbatches(qry)) as results:
+                    for batch in results:
+                        if cancelled.is_set():
+                            return
+                        asyncio.run_coroutine_threadsafe(
+                            queue.put(batch), loop).result()
+            except Exception as e:
+                asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        started = False
+        try:
+            while True:
+                batch = await queue.get()
+                if isinstance(batch, Exception):
+                    if started:
+                        raise StreamAborted(str(batch)) from batch
+                    raise batch
+                if not started:
+                    self.write_head(writer, 200, content_type)
+                    writer.write(encode(None))  # csv header
+                    started = True
+                if batch is done:
+                    break
+                writer.write(encode(batch))
+                await writer.drain()
+        finally:
+            cancelled.set()
+            while not queue.empty():  # unblock the producer
+                queue.get_nowait()
+            await producer
+
+    @staticmethod
+    def encoder(fmt: str, names: List[str]):
+        """Return a function that encodes a batch of rows for the response
+
+        Called with None it returns the preamble (the csv header).
+        """
+        def encode_jsonl(rows) -> bytes:
+            if rows is None:
+                return b''
+            return ''.join(
+                json.dumps(dict(zip(names, row)), default=json_default) + '\n'
+                for row in rows
+            ).encode('utf-8')
+
+        def encode_csv(rows) -> bytes:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerows([names] if rows is None else rows)
+            return buffer.getvalue().encode('utf-8')
+
+        return encode_csv if fmt == 'csv' else encode_jsonl
+
+    @staticmethod
+    def write_head(writer: asyncio.StreamWriter, status: int, content_type: str) -> None:
+        writer.write((
+            'HTTP/1.1 {} {}\r\n'
+            'Content-Type: {}; charset=utf-8\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        ).format(status, STATUS_TEXT[status], content_type).encode('latin-1'))
+
+    def write_json(self, writer: asyncio.StreamWriter, value) -> None:
+        self.write_head(writer, 200, 'application/json')
+        writer.write(json.dumps(value, default=json_default).encode('utf-8'))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(QueryService().start(args.host, args.port))
+    print('Serving {} on http://{}:{}'.format(
+        cfg.app.display_name, args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Time the app's imports and start up stages
+
+Run the app with --profile-startup to print, once the main window is on
+screen, where the time to window went: the modules that took longest to
+import (their own time, not counting the imports they triggered), the
+import time per top level package, and the time at which each start up
+stage finished.
+
+Example:
+    python main.py --profile-startup
+"""
+from collections import defaultdict
+import importlib.abc
+import sys
+import time
+from typing import Dict, List, Tuple
+
+_start_time = time.perf_counter()
+_stages = []  # type: List[Tuple[str, float]]
+_import_times = {}  # type: Dict[str, float]  # module -> own seconds
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wrap a module's loader to time its creation and execution"""
+
+    _stack = []  # type: List[List[float]]  # [start, child seconds] per import
+
+    def __init__(self, name: str, loader) -> None:
+        self.name = name
+        self.loader = loader
+
+    def __getattr__(self, attr: str):
+        return getattr(self.loader, attr)
+
+    def _timed(self, func, *args):
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            return func(*args)
+        finally:
+            self._stack.pop()
+            total = time.perf_counter() - frame[0]
+            _import_times[self.name] = _import_times.get(self.name, 0.0) + total - frame[1]
+            if self._stack:
+                self._stack[-1][1] += total
+
+    def create_module(self, spec):
+        return self._timed(self.loader.create_module, spec)
+
+    def exec_module(self, module) -> None:
+        module.__loader__ = self.loader
+        self._timed(self.loader.exec_module, module)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Find modules with the other finders and time them as they load"""
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(fullname, spec.loader)
+                return spec
+        return None
+
+
+def enable() -> None:
+    """Start timing imports; call this before the app's own imports"""
+    if not any(isinstance(finder, _ImportTimer) for finder in sys.meta_path):
+        sys.meta_path.insert(0, _ImportTimer())
+    mark('profiler enabled')
+
+
+def mark(stage: str) -> None:
+    """Record that a start up stage has finished"""
+    _stages.append((stage, time.perf_counter() - _start_time))
+
+
+def report(top: int = 25, file=None) -> None:
+    file = file or sys.stderr
+    packages = defaultdict(float)  # type: Dict[str, float]
+    for name, seconds in _import_times.items():
+        packages[name.split('.')[0]] += seconds
+
+    print('Start up stages (seconds since the profiler loaded):', file=file)
+    for stage, seconds in _stages:
+        print('    {:8.3f}  {}'.format(seconds, stage), file=file)
+    print('Import time by top level package:', file=file)
+    for name, seconds in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+        print('    {:8.3f}  {}'.format(seconds, name), file=file)
+    print('Slowest modules (own import time):', file=file)
+    for name, seconds in sorted(_import_times.items(), key=lambda kv: -kv[1])[:top]:
+        print('    {:8.3f}  {}'.format(seconds, name), file=file)
@@ -0,0 +1,222 @@
+"""Generate a synthetic warehouse for the facts in config at any scale
+
+Unlike fake_data, which inserts one Faker row per statement, this builds
+whole columns at a time from a seeded random generator and loads them with
+executemany in large transactions, so 10^6 fact rows take seconds and 10^8
+is practical.  The tables are built from the Fact and Dimension definitions
+in config.cfg, so any star can be populated, not just factSales.
+
+Values are skewed the way real sales data is: a few products and customers
+account for most of the orders (Zipf), recent dates are busier than old
+ones and amounts are log-normal.
+
+Example:
+    python tests/bulk_data.py --rows 1000000 --db test.db --seed 42
+"""
+import argparse
+from bisect import bisect_left
+import datetime
+from itertools import accumulate
+import os
+import random
+import sqlite3
+import sys
+import time
+from typing import Callable, Dict, List, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import cfg
+from schema import (Constellation, Dimension, Field, FieldType, ForeignKey, SQLITE_TYPES,
+    Table)
+
+BATCH_SIZE = 100000
+FIRST_DATE = datetime.date(2010, 1, 1)
+LAST_DATE = datetime.date(2016, 12, 31)
+
+WORDS = (
+    'amber arbor birch cedar coral delta ember falcon garnet harbor indigo '
+    'juniper kestrel laurel maple meadow north oak pine quarry raven river '
+    'sable spruce summit timber umber valley willow yarrow zenith'
+).split()
+FIRST_NAMES = (
+    'Ada Alan Ana Ben Carl Chloe Dan Eva Finn Grace Hugo Ivy Jack Jane Kim '
+    'Leo Lucy Mark Mia Noah Omar Paul Rosa Sam Tara Uma Vera Will Zoe'
+).split()
+LAST_NAMES = (
+    'Adams Baker Chen Diaz Evans Fischer Garcia Hill Ito Jones Khan Lopez '
+    'Miller Nguyen Olsen Patel Quinn Reyes Smith Tanaka Usman Varga Walsh '
+    'Young Zhang'
+).split()
+CATEGORIES = (
+    'Clothing Groceries Electronics Household Toiletries Medicine Office '
+    'Garden Toys Sports Books Music'
+).split()
+
+
+class ColumnGenerator:
+    """Build columns of synthetic values for the fields of a table"""
+
+    def __init__(self, rng: random.Random, dimension_sizes: Dict[str, int],
+            zipf_exponent: float = 1.1) -> None:
+        self.rng = rng
+        self.dimension_sizes = dimension_sizes
+        self.zipf_exponent = zipf_exponent
+        self._cum_weights = {}  # type: Dict[int, List[float]]
+        span = (LAST_DATE - FIRST_DATE).days
+        self.days = [
+            (FIRST_DATE + datetime.timedelta(days=d)).isoformat()
+            for d in range(span + 1)
+        ]
+        self.clock = ['{:02d}:{:02d}:00'.format(h, m) for h in range(24) for m in range(60)]
+
+    def zipf(self, n: int, k: int) -> List[int]:
+        """k keys between 1 and n, where key i has weight 1 / i**s"""
+        if n not in self._cum_weights:
+            self._cum_weights[n] = list(accumulate(
+                1 / (i ** self.zipf_exponent) for i in range(1, n + 1)))
+        cum = self._cum_weights[n]
+        total = cum[-1]
+        rand = self.rng.random
+        return [bisect_left(cum, rand() * total) + 1 for _ in range(k)]
+
+    def column(self, fld: Field, start: int, k: int) -> Sequence:
+        """k values for the field, for the rows numbered from start"""
+        rng = self.rng
+        if fld.primary_key and not isinstance(fld, ForeignKey):
+            return range(start, start + k)
+        if isinstance(fld, ForeignKey):
+            return self.zipf(self.dimension_sizes[fld.dimension], k)
+        if fld.dtype == FieldType.date:
+            last = len(self.days) - 1
+            days, clock = self.days, self.clock
+            # triangular with the mode at the end, so recent days are busier
+            return [
+                days[int(rng.triangular(0, last, last))] + ' ' + rng.choice(clock)
+                for _ in range(k)
+            ]
+        if fld.dtype == FieldType.float:
+            return [round(rng.lognormvariate(4, 1), 2) for _ in range(k)]
+        if fld.dtype == FieldType.int:
+            return [rng.randint(0, 1000000) for _ in range(k)]
+        if fld.dtype == FieldType.bool:
+            return [1 if rng.random() < 0.8 else 0 for _ in range(k)]
+        return self.strings(fld.name, k)
+
+    def strings(self, name: str, k: int) -> List[str]:
+        rng = self.rng
+        choice = rng.choice
+        lowered = name.lower()
+        if 'address' in lowered:
+            return [
+                '{} {} {} St'.format(rng.randint(1, 9999), choice(WORDS).title(),
+                    choice(WORDS).title())
+                for _ in range(k)
+            ]
+        if 'category' in lowered:
+            return [choice(CATEGORIES) for _ in range(k)]
+        if 'customer' in lowered or (lowered.endswith('name') and 'product' not in lowered):
+            return [choice(FIRST_NAMES) + ' ' + choice(LAST_NAMES) for _ in range(k)]
+        return [
+            '{} {} {}'.format(choice(WORDS).title(), choice(WORDS), rng.randint(1, 999))
+            for _ in range(k)
+        ]
+
+
+def create_table(con: sqlite3.Connection, table: Table) -> None:
+    con.execute('DROP TABLE IF EXISTS "{}"'.format(table.table_name))
+    con.execute('CREATE TABLE "{t}" ({cols})'.format(
+        t=table.table_name,
+        cols=', '.join(
+            '"{}" {}{}'.format(
+                fld.name,
+                'DATETIME' if fld.dtype == FieldType.date else SQLITE_TYPES[fld.dtype],
+                ' PRIMARY KEY' if fld.primary_key and not isinstance(fld, ForeignKey) else ''
+            )
+            for fld in table.fields
+        )
+    ))
+
+
+def load_table(con: sqlite3.Connection, table: Table, rows: int,
+        generator: ColumnGenerator, progress: Callable[[str, int], None] = None) -> None:
+    """Create the table and fill it with rows, BATCH_SIZE rows per executemany"""
+    create_table(con, table)
+    insert = 'INSERT INTO "{t}" VALUES ({p})'.format(
+        t=table.table_name,
+        p=', '.join('?' for _ in table.fields)
+    )
+    with con:  # a single transaction per table
+        for start in range(1, rows + 1, BATCH_SIZE):
+            k = min(BATCH_SIZE, rows + 1 - start)
+            columns = [generator.column(fld, start, k) for fld in table.fields]
+            con.executemany(insert, zip(*columns))
+            if progress:
+                progress(table.table_name, start + k - 1)
+
+
+def generate(*, db_path: str, fact_rows: int, dimension_ratio: float = 0.01,
+        seed: int = 0, facts: List[str] = None,
+        constellation: Constellation = cfg,
+        progress: Callable[[str, int], None] = None) -> Dict[str, int]:
+    """Build the facts (all of them by default) and their dimensions
+
+    Each dimension gets fact_rows * dimension_ratio rows (at least 10).
+    Returns the number of rows loaded per table.
+    """
+    selected = [
+        f for f in constellation.facts
+        if facts is None or f.table_name in facts
+    ]
+    dimensions = [
+        dim for dim in constellation.dimensions
+        if any(dim.table_name in f.dimensions for f in selected)
+    ]  # type: List[Dimension]
+    sizes = {
+        dim.table_name: max(10, int(fact_rows * dimension_ratio))
+        for dim in dimensions
+    }
+    generator = ColumnGenerator(random.Random(seed), sizes)
+    con = sqlite3.connect(db_path)
+    try:
+        con.execute('PRAGMA journal_mode = OFF')
+        con.execute('PRAGMA synchronous = OFF')
+        con.execute('PRAGMA cache_size = -200000')
+        for dim in dimensions:
+            load_table(con, dim, sizes[dim.table_name], generator, progress)
+        for fact in selected:
+            load_table(con, fact, fact_rows, generator, progress)
+            sizes[fact.table_name] = fact_rows
+    finally:
+        con.close()
+    return sizes
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='test.db', help='SQLite file to (re)build')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per fact')
+    parser.add_argument('--dimension-ratio', type=float, default=0.01,
+        help='dimension rows per fact row')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fact', action='append', dest='facts',
+        help='only build this fact (repeatable); all facts by default')
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+
+    def progress(table: str, rows: int) -> None:
+        print('{}: {:,} rows ({:.1f}s)'.format(table, rows, time.time() - start_time))
+
+    generate(
+        db_path=args.db,
+        fact_rows=args.rows,
+        dimension_ratio=args.dimension_ratio,
+        seed=args.seed,
+        facts=args.facts,
+        progress=progress
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import pytest
+from sqlalchemy import create_engine
+
+from bulk_data import generate
+import db
+
+
+@pytest.fixture
+def warehouse(tmpdir, monkeypatch):
+    """A small generated warehouse that the db module's engine points at"""
+    path = str(tmpdir.join('warehouse.db'))
+    generate(db_path=path, fact_rows=200)
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    return db.engine
@@ -0,0 +1,93 @@
+import datetime
+import operator
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from arrow_rows import ArrowRows, column_totals, record_batch
+from config import cfg
+import db
+from export_sinks import ParquetSink
+from schema import convert_rows, Field, FieldType, select_with_criteria
+
+FIELDS = [
+    Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+    Field(name='Name', dtype=FieldType.str, display_name='Name'),
+    Field(name='Day', dtype=FieldType.date, display_name='Day'),
+    Field(name='Amount', dtype=FieldType.float, display_name='Amount'),
+]
+
+ROWS = [
+    (1, 'b', '2016-01-02', 2.5),
+    (2, '', '2016-01-01', 1.0),
+    (3, 'a', None, 4.5),
+]
+
+
+def test_rows_read_cells_lazily():
+    rows = ArrowRows.from_batches([record_batch(FIELDS, ROWS)], FIELDS)
+    assert len(rows) == 3 and rows
+    assert rows[-1][1] == 'a'
+    with pytest.raises(IndexError):
+        rows[3]
+    assert not ArrowRows.from_batches([], FIELDS)
+
+
+def test_rows_hold_the_values_of_the_list_path():
+    rows = ArrowRows.from_batches([record_batch(FIELDS, ROWS)], FIELDS)
+    expected = convert_rows(FIELDS, ROWS)
+    assert [list(rows[i]) for i in range(len(rows))] == expected
+    assert [list(row) for row in rows] == expected
+    assert rows[1][1] == '' and rows[2][2] == ''
+    assert rows.unique(2) == ['2016-01-02', '2016-01-01', '']
+
+
+def test_sort_orders_like_the_list_path():
+    rows = ArrowRows.from_batches([record_batch(FIELDS, ROWS)], FIELDS)
+    expected = convert_rows(FIELDS, ROWS)
+    for col in range(len(FIELDS)):
+        ascending = sorted(expected, key=operator.itemgetter(col))
+        assert [list(row) for row in rows.sort(col)] == ascending
+        assert [list(row) for row in rows.sort(col, descending=True)] == ascending[::-1]
+
+
+def test_chunks_are_combined_once():
+    batch = record_batch(FIELDS, ROWS)
+    rows = ArrowRows(pa.Table.from_batches([batch] * 3))
+    assert all(not isinstance(col, pa.ChunkedArray) for col in rows.arrays)
+    assert rows[7][0] == 2 and len(rows.sort(0)) == 9
+
+
+def test_totals_use_the_columns():
+    rows = ArrowRows.from_batches([record_batch(FIELDS, ROWS)], FIELDS)
+    assert column_totals(rows, 3, FieldType.float) == [8.0, pytest.approx(8 / 3)]
+    assert column_totals(rows, 2, FieldType.date) == \
+        [datetime.date(2016, 1, 1), datetime.date(2016, 1, 2)]
+    assert column_totals(rows, 1, FieldType.str) == [3]
+
+
+def test_fetch_arrow_matches_fetch(warehouse):
+    fact = cfg.table('factSales')
+    qry = select_with_criteria(cfg.star('factSales'), {'Order Date On or After': '2016-06-01'},
+        max_rows=1000)
+    expected = [tuple(row) for row in db.fetch(qry)]
+    rows = db.fetch_arrow(qry, fact.fields)
+    assert len(rows) == len(expected) > 0
+    assert [row[0] for row in rows] == [row[0] for row in expected]
+    assert rows.column(0).type == pa.int64()
+
+
+def test_parquet_export_writes_arrow_batches(warehouse, tmpdir):
+    fact = cfg.table('factSales')
+    qry = select_with_criteria(cfg.star('factSales'), {}, max_rows=150)
+    path = str(tmpdir.join('sales.parquet'))
+    sink = ParquetSink(path, fields=fact.fields,
+        headers=[fld.display_name for fld in fact.fields])
+    assert sink.writes_arrow
+    for batch in db.iterarrow(qry, fact.fields, batch_size=100):
+        sink.write_batch(batch)
+    sink.close()
+    assert sink.rows_written == 150
+    assert pq.read_table(path).num_rows == 150
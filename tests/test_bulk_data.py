@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+
+from bulk_data import generate
+
+
+def dump(path):
+    with sqlite3.connect(path) as con:
+        return con.execute("SELECT * FROM factSales ORDER BY OrderID").fetchall()
+
+
+def test_generate(tmpdir):
+    path = str(tmpdir.join('bulk.db'))
+    sizes = generate(db_path=path, fact_rows=2000, dimension_ratio=0.05, seed=1)
+    assert sizes == {'dimProduct': 100, 'dimCustomer': 100, 'factSales': 2000}
+    with sqlite3.connect(path) as con:
+        orphans = con.execute("""
+            SELECT COUNT(*) FROM factSales f
+            LEFT JOIN dimProduct p ON p.ID = f.ProductID
+            WHERE p.ID IS NULL
+        """).fetchone()[0]
+    assert orphans == 0
+
+
+def test_generate_is_reproducible(tmpdir):
+    a, b = str(tmpdir.join('a.db')), str(tmpdir.join('b.db'))
+    generate(db_path=a, fact_rows=500, seed=7)
+    generate(db_path=b, fact_rows=500, seed=7)
+    assert dump(a) == dump(b)
+
+
+if __name__ == '__main__':
+    pytest.main(__file__)
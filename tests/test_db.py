@@ -0,0 +1,187 @@
+from contextlib import closing
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from config import cfg
+import db
+import logger
+from schema import (Fact, Field, FieldType, ForeignKey, Operator, select_with_criteria,
+    Star)
+
+SHARDED = Fact(
+    table_name='factSharded',
+    display_name='Sharded',
+    fields=[
+        Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+        ForeignKey(name='CustomerID', display_name='Customer',
+            dimension='dimCustomer', foreign_key_field='ID'),
+        Field(name='Amount', dtype=FieldType.float, display_name='Amount'),
+    ]
+)
+
+
+@pytest.fixture
+def sharded(tmpdir, monkeypatch):
+    """Customers in the app's database, and the fact's rows in three shards"""
+    warehouse = str(tmpdir.join('warehouse.db'))
+    with sqlite3.connect(warehouse) as con:
+        con.execute('CREATE TABLE dimCustomer (ID INTEGER PRIMARY KEY, '
+            'CustomerName TEXT, ShippingAddress TEXT)')
+        con.executemany('INSERT INTO dimCustomer VALUES (?, ?, ?)',
+            [(1, 'Ann', ''), (2, 'Bob', '')])
+    urls = []
+    for shard in range(3):
+        path = str(tmpdir.join('shard{}.db'.format(shard)))
+        with sqlite3.connect(path) as con:
+            con.execute('CREATE TABLE factSharded (ID INTEGER PRIMARY KEY, '
+                'CustomerID INTEGER, Amount REAL)')
+            con.executemany('INSERT INTO factSharded VALUES (?, ?, ?)', [
+                (i, i % 2 + 1, float(i)) for i in range(shard, 30, 3)])
+        urls.append('sqlite:///' + path)
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + warehouse))
+    monkeypatch.setattr(db, '_shard_engines', {})
+    monkeypatch.setattr(SHARDED, 'shards', urls)
+    return Star(fact=SHARDED, dimensions=cfg.dimensions)
+
+
+def test_sharded_star_merges_order_and_limit(sharded):
+    qry = select_with_criteria(sharded, {}, max_rows=5) \
+        .order_by(SHARDED.schema.c.Amount.desc())
+    assert [row[0] for row in db.fetch(qry)] == [29, 28, 27, 26, 25]
+    assert [row[0] for row in db.fetch(qry.offset(4))] == [25, 24, 23, 22, 21]
+    assert len(db.fetch(select_with_criteria(sharded, {}, max_rows=100))) == 30
+
+
+def test_sharded_star_joins_the_warehouse_dimensions(sharded):
+    qry = select_with_criteria(sharded, {'Customer Like': 'bo'}, max_rows=100) \
+        .order_by(SHARDED.primary_key)
+    assert [row[0] for row in db.fetch(qry)] == list(range(1, 30, 2))
+
+
+def test_sharded_iterbatches(sharded):
+    qry = select_with_criteria(sharded, {}, max_rows=25).order_by(SHARDED.primary_key)
+    with closing(db.iterbatches(qry, batch_size=10)) as results:
+        batches = [[row[0] for row in batch] for batch in results]
+    assert batches == [list(range(10)), list(range(10, 20)), list(range(20, 25))]
+
+
+@pytest.fixture
+def logs(tmpdir, monkeypatch):
+    """Keep the logs a test writes in tmpdir"""
+    monkeypatch.setattr(logger, 'rootdir', lambda: str(tmpdir))
+    monkeypatch.setattr(logger, '_listeners', [])
+    for name in ('main', 'slow_queries'):
+        monkeypatch.setattr(logger.logging.getLogger(name), 'handlers', [])
+        # file_log stops propagation, which would otherwise outlast the test
+        monkeypatch.setattr(logger.logging.getLogger(name), 'propagate', True)
+    yield tmpdir.join('logs')
+    logger.stop_listeners()
+
+
+def test_sharded_order_by_must_be_selected(sharded, logs):
+    qry = select_with_criteria(sharded, {}, max_rows=5) \
+        .order_by(cfg.table('dimCustomer').schema.c.CustomerName)
+    with pytest.raises(ValueError):
+        db.fetch(qry)
+
+
+def test_slow_sharded_query_logged_without_plan(sharded, logs, monkeypatch):
+    monkeypatch.setattr(cfg.app, 'slow_query_seconds', 0)
+    db.fetch(select_with_criteria(sharded, {}, max_rows=5))
+    logger.stop_listeners()  # flush the queue to the file
+    entry = logs.join('slow_queries.log').read()
+    assert 'FROM "factSharded"' in entry and '5 rows' in entry
+    assert 'plan:' not in entry
+
+
+COLUMNAR = Fact(
+    table_name='factColumnar',
+    display_name='Columnar',
+    fields=[
+        Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+        ForeignKey(name='CustomerID', display_name='Customer',
+            dimension='dimCustomer', foreign_key_field='ID'),
+        Field(name='Amount', dtype=FieldType.float, display_name='Amount'),
+    ]
+)
+
+
+def test_columnar_sql_matches_sqlite_semantics():
+    star = Star(fact=COLUMNAR, dimensions=cfg.dimensions)
+    sql, params = db.columnar_sql(
+        select_with_criteria(star, {'Customer Like': 'BO'}, max_rows=10))
+    assert 'ILIKE' in sql and sql.count('?') == len(params)
+    assert params[-2:] == [10, 0]
+
+
+def test_full_text_filters_stay_on_sqlite(tmpdir, monkeypatch):
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + str(tmpdir.join('notes.db'))))
+    notes = Fact(
+        table_name='factNotes',
+        display_name='Notes',
+        fields=[
+            Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+            Field(name='Note', dtype=FieldType.str, display_name='Note',
+                filter_operators=[Operator.str_like], full_text=True),
+        ],
+        columnar='notes.duckdb'
+    )
+    star = Star(fact=notes, dimensions=[])
+    qry = select_with_criteria(star, {'Note Like': 'abc'}, max_rows=10)
+    assert db.query_option(qry, 'columnar') == 'notes.duckdb'  # no FTS table yet
+
+    db.engine.execute('CREATE VIRTUAL TABLE "factNotes_fts" USING fts5(Note)')
+    db.forget_table_names(db.engine)
+    qry = select_with_criteria(star, {'Note Like': 'ab'}, max_rows=10)
+    assert db.query_option(qry, 'columnar') == 'notes.duckdb'  # too short to MATCH
+    qry = select_with_criteria(star, {'Note Like': 'abc'}, max_rows=10)
+    assert 'MATCH' in str(qry) and db.query_option(qry, 'columnar') is None
+
+
+@pytest.fixture
+def duckdb_copy(tmpdir, monkeypatch):
+    """A DuckDB copy of factColumnar and dimCustomer"""
+    duckdb = pytest.importorskip('duckdb')
+    path = str(tmpdir.join('columnar.duckdb'))
+    con = duckdb.connect(path)
+    con.execute('CREATE TABLE dimCustomer (ID INTEGER, CustomerName VARCHAR, '
+        'ShippingAddress VARCHAR)')
+    con.execute("INSERT INTO dimCustomer VALUES (1, 'Ann', ''), (2, 'Bob', '')")
+    con.execute('CREATE TABLE factColumnar (ID INTEGER, CustomerID INTEGER, Amount DOUBLE)')
+    con.execute('INSERT INTO factColumnar SELECT i, i % 2 + 1, i FROM range(100) t(i)')
+    con.close()
+    monkeypatch.setattr(db, '_columnar_connections', {})
+    monkeypatch.setattr(COLUMNAR, 'columnar', path)
+    return Star(fact=COLUMNAR, dimensions=cfg.dimensions)
+
+
+def test_columnar_star_runs_on_duckdb(duckdb_copy):
+    star = duckdb_copy
+
+    qry = select_with_criteria(star, {'Customer Like': 'BO'}, max_rows=1000)
+    assert sorted(row[0] for row in db.fetch(qry)) == list(range(1, 100, 2))
+    with closing(db.iterbatches(qry, batch_size=20)) as results:
+        assert [len(batch) for batch in results] == [20, 20, 10]
+    totals = db.fetch(star.aggregate_query(['CustomerID'], [('count', '*')]))
+    assert [tuple(row) for row in totals] == [(1, 50), (2, 50)]
+
+
+def test_slow_columnar_query_logged_without_plan(duckdb_copy, logs, monkeypatch):
+    monkeypatch.setattr(cfg.app, 'slow_query_seconds', 0)
+    db.fetch(select_with_criteria(duckdb_copy, {'Customer Like': 'BO'}, max_rows=1000))
+    logger.stop_listeners()  # flush the queue to the file
+    entry = logs.join('slow_queries.log').read()
+    assert 'ILIKE' in entry and '50 rows' in entry
+    assert 'plan:' not in entry
+
+
+def test_columnar_star_streams_arrow(duckdb_copy):
+    pa = pytest.importorskip('pyarrow')
+    star = duckdb_copy
+
+    qry = select_with_criteria(star, {'Customer Like': 'BO'}, max_rows=1000)
+    batches = list(db.iterarrow(qry, COLUMNAR.fields, batch_size=20))
+    assert sum(batch.num_rows for batch in batches) == 50
+    assert batches[0].schema.field('ID').type == pa.int64()
@@ -0,0 +1,99 @@
+import csv
+import datetime
+import gzip
+import sqlite3
+
+import pytest
+
+from config import cfg
+import db
+from export_sinks import CsvSink, ExportSink, GzipTsvSink, SqliteSink
+from partitioned_export import export_partitioned
+from schema import Field, FieldFormat, FieldType, select_with_criteria
+
+
+@pytest.fixture(scope='module')
+def fields():
+    return [
+        Field(name='ID', dtype=FieldType.int, display_name='ID')
+        , Field(name='OrderDate', dtype=FieldType.date, display_name='Order Date')
+        , Field(name='SalesAmount', dtype=FieldType.float, display_name='Sales')
+        , Field(name='Paid', dtype=FieldType.bool, display_name='Paid?',
+                field_format=FieldFormat.str)
+    ]
+
+
+@pytest.fixture(scope='module')
+def rows():
+    return [
+        (1, datetime.date(2016, 1, 2), 10.5, 1)
+        , (2, None, 3.0, 0)
+    ]
+
+
+def headers(fields):
+    return [fld.display_name for fld in fields]
+
+
+def test_csv_sink(tmpdir, fields, rows):
+    path = str(tmpdir.join('out.csv'))
+    sink = CsvSink(path, fields=fields, headers=headers(fields))
+    sink.write_rows(rows)
+    sink.close()
+    with open(path, newline='') as fh:
+        written = list(csv.reader(fh))
+    assert sink.rows_written == 2
+    assert written == [
+        ['ID', 'Order Date', 'Sales', 'Paid?']
+        , ['1', '2016-01-02', '10.5', '1']
+        , ['2', '', '3.0', '0']
+    ]
+
+
+def test_gzip_tsv_sink(tmpdir, fields, rows):
+    path = str(tmpdir.join('out.tsv.gz'))
+    sink = GzipTsvSink(path, fields=fields, headers=headers(fields))
+    sink.write_rows(rows)
+    sink.close()
+    with gzip.open(path, 'rt', newline='') as fh:
+        written = list(csv.reader(fh, delimiter='\t'))
+    assert written[1] == ['1', '2016-01-02', '10.5', '1']
+
+
+def test_sqlite_sink(tmpdir, fields, rows):
+    path = str(tmpdir.join('out.db'))
+    sink = SqliteSink(path, fields=fields, headers=headers(fields))
+    sink.write_rows(rows)
+    sink.write_rows(rows[:1])
+    sink.close()
+    with sqlite3.connect(path) as con:
+        written = con.execute('SELECT * FROM export').fetchall()
+    assert sink.rows_written == 3
+    assert written[0] == (1, '2016-01-02', 10.5, 1)
+
+
+def test_sink_without_write_rows_cannot_be_created(tmpdir, fields):
+    class NoRowsSink(ExportSink):
+        extension = '.txt'
+
+    with pytest.raises(TypeError):
+        NoRowsSink(str(tmpdir.join('out.txt')), fields=fields, headers=[])
+
+
+def test_capped_partitioned_export_keeps_first_rows_by_key(warehouse, tmpdir):
+    star = cfg.star('factSales')
+    qry = select_with_criteria(star, {'Product Like': 'a'}, max_rows=200)
+    expected = sorted(row[0] for row in db.fetch(qry))[:50]
+
+    output, written = export_partitioned(
+        query=qry, key=star.fact.primary_key, partitions=3, sink=CsvSink,
+        output_path=str(tmpdir.join('sales.csv')), fields=star.fact.fields,
+        headers=headers(star.fact.fields), max_rows=50)
+    assert written == 50
+    with open(output, newline='') as fh:
+        assert [int(row[0]) for row in list(csv.reader(fh))[1:]] == expected
+
+
+if __name__ == '__main__':
+    pytest.main(__file__)
+
@@ -0,0 +1,38 @@
+import logging
+
+import pytest
+
+import logger
+
+
+@pytest.fixture
+def main_log(tmpdir, monkeypatch):
+    """Point the 'main' log at a temporary logs folder"""
+    monkeypatch.setattr(logger, 'rootdir', lambda: str(tmpdir))
+    monkeypatch.setattr(logger, 'DEBUG', False)
+    monkeypatch.setattr(logger, '_listeners', [])
+    monkeypatch.setattr(logging.getLogger('main'), 'handlers', [])
+    return tmpdir.join('logs', 'rotating.log')
+
+
+def test_log_error_passes_results_through_without_logging(main_log):
+    @logger.log_error
+    def add(a, b):
+        return a + b
+
+    assert add(1, b=2) == 3
+    assert not logging.getLogger('main').handlers
+    assert not main_log.exists()
+
+
+def test_log_error_logs_and_reraises(main_log):
+    @logger.log_error
+    def divide(a, b):
+        return a / b
+
+    with pytest.raises(ZeroDivisionError):
+        divide(1, 0)
+    logger.stop_listeners()
+    entry = main_log.read()
+    assert 'main.test_logger.divide - ERROR - division by zero' in entry
+    assert 'Traceback' in entry
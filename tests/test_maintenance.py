@@ -0,0 +1,288 @@
+import datetime
+import io
+
+import pytest
+from sqlalchemy import create_engine
+
+from config import cfg
+import db
+import maintenance
+from schema import (
+    Constellation, criteria_applied, Dimension, Field, FieldType, Operator,
+    select_with_criteria, SummaryField
+)
+
+
+def test_indexes_reports_then_creates(warehouse):
+    wanted = maintenance.wanted_indexes()
+    assert {spec.name for spec in maintenance.missing_indexes(warehouse, wanted)} == \
+        {spec.name for spec in wanted}
+
+    out = io.StringIO()
+    created = maintenance.indexes(create=True, out=out)
+    assert len(created) == len(wanted)
+    assert 'ix_factSales_OrderDate' in out.getvalue()
+    assert maintenance.missing_indexes(warehouse, wanted) == []
+
+
+def test_existing_index_with_same_leading_columns_counts(warehouse):
+    warehouse.execute('CREATE INDEX other ON factSales (OrderDate, SalesAmount)')
+    missing = maintenance.missing_indexes(warehouse, maintenance.wanted_indexes())
+    assert 'ix_factSales_OrderDate' not in {spec.name for spec in missing}
+
+
+def test_date_filter_uses_created_index(warehouse):
+    maintenance.indexes(create=True, out=io.StringIO())
+    plan = ' '.join(row[-1] for row in warehouse.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM factSales WHERE OrderDate >= '2016-01-01'"))
+    assert 'ix_factSales_OrderDate' in plan
+
+
+PEOPLE = Dimension(
+    table_name='dimPeople',
+    display_name='People',
+    fields=[
+        Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+        Field(name='Name', dtype=FieldType.str, display_name='Name',
+            filter_operators=[Operator.str_like], full_text=True),
+        Field(name='City', dtype=FieldType.str, display_name='City',
+            filter_operators=[Operator.str_like], full_text=True),
+    ],
+    summary_field=SummaryField(display_fields=['Name'], display_name='Person')
+)
+
+
+@pytest.fixture
+def people(tmpdir, monkeypatch):
+    """A dimension with full_text fields, built in its own database"""
+    path = str(tmpdir.join('people.db'))
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    db.engine.execute('CREATE TABLE dimPeople (ID INTEGER PRIMARY KEY, Name TEXT, City TEXT)')
+    db.engine.execute('INSERT INTO dimPeople VALUES (?, ?, ?)',
+        (1, 'Ada Lovelace', 'London'), (2, 'Alan Turing', 'Wilmslow'),
+        (3, 'Grace "Amazing" Hopper', 'Arlington'))
+    constellation = Constellation(app=cfg.app, dimensions=[PEOPLE], facts=[])
+    assert maintenance.full_text(constellation, out=io.StringIO()) == ['dimPeople_fts']
+    return PEOPLE
+
+
+def like(dim, name, value):
+    """The IDs the dimension's Like filter on the field returns"""
+    flt = next(f for f in dim.filters if f.field.name == name)
+    flt.value = value
+    try:
+        qry = dim.select()
+        return sorted(row[0] for row in db.engine.execute(qry)), str(qry)
+    finally:
+        flt.value = ''
+
+
+def test_full_text_like_matches_substrings(people):
+    ids, sql = like(people, 'Name', 'LOVE')
+    assert ids == [1]
+    assert 'MATCH' in sql
+    assert like(people, 'City', 'NGTO')[0] == [3]
+    assert like(people, 'Name', '"Amaz')[0] == [3]
+
+
+def test_full_text_short_values_fall_back_to_like(people):
+    ids, sql = like(people, 'City', 'on')
+    assert ids == [1, 3]
+    assert 'MATCH' not in sql and 'LIKE' in sql
+
+
+def test_full_text_triggers_keep_index_in_sync(people):
+    db.engine.execute("INSERT INTO dimPeople VALUES (4, 'Edsger Dijkstra', 'Nuenen')")
+    db.engine.execute("UPDATE dimPeople SET City = 'Manchester' WHERE ID = 2")
+    db.engine.execute("DELETE FROM dimPeople WHERE ID = 1")
+    assert like(people, 'Name', 'dijk')[0] == [4]
+    assert like(people, 'City', 'chester')[0] == [2]
+    assert like(people, 'City', 'slow')[0] == []
+    assert like(people, 'Name', 'love')[0] == []
+
+
+def test_full_text_without_fts_table_falls_back_to_like(tmpdir, monkeypatch):
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + str(tmpdir.join('p.db'))))
+    db.engine.execute('CREATE TABLE dimPeople (ID INTEGER PRIMARY KEY, Name TEXT, City TEXT)')
+    db.engine.execute("INSERT INTO dimPeople VALUES (1, 'Ada Lovelace', 'London')")
+    ids, sql = like(PEOPLE, 'Name', 'love')
+    assert ids == [1]
+    assert 'MATCH' not in sql and 'LIKE' in sql
+
+
+def test_full_text_reports_missing_trigram_tokenizer(people, monkeypatch):
+    ddl = maintenance.fts_ddl
+    monkeypatch.setattr(maintenance, 'fts_ddl', lambda tbl: [
+        statement.replace("tokenize='trigram'", "tokenize='missing'") for statement in ddl(tbl)])
+    out = io.StringIO()
+    constellation = Constellation(app=cfg.app, dimensions=[PEOPLE], facts=[])
+    assert maintenance.full_text(constellation, out=out) == []
+    assert "doesn't have FTS5's trigram tokenizer" in out.getvalue()
+    assert like(people, 'Name', 'love')[0] == [1]
+
+
+PLACES = Dimension(
+    table_name='dimPlaces',
+    display_name='Places',
+    fields=[
+        Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+        Field(name='Town', dtype=FieldType.str, display_name='Town'),
+        Field(name='Country', dtype=FieldType.str, display_name='Country'),
+    ],
+    summary_field=SummaryField(display_fields=['Town', 'Country'],
+        display_name='Place', separator=' - ', filter_operators=[Operator.str_like],
+        persisted_column='PlaceLabel')
+)
+
+
+@pytest.fixture
+def places(tmpdir, monkeypatch):
+    """A dimension with a persisted summary label, added by the labels command"""
+    path = str(tmpdir.join('places.db'))
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    db.engine.execute('CREATE TABLE dimPlaces (ID INTEGER PRIMARY KEY, Town TEXT, Country TEXT)')
+    db.engine.execute('INSERT INTO dimPlaces VALUES (?, ?, ?)',
+        (1, 'Lyon', 'France'), (2, 'Turin', 'Italy'))
+    constellation = Constellation(app=cfg.app, dimensions=[PLACES], facts=[])
+    assert maintenance.labels(constellation, out=io.StringIO()) == ['dimPlaces']
+    assert maintenance.missing_indexes(db.engine,
+        maintenance.wanted_indexes(constellation)) == []
+    return PLACES
+
+
+def test_labels_fills_persisted_column(places):
+    assert sorted(db.engine.execute(places.foreign_key_schema)) == \
+        [(1, 'Lyon - France'), (2, 'Turin - Italy')]
+    assert 'PlaceLabel' in str(places.foreign_key_schema)
+    assert [tuple(row) for row in db.engine.execute(places.select())][0] == \
+        (1, 'Lyon', 'France')
+
+
+def test_saved_rows_keep_persisted_label_current(places):
+    db.engine.execute(places.update_row(pk=2, values=[2, 'Milan', 'Italy']))
+    assert db.engine.execute(
+        'SELECT PlaceLabel FROM dimPlaces WHERE ID = 2').scalar() == 'Milan - Italy'
+    plan = ' '.join(row[-1] for row in db.engine.execute(
+        "EXPLAIN QUERY PLAN SELECT ID FROM dimPlaces WHERE PlaceLabel = 'Milan - Italy'"))
+    assert 'ix_dimPlaces_PlaceLabel' in plan
+
+
+def aggregate(star, group_by, aggregates, **criteria):
+    with criteria_applied(star, criteria):
+        qry = star.aggregate_query(group_by, aggregates)
+    return [tuple(row) for row in db.engine.execute(qry)], str(qry)
+
+
+def test_rollups_answer_like_the_fact(warehouse):
+    star = cfg.star('factSales')
+    fact_totals = [tuple(row) for row in warehouse.execute(
+        'SELECT ProductID, count(*), sum(SalesAmount), max(SalesAmount) '
+        'FROM factSales GROUP BY ProductID ORDER BY ProductID')]
+    written = maintenance.rollups(out=io.StringIO())
+    assert written['factSales_by_day'] > 0
+
+    rows, sql = aggregate(star, ['ProductID'],
+        [('count', '*'), ('sum', 'SalesAmount'), ('max', 'SalesAmount')])
+    assert 'factSales_by_product' in sql
+    assert [r[:2] for r in rows] == [r[:2] for r in fact_totals]
+    for row, totals in zip(rows, fact_totals):
+        assert row[2:] == pytest.approx(totals[2:])
+
+    rows, sql = aggregate(star, ['ProductID'], [('count', '*')], **{'Product Like': 'a'})
+    assert 'FROM "factSales_by_product" JOIN "dimProduct"' in sql
+    assert rows == [tuple(row) for row in warehouse.execute(
+        'SELECT ProductID, count(*) FROM factSales JOIN dimProduct ON ProductID = ID '
+        "WHERE ProductName || ' - ' || ProductCategory LIKE '%a%' "
+        'GROUP BY ProductID ORDER BY ProductID')]
+
+
+def test_rollups_refresh_incrementally(warehouse):
+    maintenance.rollups(out=io.StringIO())
+    warehouse.execute(
+        "INSERT INTO factSales (OrderID, ProductID, CustomerID, OrderDate, "
+        "ShippingDate, SalesAmount, Paid) "
+        "VALUES (100001, 1, 1, '2001-02-03', '2001-02-04', 10.5, 1), "
+        "(100002, 1, 2, '2001-02-03', '2001-02-05', 4.5, 0)")
+    assert maintenance.rollups(out=io.StringIO())['factSales_by_day'] == 1
+
+    star = cfg.star('factSales')
+    rows, sql = aggregate(star, ['OrderDate'], [('sum', 'SalesAmount'), ('count', '*')],
+        **{'Order Date On or After': '2001-02-03', 'Order Date On or Before': '2001-02-03'})
+    assert 'factSales_by_day' in sql
+    assert rows == [(datetime.date(2001, 2, 3), 15.0, 2)]
+
+
+def test_uncovered_aggregates_read_the_fact(warehouse):
+    maintenance.rollups(out=io.StringIO())
+    star = cfg.star('factSales')
+    rows, sql = aggregate(star, ['Paid'], [('count', '*')])
+    assert 'FROM "factSales" JOIN' in sql
+    assert sum(count for _, count in rows) == 200
+    _, sql = aggregate(star, ['OrderDate'], [('count', '*')],
+        **{'Sales Amount Equals': '10'})
+    assert 'FROM "factSales" JOIN' in sql
+
+
+def test_rollups_group_dates_by_day(warehouse):
+    maintenance.rollups(out=io.StringIO())
+    days = warehouse.execute('SELECT count(DISTINCT date(OrderDate)) FROM factSales').scalar()
+    assert warehouse.execute('SELECT count(*) FROM "factSales_by_day"').scalar() == days
+
+    star = cfg.star('factSales')
+    rows, sql = aggregate(star, ['OrderDate'], [('count', '*')])
+    assert 'factSales_by_day' in sql and len(rows) == days
+    for rollup in star.fact.rollups:
+        warehouse.execute('DROP TABLE "{}"'.format(rollup.table_name))
+    fact_rows, sql = aggregate(star, ['OrderDate'], [('count', '*')])
+    assert 'FROM "factSales" JOIN' in sql
+    assert fact_rows == rows
+
+
+def test_incremental_refresh_matches_a_rebuild(warehouse):
+    maintenance.rollups(out=io.StringIO())
+    warehouse.execute(
+        'INSERT INTO factSales (OrderID, ProductID, CustomerID, OrderDate, '
+        'ShippingDate, SalesAmount, Paid) '
+        'SELECT OrderID + 1000, ProductID, CustomerID, OrderDate, ShippingDate, '
+        'SalesAmount * 2, Paid FROM factSales WHERE OrderID <= 50')
+    maintenance.rollups(out=io.StringIO())
+    incremental = sorted(tuple(row) for row in
+        warehouse.execute('SELECT * FROM "factSales_by_product"'))
+    maintenance.rollups(full=True, out=io.StringIO())
+    rebuilt = sorted(tuple(row) for row in
+        warehouse.execute('SELECT * FROM "factSales_by_product"'))
+    assert len(incremental) == len(rebuilt)
+    for row, expected in zip(incremental, rebuilt):
+        assert row == pytest.approx(expected)
+
+
+def test_stale_or_missing_rollups_are_not_read(warehouse):
+    star = cfg.star('factSales')
+    _, sql = aggregate(star, ['OrderDate'], [('count', '*')])
+    assert 'FROM "factSales" JOIN' in sql
+
+    maintenance.rollups(out=io.StringIO())
+    warehouse.execute(
+        "INSERT INTO factSales (OrderID, ProductID, CustomerID, OrderDate, "
+        "ShippingDate, SalesAmount, Paid) "
+        "VALUES (100001, 1, 1, '2001-02-03', '2001-02-04', 10.5, 1)")
+    rows, sql = aggregate(star, [], [('count', '*')])
+    assert 'FROM "factSales" JOIN' in sql and rows == [(201,)]
+    maintenance.rollups(out=io.StringIO())
+    rows, sql = aggregate(star, [], [('count', '*')])
+    assert 'factSales_by_day' in sql and rows == [(201,)]
+
+
+def test_columnar_copy_answers_like_sqlite(warehouse, tmpdir, monkeypatch):
+    pytest.importorskip('duckdb')
+    criteria = {'Order Date On or After': '2016-06-01', 'Product Like': 'a'}
+    star = cfg.star('factSales')
+    expected = sorted(tuple(row) for row in db.fetch(
+        select_with_criteria(star, criteria, max_rows=1000)))
+
+    monkeypatch.setattr(db, '_columnar_connections', {})
+    monkeypatch.setattr(star.fact, 'columnar', str(tmpdir.mkdir('parquet')))
+    assert maintenance.columnar(out=io.StringIO()) == ['factSales']
+    qry = select_with_criteria(star, criteria, max_rows=1000)
+    assert qry.get_execution_options()['columnar'] == star.fact.columnar
+    assert sorted(tuple(row) for row in db.fetch(qry)) == expected
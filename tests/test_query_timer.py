@@ -0,0 +1,77 @@
+from contextlib import closing
+import datetime
+import json
+
+import pytest
+from sqlalchemy import Date, column, create_engine, literal, select, table, text
+
+import db
+import logger
+from query_timer import QueryTimer
+
+
+@pytest.fixture
+def memory_db(tmpdir, monkeypatch):
+    """An in-memory database, with any logs it writes kept in tmpdir"""
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite://'))
+    monkeypatch.setattr(logger, 'rootdir', lambda: str(tmpdir))
+    monkeypatch.setattr(logger, '_listeners', [])
+    for name in ('main', 'slow_queries'):
+        monkeypatch.setattr(logger.logging.getLogger(name), 'handlers', [])
+    yield
+    logger.stop_listeners()
+
+
+def test_fetch_records_stages(memory_db):
+    timer = QueryTimer('pull', 'test')
+    rows = db.fetch(select([literal(1)]), timer=timer)
+    assert [tuple(r) for r in rows] == [(1,)]
+    assert list(timer.stages) == ['compile', 'execute', 'first_row', 'fetch']
+
+
+def test_iterbatches_records_stages(memory_db):
+    timer = QueryTimer('export', 'test')
+    qry = select([text('*')]).select_from(text(
+        '(WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 25) '
+        'SELECT x FROM n)'))
+    with closing(db.iterbatches(qry, batch_size=10, timer=timer)) as results:
+        assert [len(b) for b in results] == [10, 10, 5]
+    assert list(timer.stages) == ['compile', 'execute', 'first_row', 'fetch']
+
+
+def test_log_writes_json_record(tmpdir, monkeypatch):
+    monkeypatch.setattr(logger, 'rootdir', lambda: str(tmpdir))
+    log = logger.logging.getLogger('timings')
+    monkeypatch.setattr(log, 'handlers', [])
+    monkeypatch.setattr(logger, '_listeners', [])
+    timer = QueryTimer('pull', 'factSales')
+    timer.rows = 3
+    timer.add('model', 0.01)
+    timer.log()
+    logger.stop_listeners()  # flush the queue to the file
+    record = json.loads(tmpdir.join('logs', 'timings.log').read().splitlines()[-1])
+    assert record['table'] == 'factSales'
+    assert record['rows'] == 3
+    assert record['stages'] == {'model': 0.01}
+
+
+def test_slow_query_logged_with_plan(memory_db, tmpdir, monkeypatch):
+    path = str(tmpdir.join('slow.db'))
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    db.engine.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, day DATE)')
+    monkeypatch.setattr(db.cfg.app, 'slow_query_seconds', 0)
+    tbl = table('t', column('id'), column('day', Date))
+    qry = select([tbl.c.id]).where(tbl.c.day >= datetime.date(2016, 1, 1))
+    db.fetch(qry)
+    logger.stop_listeners()  # flush the queue to the file
+    entry = tmpdir.join('logs', 'slow_queries.log').read()
+    assert 'WHERE t.day >= ?' in entry
+    assert 'datetime.date(2016, 1, 1)' in entry
+    assert 'SCAN' in entry
+
+
+def test_bound_parameters_are_processed_for_the_driver():
+    tbl = table('t', column('id'), column('day', Date))
+    qry = select([tbl.c.id]).where(tbl.c.day >= datetime.date(2016, 1, 1)).limit(5)
+    compiled = qry.compile(dialect=create_engine('sqlite://').dialect)
+    assert db.bound_parameters(compiled) == ['2016-01-01', 5, 0]
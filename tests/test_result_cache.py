@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from config import cfg
+import db
+import result_cache
+from result_cache import cache_key, ResultCache
+from schema import Field, FieldType, select_with_criteria
+
+
+FIELDS = cfg.table('factSales').fields
+
+
+def sales(**criteria):
+    return select_with_criteria(cfg.star('factSales'), criteria, max_rows=1000)
+
+
+def test_key_follows_filters_and_data_version(warehouse):
+    key = cache_key(sales(), 'factSales', FIELDS)
+    assert key == cache_key(sales(), 'factSales', FIELDS)
+    assert key != cache_key(sales(**{'Order Date On or After': '2016-06-01'}), 'factSales',
+        FIELDS)
+
+    warehouse.execute('UPDATE factSales SET SalesAmount = SalesAmount + 1 WHERE OrderID = 1')
+    os.utime(str(warehouse.url.database), ns=(0, 0))  # a write within the same tick
+    assert cache_key(sales(), 'factSales', FIELDS) != key
+
+
+def test_key_follows_the_fields(warehouse):
+    key = cache_key(sales(), 'factSales', FIELDS)
+    renamed = [Field(name='Amount', dtype=fld.dtype, display_name=fld.display_name)
+        if fld.name == 'SalesAmount' else fld for fld in FIELDS]
+    retyped = [Field(name=fld.name, dtype=FieldType.str, display_name=fld.display_name)
+        if fld.name == 'SalesAmount' else fld for fld in FIELDS]
+    assert len({key, cache_key(sales(), 'factSales', renamed),
+        cache_key(sales(), 'factSales', retyped)}) == 3
+
+
+def test_cache_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(result_cache, '_cache', None)
+    assert not cfg.app.result_cache_folder
+    assert result_cache.get_cache() is None
+
+
+def test_cached_rows_are_memory_mapped(warehouse, tmpdir, monkeypatch):
+    monkeypatch.setattr(cfg.app, 'result_cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(result_cache, '_cache', None)
+    fields = cfg.table('factSales').fields
+    qry = sales(**{'Order Date On or After': '2016-06-01'})
+
+    key, rows = result_cache.cached_rows(qry, 'factSales', fields)
+    assert key and rows is None
+    expected = db.fetch_arrow(qry, fields)
+    result_cache.store_rows(key, expected)
+
+    allocated = pa.total_allocated_bytes()
+    key, rows = result_cache.cached_rows(qry, 'factSales', fields)
+    assert pa.total_allocated_bytes() - allocated < expected.table.nbytes  # not copied
+    assert rows.table.equals(expected.table)
+
+
+def test_least_recently_used_results_are_evicted(warehouse, tmpdir):
+    fields = cfg.table('factSales').fields
+    rows = db.fetch_arrow(sales(), fields)
+    cache = ResultCache(str(tmpdir.join('cache')), max_bytes=10 ** 9)
+    for key in 'abc':
+        cache.put(key, rows)
+    for key, when in zip('abc', [1, 3, 2]):
+        os.utime(cache.path(key), (when, when))
+    assert cache.get('a') is not None  # a hit makes it the most recent
+
+    cache.max_bytes = os.path.getsize(cache.path('a')) * 2
+    assert cache.evict() == [cache.path('c')]
+    assert cache.get('c') is None and len(cache.get('b')) == len(rows)
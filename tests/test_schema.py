@@ -0,0 +1,241 @@
+import datetime
+import sqlite3
+
+import pytest
+import sqlalchemy as sqa
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import SingletonThreadPool
+
+from config import cfg
+import db
+from schema import (
+    Constellation, convert_rows, Fact, Field, FieldFormat, FieldType, Filter,
+    ForeignKey, Operator, Partitioning, select_with_criteria, Star
+)
+
+
+@pytest.fixture(scope='module')
+def fields():
+    return [
+        Field(name='ID', dtype=FieldType.int, display_name='ID')
+        , Field(name='OrderDate', dtype=FieldType.date, display_name='Order Date')
+        , Field(name='SalesAmount', dtype=FieldType.float, display_name='Sales')
+        , Field(name='Paid', dtype=FieldType.bool, display_name='Paid?',
+                field_format=FieldFormat.str)
+        , Field(name='Name', dtype=FieldType.str, display_name='Name')
+    ]
+
+
+@pytest.mark.parametrize('dtype, values', [
+    (FieldType.int, [1, '2', None, 0])
+    , (FieldType.float, [1.5, '2.25', None, 0])
+    , (FieldType.str, ['a', 1, None, ''])
+    , (FieldType.date, ['2016-01-02 10:11:12', datetime.date(2016, 1, 2),
+                        datetime.datetime(2016, 1, 2, 3, 4), None, ''])
+    , (FieldType.bool, [1, 0, '1', '0', 'True', 'false', None])
+])
+def test_convert_column_matches_convert(dtype, values):
+    assert dtype.convert_column(values) == [dtype.convert(v) for v in values]
+
+
+def test_convert_column_invalid_date():
+    with pytest.raises(ValueError):
+        FieldType.date.convert_column(['not a date'])
+    with pytest.raises(ValueError):
+        FieldType.date.convert_column(['2016-01-02', 'abcd-ef-gh'])
+
+
+def test_convert_rows(fields):
+    rows = [
+        (1, '2016-01-02 00:00:00', '10.5', '0', 'x')
+        , (2, None, None, 1, None)
+    ]
+    assert convert_rows(fields, rows) == [
+        [1, '2016-01-02', 10.5, False, 'x']
+        , [2, '', 0.0, True, '']
+    ]
+
+
+def test_convert_rows_empty(fields):
+    assert convert_rows(fields, []) == []
+
+
+def test_select_with_criteria_restores_filters():
+    star = cfg.star('factSales')
+    flt = next(f for f in star.filters if f.display_name == 'Sales Amount Equals')
+    flt.value = '5'
+    qry = select_with_criteria(star, {'Sales Amount Equals': '3'}, max_rows=10)
+    assert qry.compile().params['SalesAmount_1'] == 3.0
+    assert flt.value == 5.0
+    flt.value = ''
+
+
+def test_select_with_criteria_unknown_filter():
+    with pytest.raises(KeyError) as err:
+        select_with_criteria(cfg.star('factSales'), {'Paid': '1'}, max_rows=10)
+    assert "['Paid']" in str(err.value) and 'Product Like' in str(err.value)
+
+
+
+def test_prefetch_foreign_keys(tmpdir, monkeypatch):
+    path = str(tmpdir.join('dims.db'))
+    with sqlite3.connect(path) as con:
+        for dim in cfg.dimensions:
+            con.execute('CREATE TABLE {} ({})'.format(
+                dim.table_name, ', '.join(fld.name for fld in dim.fields)))
+            con.execute('INSERT INTO {} VALUES ({})'.format(
+                dim.table_name, ', '.join(['1'] + ["'x'"] * (len(dim.fields) - 1))))
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    constellation = Constellation(app=cfg.app, dimensions=cfg.dimensions, facts=cfg.facts)
+    pulled = []
+    pull = constellation.pull_foreign_keys
+    monkeypatch.setattr(constellation, 'pull_foreign_keys',
+        lambda dim: pulled.append(dim) or pull(dim))
+    constellation.prefetch_foreign_keys()
+    for dim in cfg.dimensions:
+        assert 1 in constellation.foreign_keys(dim.table_name)
+    assert sorted(pulled) == sorted(dim.table_name for dim in cfg.dimensions)
+
+
+@pytest.mark.parametrize('operator, expected', [
+    (Operator.date_after, lambda day: day > '2016-01-02'),
+    (Operator.date_on_or_after, lambda day: day >= '2016-01-02'),
+    (Operator.date_before, lambda day: day < '2016-01-02'),
+    (Operator.date_on_or_before, lambda day: day <= '2016-01-02'),
+    (Operator.date_equals, lambda day: day == '2016-01-02'),
+    (Operator.date_does_not_equal, lambda day: day != '2016-01-02'),
+])
+def test_date_filters_are_sargable(operator, expected):
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE t (ID INTEGER PRIMARY KEY, OrderDate DATETIME)')
+    engine.execute('CREATE INDEX ix_t_OrderDate ON t (OrderDate)')
+    stamps = ['2016-01-01 23:59:59', '2016-01-02', '2016-01-02 00:00:00',
+              '2016-01-02 12:30:00', '2016-01-03 00:00:00', '2016-01-03']
+    engine.execute('INSERT INTO t VALUES (?, ?)', *enumerate(stamps))
+    fld = Field(name='OrderDate', dtype=FieldType.date, display_name='Order Date')
+    flt = Filter(field=fld, operator=operator)
+    flt.value = '2016-01-02'
+    tbl = sqa.table('t', sqa.column('ID'), fld.schema)
+    qry = sqa.select([tbl.c.ID]).where(flt.filter)
+
+    sql = str(qry.compile(dialect=engine.dialect))
+    assert 'date(' not in sql
+    assert sorted(row[0] for row in engine.execute(qry)) == \
+        [i for i, stamp in enumerate(stamps) if expected(stamp[:10])]
+    if operator != Operator.date_does_not_equal:
+        plan = ' '.join(str(row[-1]) for row in engine.execute(
+            'EXPLAIN QUERY PLAN ' + sql, *qry.compile(dialect=engine.dialect).params.values()))
+        assert 'ix_t_OrderDate' in plan
+
+
+def monthly_fact(table_name, last_month='2016-03', **partitioning):
+    return Fact(
+        table_name=table_name,
+        display_name=table_name,
+        fields=[
+            Field(name='ID', dtype=FieldType.int, display_name='ID', primary_key=True),
+            ForeignKey(name='CustomerID', display_name='Customer',
+                dimension='dimCustomer', foreign_key_field='ID'),
+            Field(name='OrderDate', dtype=FieldType.date, display_name='Order Date',
+                filter_operators=[Operator.date_on_or_after, Operator.date_before]),
+        ],
+        partitioning=Partitioning(field='OrderDate', first_month='2016-01',
+            last_month=last_month, **partitioning)
+    )
+
+
+MONTHLY = monthly_fact('factMonthly')
+
+
+def load_month(con, table, month):
+    con.execute('CREATE TABLE "{}" (ID INTEGER PRIMARY KEY, CustomerID INTEGER, '
+        'OrderDate DATE)'.format(table))
+    con.execute('CREATE INDEX "ix_{0}_OrderDate" ON "{0}" (OrderDate)'.format(table))
+    con.executemany('INSERT INTO "{}" VALUES (?, ?, ?)'.format(table), [
+        (month * 100 + day, day, '2016-{:02d}-{:02d}'.format(month, day))
+        for day in (1, 15)
+    ])
+
+
+@pytest.fixture
+def monthly(tmpdir, monkeypatch):
+    path = str(tmpdir.join('monthly.db'))
+    with sqlite3.connect(path) as con:
+        con.execute('CREATE TABLE dimCustomer (ID INTEGER PRIMARY KEY, '
+            'CustomerName TEXT, ShippingAddress TEXT)')
+        con.executemany('INSERT INTO dimCustomer VALUES (?, ?, ?)',
+            [(1, 'Ann', ''), (15, 'Bob', '')])
+        for month in (1, 2, 3):
+            load_month(con, 'factMonthly_2016{:02d}'.format(month), month)
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    return Star(fact=MONTHLY, dimensions=cfg.dimensions)
+
+
+def ids(star, **criteria):
+    qry = select_with_criteria(star, criteria, max_rows=100)
+    return sorted(row[0] for row in db.get_engine().execute(qry)), str(qry)
+
+
+def test_partitioned_star_reads_only_the_filtered_months(monthly):
+    rows, sql = ids(monthly, **{'Order Date On or After': '2016-02-10'})
+    assert rows == [215, 301, 315]
+    assert 'factMonthly_201601' not in sql and 'factMonthly_201602' in sql
+    rows, sql = ids(monthly, **{'Order Date Before': '2016-02-01'})
+    assert rows == [101, 115]
+    assert 'factMonthly_201601' in sql and 'factMonthly_201602' not in sql
+
+
+def test_partitioned_star_with_dimension_filter(monthly):
+    assert ids(monthly)[0] == [101, 115, 201, 215, 301, 315]
+    assert ids(monthly, **{'Customer Like': 'bo'})[0] == [115, 215, 315]
+    assert ids(monthly, **{'Order Date Before': '2015-06-01'})[0] == []
+
+
+def test_partitioned_star_uses_each_partitions_index(monthly):
+    qry = select_with_criteria(monthly, {'Order Date On or After': '2016-02-10'}, 100)
+    compiled = qry.compile(dialect=db.engine.dialect)
+    plan = ' '.join(row[-1] for row in db.engine.execute(
+        'EXPLAIN QUERY PLAN ' + str(compiled), *compiled.params.values()))
+    assert 'ix_factMonthly_201602_OrderDate' in plan
+    assert 'ix_factMonthly_201603_OrderDate' in plan
+
+
+def test_partition_files_are_attached(tmpdir, monkeypatch):
+    fact = monthly_fact('factArchive', database=str(tmpdir.join('archive_{:%Y%m}.db')))
+    for month in (1, 2, 3):
+        with sqlite3.connect(str(tmpdir.join('archive_2016{:02d}.db'.format(month)))) as con:
+            load_month(con, 'factArchive', month)
+    monkeypatch.setattr(cfg, 'facts', [fact])
+    monkeypatch.setattr(cfg.app, 'db_path', 'sqlite:///' + str(tmpdir.join('main.db')))
+    monkeypatch.setattr(db, 'engine', None)
+    star = Star(fact=fact, dimensions=[])
+    rows, sql = ids(star, **{'Order Date On or After': '2016-03-01'})
+    assert rows == [301, 315]
+    assert '"factArchive_201603"."factArchive"' in sql
+
+
+def test_only_the_months_read_are_attached(tmpdir, monkeypatch):
+    fact = monthly_fact('factYearly', last_month='2016-12',
+        database=str(tmpdir.join('yearly_{:%Y%m}.db')))
+    for month in range(1, 13):
+        with sqlite3.connect(str(tmpdir.join('yearly_2016{:02d}.db'.format(month)))) as con:
+            load_month(con, 'factYearly', month)
+    monkeypatch.setattr(cfg, 'facts', [fact])
+    engine = create_engine('sqlite:///' + str(tmpdir.join('main.db')),
+        poolclass=SingletonThreadPool)
+    event.listen(engine, 'before_execute', db.attach_partitions)
+    monkeypatch.setattr(db, 'engine', engine)
+    star = Star(fact=fact, dimensions=[])
+
+    assert ids(star, **{'Order Date Before': '2016-09-01'})[0] == \
+        [month * 100 + day for month in range(1, 9) for day in (1, 15)]
+    assert ids(star, **{'Order Date On or After': '2016-07-01'})[0] == \
+        [month * 100 + day for month in range(7, 13) for day in (1, 15)]
+    attached = {row[1] for row in engine.execute('PRAGMA database_list')}
+    assert len(attached - {'main', 'temp'}) <= db.MAX_ATTACHED
+    with pytest.raises(ValueError, match='narrow its date filters'):
+        ids(star)
+
+
+if __name__ == '__main__':
+    pytest.main(__file__)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from config import cfg
+import db
+import result_cache
+from server import QueryService
+
+
+@pytest.fixture
+def sales_db(tmpdir, monkeypatch):
+    path = str(tmpdir.join('sales.db'))
+    with sqlite3.connect(path) as con:
+        con.execute("CREATE TABLE dimProduct (ID INTEGER PRIMARY KEY, ProductName, ProductCategory)")
+        con.execute("CREATE TABLE dimCustomer (ID INTEGER PRIMARY KEY, CustomerName, ShippingAddress)")
+        con.execute("""
+            CREATE TABLE factSales (OrderID INTEGER PRIMARY KEY, ProductID, CustomerID
+                , OrderDate, ShippingDate, SalesAmount, Paid)
+        """)
+        con.execute("INSERT INTO dimProduct VALUES (1, 'Shoes', 'Clothing')")
+        con.execute("INSERT INTO dimCustomer VALUES (1, 'Bob', '1 Main St')")
+        con.executemany(
+            "INSERT INTO factSales VALUES (?, 1, 1, '2016-01-02 00:00:00', NULL, ?, 1)",
+            [(i, i * 10.0) for i in range(1, 6)]
+        )
+    monkeypatch.setattr(db, 'engine', create_engine('sqlite:///' + path))
+    return path
+
+
+def get(path, service=None):
+    """Start a service on a free localhost port and GET the path from it"""
+    async def go():
+        server = await (service or QueryService()).start('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    loop = asyncio.new_event_loop()
+    try:
+        head, _, body = loop.run_until_complete(go()).partition(b'\r\n\r\n')
+    finally:
+        loop.close()
+    return int(head.split()[1]), body.decode('utf-8')
+
+
+def test_stars():
+    status, body = get('/stars')
+    assert status == 200
+    stars = json.loads(body)
+    assert [s['name'] for s in stars] == ['factSales']
+    assert 'Order Date On or After' in stars[0]['filters']
+
+
+def test_unknown_star():
+    status, _ = get('/stars/nope/filters')
+    assert status == 404
+
+
+def test_unknown_filter(sales_db):
+    status, body = get('/stars/factSales/rows?Nope=1')
+    assert status == 400
+
+
+def test_rows_page(sales_db):
+    status, body = get('/stars/factSales/rows?limit=2&offset=1')
+    assert status == 200
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [r['OrderID'] for r in rows] == [2, 3]
+
+
+def test_rows_stream_csv(sales_db):
+    status, body = get('/stars/factSales/rows?format=csv&Sales%20Amount%20Equals=30')
+    assert status == 200
+    lines = body.splitlines()
+    assert lines[0].startswith('OrderID,ProductID')
+    assert len(lines) == 2 and lines[1].startswith('3,')
+
+
+def test_pages_see_writes_between_requests(sales_db):
+    service = QueryService()
+    _, body = get('/stars/factSales/rows?limit=1', service)
+    assert json.loads(body)['SalesAmount'] == 10.0
+    with sqlite3.connect(sales_db) as con:
+        con.execute('UPDATE factSales SET SalesAmount = 15 WHERE OrderID = 1')
+    _, body = get('/stars/factSales/rows?limit=1', service)
+    assert json.loads(body)['SalesAmount'] == 15.0
+
+
+def test_pages_are_shared_through_the_result_cache(sales_db, tmpdir, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(cfg.app, 'result_cache_folder', str(tmpdir.join('cache')))
+    monkeypatch.setattr(result_cache, '_cache', None)
+    service = QueryService()
+    _, body = get('/stars/factSales/rows?limit=2&offset=1', service)
+    assert len(result_cache.get_cache().files()) == 1
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert [(r['OrderID'], r['OrderDate'], r['ShippingDate']) for r in rows] == \
+        [(2, '2016-01-02', None), (3, '2016-01-02', None)]
+    assert get('/stars/factSales/rows?limit=2&offset=1', service)[1] == body
+
+
+@pytest.mark.parametrize('query', ['limit=2', 'format=csv'])
+def test_failed_query_gets_an_error_status(sales_db, query):
+    with sqlite3.connect(sales_db) as con:
+        con.execute('DROP TABLE factSales')
+    status, body = get('/stars/factSales/rows?' + query)
+    assert status == 500
+    assert 'HTTP/1.1' not in body and 'no such table' in json.loads(body)['error']
+
+
+if __name__ == '__main__':
+    pytest.main(__file__)
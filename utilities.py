@@ -86,7 +86,7 @@ def delete_old_outputs(path: str):
     If a file is open it will trigger an OS Error,
     but we ignore it.  The file will get deleted later.
     """
-    pattern = r'^temp_\d{4}-\d{2}-\d{2}[.]\d{6}.xls$'
+    pattern = r'^temp_\d{4}-\d{2}-\d{2}[.]\d{6}[.]xlsx?$'
     for root, dirs, files in os.walk(path):
         for f in files:
             match = re.search(pattern, f)
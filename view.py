@@ -8,10 +8,10 @@ import time
 from typing import Dict, List
 
 from PyQt4 import QtCore, QtGui
-import xlwt
 
 from checkbox_delegate import CheckBoxDelegate
 from config import cfg
+from export_sinks import SINKS, XlsxSink
 from foreign_key_delegate import ForeignKeyDelegate
 from logger import log_error
 from model import AbstractModel
@@ -108,7 +108,9 @@ class DatasheetView(QtGui.QWidget):
         self.btn_save.clicked.connect(self.save)
         self.model.layoutChanged.connect(self.table.resizeColumnsToContents)
         self.model.query_manager.exporter.signals.rows_exported.connect(self.show_rows_exported)
+        self.model.query_manager.exporter.signals.exported_msg.connect(self.set_status)
         self.model.query_manager.runner.signals.rows_returned_msg.connect(self.show_rows_returned)
+        self.model.query_manager.timings_signal.connect(self.set_status)
         # self.model.layoutChanged.connect(self.open_comboboxes)
         # self.model.rows_fetched_signal.connect(self.open_comboboxes)
         self.query_designer.add_criteria_signal.connect(self.add_query_criteria)
@@ -127,13 +129,14 @@ class DatasheetView(QtGui.QWidget):
 
     def add_foreign_key_comboboxes(self) -> None:
         if self.model.query_manager.table.editable:
-            for key, val in self.model.foreign_keys.items():
-                dim = self.model.query_manager.table.foreign_keys[key].dimension
+            # the delegates look the lookups up when an editor opens, so
+            # there's no need to pull them here
+            for key, fld in self.model.query_manager.table.foreign_keys.items():
                 self.table.setItemDelegateForColumn(
                     key,
                     ForeignKeyDelegate(
                         model=self.model,
-                        dimension=dim
+                        dimension=fld.dimension
                     )
                 )
 
@@ -143,12 +146,13 @@ class DatasheetView(QtGui.QWidget):
     def exit(self):
         self.stop_everything.emit()
 
-    def export_all(self) -> None:
-        self.model.query_manager.export()
+    def export_all(self, export_format: str) -> None:
+        self.model.query_manager.export(export_format=export_format)
 
     def export_visible(self) -> None:
         self.to_excel(
             data=self.model.visible_data,
+            fields=self.model.query_manager.table.fields,
             header=self.model.query_manager.headers
         )
 
@@ -433,7 +437,7 @@ class DatasheetView(QtGui.QWidget):
     def outside_error(self, msg):
         self.set_status(msg)
 
-    def to_excel(self, data, header):
+    def to_excel(self, data, fields, header):
         """Save displayed items to Excel file."""
 
         if not data:
@@ -442,20 +446,14 @@ class DatasheetView(QtGui.QWidget):
         folder = 'output'
         if not os.path.exists(folder) or not os.path.isdir(folder):
             os.mkdir(folder)
-        wb = xlwt.Workbook()
-        sht = wb.add_sheet('temp', cell_overwrite_ok=True)
-        header_style = xlwt.easyxf(
-            'pattern: pattern solid, fore_colour dark_blue;'
-            'font: colour white, bold True;'
-        )
-        [sht.write(0, i, x, header_style) for i, x in enumerate(header)]
-        for i, row in enumerate(data):
-            for j, col in enumerate(data[i]):
-                sht.write(i + 1, j, col)
         t = time.strftime("%Y-%m-%d.%H%M%S")
-        dest = os.path.join(folder, 'temp_{}.xls'.format(t))
+        dest = os.path.join(folder, 'temp_{}{}'.format(t, XlsxSink.extension))
         delete_old_outputs(folder)
-        wb.save(dest)
+        sink = XlsxSink(dest, fields=fields, headers=header)
+        try:
+            sink.write_rows(data)
+        finally:
+            sink.close()
         Popen(dest, shell=True)
 
     def reset_query(self):
@@ -490,9 +488,10 @@ class DatasheetView(QtGui.QWidget):
         self.layout.addLayout(self.query_designer, 0, 0, 1, 1, QtCore.Qt.AlignTop)
         self.layout.setColumnStretch(0, 1)
 
-    @QtCore.pyqtSlot(int)
-    def show_rows_exported(self, msg):
-        self.set_status('Rows exported {}...'.format(msg))
+    @QtCore.pyqtSlot(int, float)
+    def show_rows_exported(self, rows, rows_per_second):
+        self.set_status('Rows exported {:,} ({:,.0f} rows/sec)...'.format(
+            rows, rows_per_second))
 
     @QtCore.pyqtSlot(str)
     def show_rows_returned(self, msg):
@@ -511,7 +510,7 @@ class QueryDesigner(QtGui.QWidget):
 
     add_criteria_signal = QtCore.pyqtSignal(int, str)
     error_signal = QtCore.pyqtSignal()
-    export_signal = QtCore.pyqtSignal()
+    export_signal = QtCore.pyqtSignal(str)
     pull_signal = QtCore.pyqtSignal()
     reset_signal = QtCore.pyqtSignal()
     stop_export_signal = QtCore.pyqtSignal()
@@ -567,8 +566,16 @@ class QueryDesigner(QtGui.QWidget):
 
         export_btn_txt = 'Export'
         self.btn_export = QtGui.QPushButton(export_btn_txt)
-        self.btn_export.clicked.connect(self.export_signal.emit)
+        self.btn_export.clicked.connect(self.export)
         self.layout.addWidget(self.btn_export, self._current_row, 1, 1, 1)
+        self._current_row += 1
+
+        self.cbo_export_format = QtGui.QComboBox()
+        self.cbo_export_format.addItems(list(SINKS.keys()))
+        self.layout.addWidget(self.cbo_export_format, self._current_row, 1, 1, 1)
+
+    def export(self) -> None:
+        self.export_signal.emit(self.cbo_export_format.currentText())
 
     def reset(self):
         for val in self.query_controls.values():
@@ -588,19 +595,25 @@ class MainView(QtGui.QDialog):
         )
 
         self.config_popup = None
-        self.datasheet_controls = []
+        self.datasheet_controls = {}  # type: Dict[int, DatasheetView]
         self.query_designer_visibility = True
 
         app_name = cfg.app.display_name
 
         self.setWindowTitle(app_name)
 
-        tabs = QtGui.QTabWidget()
+        # Each tab starts as an empty page and gets its DatasheetView the
+        # first time it is shown, while the foreign key lookups are pulled
+        # in the background.
+        self.tabs = QtGui.QTabWidget()
         for tbl in cfg.tables:
-            ds = DatasheetView(table=tbl)
-            self.datasheet_controls.append(ds)
-            # self.exit_signal.connect(ds.exit_signal.emit)
-            tabs.addTab(ds, tbl.display_name)
+            page = QtGui.QWidget()
+            page.setLayout(QtGui.QVBoxLayout())
+            page.layout().setContentsMargins(0, 0, 0, 0)
+            self.tabs.addTab(page, tbl.display_name)
+        self.tabs.currentChanged.connect(self.build_tab)
+        self.build_tab(self.tabs.currentIndex())
+        cfg.prefetch_foreign_keys()
 
         mainLayout = QtGui.QVBoxLayout()
         menubar = QtGui.QMenuBar()
@@ -622,9 +635,18 @@ class MainView(QtGui.QDialog):
         filemenu = menubar.addMenu('&View')
         filemenu.addAction('Toggle Query Designer', self.toggle_query_designer)
 
-        mainLayout.addWidget(tabs)
+        mainLayout.addWidget(self.tabs)
         self.setLayout(mainLayout)
 
+    def build_tab(self, ix: int) -> None:
+        if ix < 0 or ix in self.datasheet_controls:
+            return
+        ds = DatasheetView(table=cfg.tables[ix])
+        # self.exit_signal.connect(ds.exit_signal.emit)
+        self.set_query_designer_visibility(ds, self.query_designer_visibility)
+        self.tabs.widget(ix).layout().addWidget(ds)
+        self.datasheet_controls[ix] = ds
+
     def open_output_folder(self):
         folder = os.path.join(rootdir(), 'output')
         if not os.path.exists(folder) or not os.path.isdir(folder):
@@ -636,17 +658,16 @@ class MainView(QtGui.QDialog):
     #     # self.config_popup.setGeometry(QtCore.QRect(100, 100, 400, 200))
     #     self.config_popup.show()
 
+    @staticmethod
+    def set_query_designer_visibility(ds: DatasheetView, visible: bool) -> None:
+        ds.layout.setColumnStretch(0, 1 if visible else 0)
+        ds.query_designer.setVisible(visible)
+
     def toggle_query_designer(self):
-        if self.query_designer_visibility:
-            for ds in self.datasheet_controls:
-                ds.layout.setColumnStretch(0, 0)
-                ds.query_designer.hide()
-                self.query_designer_visibility = False
-        else:
-            for ds in self.datasheet_controls:
-                ds.layout.setColumnStretch(0, 1)
-                ds.query_designer.show()
-                self.query_designer_visibility = True
+        """Tabs that haven't been built yet pick the setting up when they are"""
+        self.query_designer_visibility = not self.query_designer_visibility
+        for ds in self.datasheet_controls.values():
+            self.set_query_designer_visibility(ds, self.query_designer_visibility)
 
 
 # class ConfigPopup(QtGui.QWidget):